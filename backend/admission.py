@@ -0,0 +1,216 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+from starlette.routing import compile_path
+
+from sessions import InvalidSession
+
+# Route templates by cost class; anything not listed is "standard".
+# "exempt" routes are long-lived streams and operational endpoints that
+# must keep answering when everything else is saturated.
+ROUTE_CLASSES = {
+    "heavy": [
+        "/stock/{symbol}/predict",
+        "/stock/predict/batch",
+        "/stock/{symbol}/history",
+        "/portfolio/{portfolio_id}/stats",
+        "/portfolio/{portfolio_id}/value-history",
+        "/portfolio/{portfolio_id}/rebalance",
+        "/valuations",
+        "/stock/bulk-prices",
+        "/stock/risk-metrics/refresh",
+    ],
+    "auth": ["/login", "/register"],
+    # Long-lived exports: rate limited when opened, but a slow reader must
+    # not hold a heavy slot for the whole download.
+    "streaming": ["/portfolio/user-transactions/stream"],
+    "exempt": [
+        "/stock/stream",
+        "/metrics",
+        "/metrics/queries",
+        "/sessions/stats",
+        "/stock/stream/stats",
+        "/stock/price-cache/stats",
+        "/stock/storage/stats",
+        "/stock/forecast-engine/stats",
+        "/stock/risk-metrics/stats",
+        "/stock/search/stats",
+    ],
+}
+
+# concurrency (0 for no limit), queue, rate (requests/second per client), burst
+DEFAULT_LIMITS = {
+    "heavy": (4, 8, 1.0, 5),
+    "auth": (4, 16, 0.2, 5),
+    "streaming": (0, 0, 1.0, 5),
+    "standard": (64, 128, 50.0, 100),
+}
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class CostClass:
+    # At most `concurrency` requests run at once; up to `queue` more wait at
+    # most max_wait for a slot, and anything beyond that is turned away.
+    # A concurrency of 0 or less leaves only the rate limit.
+    def __init__(self, name: str, concurrency: int, queue: int, rate: float, burst: int, max_wait: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(max(concurrency, 0))
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.saturated = 0
+
+    async def acquire(self):
+        if self.concurrency > 0:
+            await self._take_slot()
+        self.active += 1
+        self.admitted += 1
+
+    async def _take_slot(self):
+        if self._slots.locked():
+            if self.waiting >= self.queue:
+                self.saturated += 1
+                raise Rejected(503, f"Too many {self.name} requests in progress", self.max_wait)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self.saturated += 1
+                raise Rejected(503, f"Too many {self.name} requests in progress", self.max_wait)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+
+    def release(self):
+        self.active -= 1
+        if self.concurrency > 0:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+            "rate_per_client": self.rate,
+            "burst": self.burst,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "saturated": self.saturated,
+        }
+
+
+class AdmissionControl:
+    def __init__(self, classes, max_clients=10000):
+        self.classes = classes
+        self.max_clients = max_clients
+        self._routes = [
+            (compile_path(path)[0], name) for name, paths in ROUTE_CLASSES.items() for path in paths
+        ]
+        self._buckets = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        max_wait = float(os.getenv("ADMISSION_MAX_WAIT", "0.5"))
+        classes = {}
+        for name, (concurrency, queue, rate, burst) in DEFAULT_LIMITS.items():
+            prefix = f"ADMISSION_{name.upper()}_"
+            classes[name] = CostClass(
+                name,
+                concurrency=int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+                queue=int(os.getenv(prefix + "QUEUE", str(queue))),
+                rate=float(os.getenv(prefix + "RATE", str(rate))),
+                burst=int(os.getenv(prefix + "BURST", str(burst))),
+                max_wait=max_wait,
+            )
+        return cls(classes, max_clients=int(os.getenv("ADMISSION_MAX_CLIENTS", "10000")))
+
+    def classify(self, path: str) -> str:
+        for regex, name in self._routes:
+            if regex.match(path):
+                return name
+        return "standard"
+
+    def client_key(self, request: Request) -> str:
+        # Logged-in clients are limited per user, everyone else per address.
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                return f"user:{request.app.state.sessions.verify(token.strip()).user_id}"
+            except InvalidSession:
+                pass
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    def take_token(self, cost_class: CostClass, client: str):
+        # Token bucket per (class, client): refills at `rate` per second up
+        # to `burst`. Idle clients are evicted first, and an evicted client
+        # simply starts again with a full bucket.
+        if cost_class.rate <= 0:
+            return
+        key = (cost_class.name, client)
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (cost_class.burst, now))
+        tokens = min(cost_class.burst, tokens + (now - updated) * cost_class.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            cost_class.rate_limited += 1
+            raise Rejected(429, "Rate limit exceeded", (1 - tokens) / cost_class.rate)
+        self._buckets[key] = (tokens - 1, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+    def stats(self):
+        return {
+            "clients": len(self._buckets),
+            "classes": {name: cost_class.stats() for name, cost_class in self.classes.items()},
+        }
+
+
+# Pure ASGI so a slot is held until the response body, streamed or not, has
+# been sent in full.
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        admission = scope["app"].state.admission
+        cost_class = admission.classes.get(admission.classify(scope["path"]))
+        if cost_class is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            admission.take_token(cost_class, admission.client_key(Request(scope)))
+            await cost_class.acquire()
+        except Rejected as e:
+            response = JSONResponse(
+                {"detail": e.detail},
+                status_code=e.status_code,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+            return await response(scope, receive, send)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cost_class.release()
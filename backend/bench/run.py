@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import asyncpg
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+from bench.seed import BENCH_PASSWORD  # noqa: E402
+
+
+class Fixtures:
+    # Ids the request mix draws from, read from the seeded database.
+    def __init__(self, users, portfolios, symbols, public_stocklists):
+        self.users = users
+        self.portfolios = portfolios
+        self.symbols = symbols
+        self.public_stocklists = public_stocklists
+
+    @classmethod
+    async def load(cls, dsn):
+        db = await asyncpg.connect(dsn)
+        try:
+            users = await db.fetch("SELECT user_id, username FROM users ORDER BY user_id")
+            portfolios = {}
+            for row in await db.fetch("SELECT user_id, portfolio_id FROM portfolios ORDER BY portfolio_id"):
+                portfolios.setdefault(row["user_id"], []).append(row["portfolio_id"])
+            symbols = [row["stock_symbol"] for row in await db.fetch("SELECT stock_symbol FROM stocks ORDER BY 1")]
+            public = [row["stocklist_id"] for row in await db.fetch(
+                "SELECT stocklist_id FROM stocklists WHERE is_public ORDER BY 1"
+            )]
+        finally:
+            await db.close()
+        users = [(row["user_id"], row["username"]) for row in users if row["user_id"] in portfolios]
+        if not users or not symbols:
+            sys.exit("No seeded data found; run python bench/seed.py first")
+        return cls(users, portfolios, symbols, public)
+
+
+class VirtualUser:
+    def __init__(self, fixtures: Fixtures, rng: random.Random):
+        self.fx = fixtures
+        self.rng = rng
+        self.user_id, self.username = rng.choice(fixtures.users)
+        self.token = None
+
+    def portfolio(self):
+        return self.rng.choice(self.fx.portfolios[self.user_id])
+
+    def symbol(self):
+        return self.rng.choice(self.fx.symbols)
+
+
+# (weight, route label, request builder). Weighted towards the cheap reads
+# a logged-in frontend polls, with a tail of writes and analytics.
+def request_mix():
+    def get(path, **params):
+        return "GET", path, {"params": params}
+
+    def post(path, body):
+        return "POST", path, {"json": body}
+
+    return [
+        (15, "GET /portfolios", lambda u: get("/portfolios", user_id=u.user_id)),
+        (15, "GET /portfolio/{portfolio_id}/holdings", lambda u: get(f"/portfolio/{u.portfolio()}/holdings")),
+        (15, "GET /stock/{symbol}/latest-price", lambda u: get(f"/stock/{u.symbol()}/latest-price")),
+        (6, "GET /friends", lambda u: get("/friends", user_id=u.user_id)),
+        (4, "GET /friend-requests", lambda u: get("/friend-requests", user_id=u.user_id)),
+        (6, "GET /get-stocklists", lambda u: get("/get-stocklists", user_id=u.user_id)),
+        (4, "GET /stocklists/public-feed", lambda u: get("/stocklists/public-feed", sort=u.rng.choice(
+            ["newest", "most_reviewed", "highest_value"]
+        ))),
+        (4, "GET /portfolio/{portfolio_id}/value", lambda u: get(f"/portfolio/{u.portfolio()}/value")),
+        (4, "GET /portfolio/user-transactions/page", lambda u: get("/portfolio/user-transactions/page", user_id=u.user_id)),
+        (4, "GET /stock/{symbol}/bars", lambda u: get(f"/stock/{u.symbol()}/bars", resolution=u.rng.choice(["1d", "1w", "1M"]))),
+        (3, "GET /stock/{symbol}/history", lambda u: get(f"/stock/{u.symbol()}/history")),
+        (2, "GET /portfolio/{portfolio_id}/stats", lambda u: get(f"/portfolio/{u.portfolio()}/stats")),
+        (2, "GET /portfolio/{portfolio_id}/value-history", lambda u: get(f"/portfolio/{u.portfolio()}/value-history")),
+        (1, "GET /stock/{symbol}/predict", lambda u: get(f"/stock/{u.symbol()}/predict")),
+        (4, "POST /portfolio/transaction", lambda u: post("/portfolio/transaction", {
+            "portfolio_id": u.portfolio(), "stock_symbol": u.symbol(), "shares": u.rng.choice([1, 2, 3]),
+            "price_per_share": 0
+        })),
+        (2, "POST /portfolio/{portfolio_id}/deposit", lambda u: post(f"/portfolio/{u.portfolio()}/deposit", {
+            "amount": round(u.rng.uniform(10, 1000), 2)
+        })),
+        (1, "POST /valuations", lambda u: post("/valuations", {
+            "portfolio_ids": u.fx.portfolios[u.user_id], "stocklist_ids": u.rng.sample(
+                u.fx.public_stocklists, min(5, len(u.fx.public_stocklists))
+            )
+        })),
+        (1, "POST /login", lambda u: post("/login", {"username": u.username, "password": BENCH_PASSWORD})),
+    ]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.transport_errors = {}
+
+    def record(self, label, status, seconds):
+        self.samples.setdefault(label, []).append(seconds * 1000)
+        counts = self.statuses.setdefault(label, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def error(self, label, exc):
+        key = type(exc).__name__
+        errors = self.transport_errors.setdefault(label, {})
+        errors[key] = errors.get(key, 0) + 1
+
+    def report(self, elapsed):
+        def summarize(samples, statuses, errors):
+            ms = np.asarray(samples) if samples else np.zeros(0)
+            ok = sum(count for status, count in statuses.items() if status.startswith(("2", "3")))
+            return {
+                "requests": len(samples),
+                "ok": ok,
+                "errors": len(samples) - ok + sum(errors.values()),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3) if len(ms) else None,
+                "p95_ms": round(float(np.percentile(ms, 95)), 3) if len(ms) else None,
+                "p99_ms": round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+                "mean_ms": round(float(ms.mean()), 3) if len(ms) else None,
+                "max_ms": round(float(ms.max()), 3) if len(ms) else None,
+                "status": dict(sorted(statuses.items())),
+                "transport_errors": errors,
+            }
+
+        routes = {
+            label: summarize(self.samples[label], self.statuses[label], self.transport_errors.get(label, {}))
+            for label in sorted(self.samples)
+        }
+        everything = [ms for samples in self.samples.values() for ms in samples]
+        statuses = {}
+        for counts in self.statuses.values():
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+        errors = {}
+        for counts in self.transport_errors.values():
+            for name, count in counts.items():
+                errors[name] = errors.get(name, 0) + count
+        return summarize(everything, statuses, errors), routes
+
+
+async def drive(client, fixtures, args, recorder):
+    mix = request_mix()
+    weights = [weight for weight, _, _ in mix]
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+
+    async def worker(n):
+        user = VirtualUser(fixtures, random.Random(args.seed * 1000 + n))
+        response = await client.post("/login", json={"username": user.username, "password": BENCH_PASSWORD})
+        if response.status_code == 200:
+            user.token = response.json()["token"]
+        headers = {"Authorization": f"Bearer {user.token}"} if user.token else {}
+
+        while True:
+            _, label, build = user.rng.choices(mix, weights=weights)[0]
+            method, path, kwargs = build(user)
+            sent = time.perf_counter()
+            if sent >= deadline:
+                return
+            try:
+                response = await client.request(method, path, headers=headers, **kwargs)
+            except httpx.HTTPError as e:
+                if sent >= measure_from:
+                    recorder.error(label, e)
+                continue
+            if sent >= measure_from:
+                recorder.record(label, response.status_code, time.perf_counter() - sent)
+
+    await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+    return time.perf_counter() - measure_from
+
+
+def compare(current, baseline):
+    # Relative change per route against an earlier results file; negative
+    # latency and positive throughput changes are improvements.
+    def delta(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    result = {}
+    for label, stats in current.items():
+        old = baseline.get(label)
+        if old is None:
+            continue
+        result[label] = {
+            f"{key}_change_pct": delta(stats[key], old.get(key))
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+        }
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    fixtures = await Fixtures.load(args.dsn)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        app = None
+    else:
+        # In process: the app and the load generator share one event loop,
+        # which inflates latency under load; point --url at a running server
+        # for numbers comparable to production.
+        # Every virtual user shares one client address here, so admission
+        # control would mostly measure its own per-address limits.
+        os.environ["DATABASE_URL"] = args.dsn
+        if not args.admission:
+            os.environ["ADMISSION_CONTROL"] = "0"
+        import main as app_module
+        app = app_module.app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+    recorder = Recorder()
+    try:
+        elapsed = await drive(client, fixtures, args, recorder)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    overall, routes = recorder.report(elapsed)
+    result = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "target": args.url or "in-process",
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "seed": args.seed,
+            "dataset": {
+                "users": len(fixtures.users),
+                "portfolios": sum(len(ids) for ids in fixtures.portfolios.values()),
+                "symbols": len(fixtures.symbols),
+                "public_stocklists": len(fixtures.public_stocklists),
+            },
+        },
+        "overall": overall,
+        "routes": routes,
+    }
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        result["baseline"] = {"commit": baseline["meta"].get("commit"), "started_at": baseline["meta"].get("started_at")}
+        result["comparison"] = compare(routes, baseline["routes"])
+
+    output = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).write_text(output + "\n")
+    print(output)
+
+
+def parse_args(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Drive a request mix and report per-route latency and throughput.")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="seeded database, defaults to DATABASE_URL")
+    parser.add_argument("--url", help="benchmark a running server instead of the app in process")
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users sending requests back to back")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--admission", action="store_true", help="keep admission control on (in process only)")
+    parser.add_argument("--out", help="also write the JSON results here")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("set DATABASE_URL or pass --dsn")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
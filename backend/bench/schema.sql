@@ -0,0 +1,85 @@
+-- Base tables the backend expects. Indexes, functions, rollups, partitions
+-- and the session tables are created by the app itself at startup.
+
+CREATE TABLE users (
+    user_id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE friendships (
+    sender_id INT REFERENCES users,
+    receiver_id INT REFERENCES users,
+    status VARCHAR(10) NOT NULL,
+    last_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sender_id, receiver_id)
+);
+
+CREATE TABLE stocks (
+    stock_symbol VARCHAR(10) PRIMARY KEY,
+    company_name VARCHAR(100)
+);
+
+CREATE TABLE stockpricehistory (
+    symbol VARCHAR(10) NOT NULL,
+    the_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    open NUMERIC(12, 4),
+    high NUMERIC(12, 4),
+    low NUMERIC(12, 4),
+    close NUMERIC(12, 4),
+    volume BIGINT,
+    PRIMARY KEY (symbol, the_timestamp)
+);
+
+CREATE TABLE portfolios (
+    portfolio_id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    user_id INT REFERENCES users,
+    cash_balance NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE portfolioholdings (
+    portfolio_id INT REFERENCES portfolios ON DELETE CASCADE,
+    stock_symbol VARCHAR(10) REFERENCES stocks,
+    shares INT NOT NULL,
+    PRIMARY KEY (portfolio_id, stock_symbol)
+);
+
+CREATE TABLE transactions (
+    transaction_id SERIAL PRIMARY KEY,
+    portfolio_id INT REFERENCES portfolios ON DELETE CASCADE,
+    stock_symbol VARCHAR(10),
+    shares INT NOT NULL,
+    total_price NUMERIC(14, 2),
+    the_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    trans_type VARCHAR(4)
+);
+
+CREATE TABLE stocklists (
+    stocklist_id SERIAL PRIMARY KEY,
+    name VARCHAR(100),
+    is_public BOOLEAN DEFAULT FALSE,
+    creator_id INT REFERENCES users
+);
+
+CREATE TABLE stocklistitems (
+    stocklist_id INT REFERENCES stocklists ON DELETE CASCADE,
+    stock_symbol VARCHAR(10) REFERENCES stocks,
+    shares INT,
+    PRIMARY KEY (stocklist_id, stock_symbol)
+);
+
+CREATE TABLE sharedstocklists (
+    stocklist_id INT REFERENCES stocklists ON DELETE CASCADE,
+    sharedto_id INT REFERENCES users,
+    PRIMARY KEY (stocklist_id, sharedto_id)
+);
+
+CREATE TABLE reviews (
+    review_id SERIAL PRIMARY KEY,
+    reviewer_id INT REFERENCES users,
+    stocklist_id INT REFERENCES stocklists ON DELETE CASCADE,
+    content VARCHAR(4000),
+    the_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (reviewer_id, stocklist_id)
+);
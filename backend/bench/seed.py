@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import asyncpg
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sessions import hash_password  # noqa: E402
+
+SCHEMA = Path(__file__).with_name("schema.sql")
+BENCH_PASSWORD = "benchpass"  # every generated user logs in with this
+
+SERIALS = {
+    "users": "user_id",
+    "portfolios": "portfolio_id",
+    "transactions": "transaction_id",
+    "stocklists": "stocklist_id",
+    "reviews": "review_id",
+}
+
+
+def money(value, places=2):
+    return Decimal(f"{value:.{places}f}")
+
+
+def username(user_id: int) -> str:
+    return f"bench_user_{user_id}"
+
+
+def symbol_name(index: int) -> str:
+    # AAAA, AAAB, ... so symbols sort and look like tickers.
+    letters = []
+    for _ in range(4):
+        index, rem = divmod(index, 26)
+        letters.append(chr(ord("A") + rem))
+    return "".join(reversed(letters))
+
+
+def trading_days(years: int):
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=int(365.25 * years))
+    days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    return days[np.is_busday(days)]
+
+
+def price_paths(rng, symbols: int, days: int):
+    # Geometric random walks with a per-symbol drift and volatility.
+    start = rng.uniform(10, 500, size=(symbols, 1))
+    drift = rng.normal(0.0003, 0.0004, size=(symbols, 1))
+    vol = rng.uniform(0.01, 0.03, size=(symbols, 1))
+    returns = drift + vol * rng.standard_normal((symbols, days))
+    return start * np.exp(np.cumsum(returns, axis=1))
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.counts = {}
+
+    async def copy(self, db, table, columns, records):
+        await db.copy_records_to_table(table, records=records, columns=columns)
+        self.counts[table] = self.counts.get(table, 0) + len(records)
+
+    async def run(self, db):
+        args, rng = self.args, self.rng
+        symbols = [symbol_name(i) for i in range(args.symbols)]
+        days = trading_days(args.years)
+        closes = price_paths(rng, args.symbols, len(days))
+        timestamps = [datetime.combine(day.item(), datetime.min.time()) for day in days]
+
+        await self.copy(db, "stocks", ["stock_symbol", "company_name"], [
+            (symbol, f"{symbol} Holdings Inc.") for symbol in symbols
+        ])
+
+        for i, symbol in enumerate(symbols):
+            close = closes[i]
+            opens = np.concatenate([[close[0]], close[:-1]]) * (1 + rng.normal(0, 0.002, len(close)))
+            highs = np.maximum(opens, close) * (1 + rng.uniform(0, 0.01, len(close)))
+            lows = np.minimum(opens, close) * (1 - rng.uniform(0, 0.01, len(close)))
+            volumes = rng.integers(100_000, 10_000_000, len(close))
+            await self.copy(db, "stockpricehistory", ["symbol", "the_timestamp", "open", "high", "low", "close", "volume"], [
+                (symbol, ts, money(o, 4), money(h, 4), money(lo, 4), money(c, 4), int(v))
+                for ts, o, h, lo, c, v in zip(timestamps, opens, highs, lows, close, volumes)
+            ])
+
+        password = hash_password(BENCH_PASSWORD)
+        user_ids = list(range(1, args.users + 1))
+        await self.copy(db, "users", ["user_id", "username", "password"], [
+            (user_id, username(user_id), password) for user_id in user_ids
+        ])
+
+        pairs = {}
+        for user_id in user_ids:
+            for friend in rng.choice(user_ids, size=min(args.friends, args.users - 1), replace=False):
+                friend = int(friend)
+                if friend == user_id or (friend, user_id) in pairs:
+                    continue
+                pairs[(user_id, friend)] = rng.choice(["accepted", "pending", "rejected"], p=[0.7, 0.2, 0.1])
+        await self.copy(db, "friendships", ["sender_id", "receiver_id", "status", "last_timestamp"], [
+            (sender, receiver, str(status), timestamps[int(rng.integers(len(timestamps)))])
+            for (sender, receiver), status in pairs.items()
+        ])
+
+        await self.portfolios(db, user_ids, symbols, closes, timestamps)
+        await self.stocklists(db, user_ids, symbols)
+
+        for table, column in SERIALS.items():
+            await db.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                f"(SELECT coalesce(max({column}), 0) + 1 FROM {table}), false)"
+            )
+        await db.execute("ANALYZE")
+        return self.counts
+
+    async def portfolios(self, db, user_ids, symbols, closes, timestamps):
+        args, rng = self.args, self.rng
+        portfolios, holdings, transactions = [], [], []
+        portfolio_id = 0
+        for user_id in user_ids:
+            for n in range(args.portfolios):
+                portfolio_id += 1
+                cash = float(rng.uniform(20_000, 200_000))
+                universe = rng.choice(len(symbols), size=min(args.holdings, len(symbols)), replace=False)
+                positions = dict.fromkeys(universe.tolist(), 0)
+                # Trades in time order; a sell never exceeds the position.
+                for day in np.sort(rng.integers(len(timestamps), size=args.transactions)):
+                    col = int(rng.choice(universe))
+                    price = float(closes[col, day])
+                    shares = int(rng.integers(1, 50))
+                    if positions[col] >= shares and rng.random() < 0.3:
+                        trans_type = "sell"
+                        positions[col] -= shares
+                        cash += shares * price
+                    else:
+                        trans_type = "buy"
+                        positions[col] += shares
+                        cash -= shares * price
+                    transactions.append((
+                        len(transactions) + 1, portfolio_id, symbols[col], shares,
+                        money(shares * price), timestamps[day], trans_type
+                    ))
+                portfolios.append((portfolio_id, f"Portfolio {n + 1}", user_id, money(max(cash, 1_000.0))))
+                holdings.extend(
+                    (portfolio_id, symbols[col], shares) for col, shares in positions.items() if shares > 0
+                )
+
+        await self.copy(db, "portfolios", ["portfolio_id", "name", "user_id", "cash_balance"], portfolios)
+        await self.copy(db, "portfolioholdings", ["portfolio_id", "stock_symbol", "shares"], holdings)
+        await self.copy(db, "transactions", [
+            "transaction_id", "portfolio_id", "stock_symbol", "shares", "total_price", "the_timestamp", "trans_type"
+        ], transactions)
+
+    async def stocklists(self, db, user_ids, symbols):
+        args, rng = self.args, self.rng
+        stocklists, items, shared, reviews = [], [], [], []
+        for user_id in user_ids:
+            for n in range(args.stocklists):
+                stocklist_id = len(stocklists) + 1
+                is_public = bool(rng.random() < 0.5)
+                stocklists.append((stocklist_id, f"List {n + 1} of {username(user_id)}", is_public, user_id))
+                for col in rng.choice(len(symbols), size=min(int(rng.integers(3, 11)), len(symbols)), replace=False):
+                    items.append((stocklist_id, symbols[int(col)], int(rng.integers(1, 100))))
+
+                others = [int(other) for other in rng.choice(user_ids, size=min(args.reviews + 3, len(user_ids)), replace=False)]
+                others = [other for other in others if other != user_id]
+                if not is_public:
+                    shared.extend((stocklist_id, other) for other in others[:2])
+                for reviewer in (others if is_public else others[:2])[:args.reviews]:
+                    reviews.append((
+                        len(reviews) + 1, reviewer, stocklist_id,
+                        f"Review of list {stocklist_id} by {username(reviewer)}"
+                    ))
+
+        await self.copy(db, "stocklists", ["stocklist_id", "name", "is_public", "creator_id"], stocklists)
+        await self.copy(db, "stocklistitems", ["stocklist_id", "stock_symbol", "shares"], items)
+        await self.copy(db, "sharedstocklists", ["stocklist_id", "sharedto_id"], shared)
+        await self.copy(db, "reviews", ["review_id", "reviewer_id", "stocklist_id", "content"], reviews)
+
+
+async def main(args):
+    db = await asyncpg.connect(args.dsn)
+    try:
+        if args.reset:
+            await db.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+            await db.execute(SCHEMA.read_text())
+        elif await db.fetchval("SELECT to_regclass('users') IS NOT NULL"):
+            if await db.fetchval("SELECT EXISTS (SELECT 1 FROM users)"):
+                sys.exit("Database already has data; pass --reset to drop and recreate the public schema")
+        else:
+            await db.execute(SCHEMA.read_text())
+
+        started = time.perf_counter()
+        async with db.transaction():
+            counts = await Generator(args).run(db)
+        print(json.dumps({
+            "seed": args.seed,
+            "scale": {key: getattr(args, key) for key in (
+                "users", "symbols", "years", "friends", "portfolios", "holdings", "transactions", "stocklists", "reviews"
+            )},
+            "rows": counts,
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+        }, indent=2))
+    finally:
+        await db.close()
+
+
+def parse_args(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create the schema and load deterministic synthetic data.")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the public schema first")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--years", type=int, default=5, help="years of daily bars per symbol")
+    parser.add_argument("--friends", type=int, default=10, help="friend requests sent per user")
+    parser.add_argument("--portfolios", type=int, default=2, help="portfolios per user")
+    parser.add_argument("--holdings", type=int, default=8, help="symbols traded per portfolio")
+    parser.add_argument("--transactions", type=int, default=40, help="transactions per portfolio")
+    parser.add_argument("--stocklists", type=int, default=2, help="stocklists per user")
+    parser.add_argument("--reviews", type=int, default=3, help="reviews per stocklist")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("set DATABASE_URL or pass --dsn")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,5 +1,72 @@
-from fastapi import Request
+from fastapi import HTTPException, Request
+from fastapi.requests import HTTPConnection
+import asyncio
+import time
+
+from profiler import ProfiledConnection
+from sessions import InvalidSession
+
+async def acquire_connection(state):
+    # Pool checkout with the acquire timeout and metrics, for code that
+    # holds a connection outside get_db; release it with state.pool.release.
+    started = time.perf_counter()
+    try:
+        connection = await state.pool.acquire(timeout=state.pool_acquire_timeout)
+    except asyncio.TimeoutError:
+        state.metrics.acquire_timeouts += 1
+        raise HTTPException(status_code=503, detail="Database is busy, try again shortly")
+    state.metrics.acquire_wait.observe(time.perf_counter() - started)
+    return connection
 
 async def get_db(request: Request):
-    async with request.app.state.pool.acquire() as connection:
-        yield connection
+    state = request.app.state
+    connection = await acquire_connection(state)
+    profile = getattr(request.state, "query_profile", None)
+    try:
+        yield ProfiledConnection(connection, profile) if profile is not None else connection
+    finally:
+        await state.pool.release(connection)
+
+def get_price_cache(request: Request):
+    return request.app.state.price_cache
+
+def get_forecast_engine(request: Request):
+    return request.app.state.forecast_engine
+
+def get_stats_engine(request: Request):
+    return request.app.state.stats_engine
+
+def get_stocklist_feed(request: Request):
+    return request.app.state.stocklist_feed
+
+def get_value_curves(request: Request):
+    return request.app.state.value_curves
+
+def get_versions(request: Request):
+    return request.app.state.versions
+
+def get_price_feed(connection: HTTPConnection):
+    # Shared by the SSE and WebSocket price stream routes.
+    return connection.app.state.price_feed
+
+def get_sessions(request: Request):
+    return request.app.state.sessions
+
+def get_current_user(request: Request):
+    # Authorization: Bearer <token from /login>; verified in memory.
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Not logged in", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return request.app.state.sessions.verify(token.strip())
+    except InvalidSession as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+def get_price_storage(request: Request):
+    return request.app.state.price_storage
+
+def get_risk_metrics(request: Request):
+    return request.app.state.risk_metrics
+
+def get_symbol_search(request: Request):
+    return request.app.state.symbol_search
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+from collections import defaultdict
+
+import asyncpg
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+MAX_PAYLOAD = 7000  # NOTIFY payloads must stay under 8000 bytes
+
+
+def pack(messages):
+    # JSON messages packed several to a payload, each payload a JSON array.
+    payloads, batch, size = [], [], 0
+    for message in messages:
+        if batch and size + len(message) > MAX_PAYLOAD:
+            payloads.append("[" + ",".join(batch) + "]")
+            batch, size = [], 0
+        batch.append(message)
+        size += len(message) + 1
+    if batch:
+        payloads.append("[" + ",".join(batch) + "]")
+    return payloads
+
+
+# Cross-worker notifications for in-process state: one LISTEN connection per
+# process, handlers per channel, and an outbox that publish() fills and a
+# task drains through the pool, so callers on the request path never wait
+# on it. Every payload carries this process's origin and its own messages
+# are skipped, since the publisher already applied them. Notifications sent
+# while the listener is down are lost, so on_connect callbacks run after
+# every (re)connect for receivers to resynchronise, and on_lost ones when
+# it drops.
+class EventBus:
+    def __init__(self, dsn, retry_interval=5.0):
+        self.dsn = dsn
+        self.retry_interval = retry_interval
+        self.origin = secrets.token_hex(4)
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self._handlers = defaultdict(list)
+        self._on_connect = []
+        self._on_lost = []
+        self._outbox = []
+        self._pool = None
+        self._flushing = None
+
+    @classmethod
+    def from_env(cls, dsn):
+        return cls(dsn, retry_interval=float(os.getenv("EVENT_BUS_RETRY_INTERVAL", "5")))
+
+    def subscribe(self, channel: str, handler):
+        # handler(messages) with the decoded messages of one notification.
+        self._handlers[channel].append(handler)
+
+    def on_connect(self, callback):
+        self._on_connect.append(callback)
+
+    def on_lost(self, callback):
+        self._on_lost.append(callback)
+
+    def publish(self, channel: str, message):
+        self._outbox.append((channel, json.dumps(message)))
+        if self._pool is not None and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._outbox:
+            outbox, self._outbox = self._outbox, []
+            by_channel = defaultdict(list)
+            for channel, message in outbox:
+                by_channel[channel].append(message)
+            try:
+                async with self._pool.acquire() as db:
+                    for channel, messages in by_channel.items():
+                        payloads = [
+                            f'{{"origin":"{self.origin}","messages":{batch}}}' for batch in pack(messages)
+                        ]
+                        await queries.notify(db, channel, payloads)
+                self.published += len(outbox)
+            except Exception:
+                logger.exception("Event bus publish failed")
+                self._outbox[:0] = outbox
+                await asyncio.sleep(self.retry_interval)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed %s notification", channel)
+            return
+        if envelope["origin"] == self.origin:
+            return
+        self.received += len(envelope["messages"])
+        for handler in self._handlers[channel]:
+            handler(envelope["messages"])
+
+    async def run(self, pool):
+        self._pool = pool
+        if self._outbox:
+            self._flushing = asyncio.create_task(self._flush())
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    connection = await asyncpg.connect(self.dsn)
+                    lost = loop.create_future()
+                    connection.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+                    try:
+                        for channel in self._handlers:
+                            await connection.add_listener(channel, self._on_notify)
+                        self.connected = True
+                        for callback in self._on_connect:
+                            callback()
+                        await lost
+                    finally:
+                        self.connected = False
+                        for callback in self._on_lost:
+                            callback()
+                        await connection.close()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Event bus listener failed")
+                await asyncio.sleep(self.retry_interval)
+        finally:
+            if self._flushing is not None:
+                self._flushing.cancel()
+
+    def stats(self):
+        return {
+            "origin": self.origin,
+            "connected": self.connected,
+            "channels": sorted(self._handlers),
+            "published": self.published,
+            "received": self.received,
+            "queued": len(self._outbox),
+        }
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+
+def fit_monthly_forecast(buckets, closes, periods=12):
+    # Runs inside a worker process, so the scientific stack is imported there.
+    import pandas as pd
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    monthly = pd.Series(closes, index=pd.DatetimeIndex(buckets) + pd.offsets.MonthEnd(0)).astype(float)
+
+    model = ExponentialSmoothing(monthly, trend="add")
+    fit = model.fit()
+
+    forecast = fit.forecast(periods)
+    future_months = pd.date_range(start=monthly.index[-1] + pd.offsets.MonthEnd(1), periods=periods, freq='M')
+
+    return [
+        {"month": date.strftime("%b %Y"), "predicted_close": round(float(pred), 2)}
+        for date, pred in zip(future_months, forecast)
+    ]
+
+
+def preload_analytics():
+    # Submitted once per worker process by ForecastEngine.warm.
+    started = time.perf_counter()
+    import pandas  # noqa: F401
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing  # noqa: F401
+    return os.getpid(), time.perf_counter() - started
+
+
+class ForecastTimeout(Exception):
+    pass
+
+
+class ForecastEngine:
+    def __init__(self, workers=None, max_concurrent=None, cache_size=1024, timeout=30.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrent = max_concurrent or self.workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._executor = None
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.fits = 0
+        self.timeouts = 0
+        self.warmed_workers = 0
+        self.warm_seconds = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv("FORECAST_WORKERS", "0")) or None,
+            max_concurrent=int(os.getenv("FORECAST_MAX_CONCURRENT", "0")) or None,
+            cache_size=int(os.getenv("FORECAST_CACHE_SIZE", "1024")),
+            timeout=float(os.getenv("FORECAST_TIMEOUT", "30")),
+        )
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def warm(self):
+        # Worker processes start on first use and import pandas/statsmodels
+        # on their first fit. This does both ahead of time, one task per
+        # worker, so the first /predict is as fast as any other.
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, preload_analytics) for _ in range(self.workers)
+        ))
+        self.warmed_workers = len({pid for pid, _ in results})
+        self.warm_seconds = round(time.perf_counter() - started, 3)
+        return self.warm_seconds
+
+    def get_cached(self, symbol: str, latest_timestamp):
+        entry = self._cache.get(symbol)
+        if entry is None or entry[0] != latest_timestamp:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(symbol)
+        self.hits += 1
+        return entry[1]
+
+    def _store(self, symbol: str, latest_timestamp, result):
+        self._cache[symbol] = (latest_timestamp, result)
+        self._cache.move_to_end(symbol)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _fit(self, symbol, latest_timestamp, buckets, closes, periods):
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            self.fits += 1
+            result = await loop.run_in_executor(self._executor, fit_monthly_forecast, buckets, closes, periods)
+        self._store(symbol, latest_timestamp, result)
+        return result
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        # Mark errors from fits that every waiter gave up on as retrieved.
+        if not task.cancelled():
+            task.exception()
+
+    async def forecast(self, symbol: str, latest_timestamp, buckets, closes, periods=12):
+        # Concurrent requests for the same symbol and bar share one fit.
+        key = (symbol, latest_timestamp)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fit(symbol, latest_timestamp, buckets, closes, periods))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise ForecastTimeout(symbol)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_concurrent": self.max_concurrent,
+            "cached_symbols": len(self._cache),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fits": self.fits,
+            "timeouts": self.timeouts,
+            "warmed_workers": self.warmed_workers,
+            "warm_seconds": self.warm_seconds,
+        }
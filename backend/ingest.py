@@ -0,0 +1,172 @@
+import csv
+import json
+import time
+
+from pydantic import ValidationError
+
+from models import BulkStockPriceRow
+from pricefeed import publish_bars, publish_history
+import queries
+from rollups import refresh_rollups
+
+COLUMNS = ["symbol", "the_timestamp", "open", "high", "low", "close", "volume"]
+MAX_REJECTED_REPORTED = 100
+
+STAGING_TABLE = "stockprice_staging"
+
+
+async def ensure_staging_table(db):
+    # Typed explicitly so binary COPY always sees timestamp/float8/bigint;
+    # the upsert below casts into whatever stockpricehistory actually uses.
+    await db.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+            symbol TEXT,
+            the_timestamp TIMESTAMP,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION,
+            volume BIGINT
+        ) ON COMMIT DELETE ROWS
+    """)
+
+
+async def iter_lines(stream):
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+
+async def iter_raw_rows(stream, fmt: str):
+    header = None
+    line_no = 0
+    async for line in iter_lines(stream):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, e
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            missing = set(COLUMNS) - set(header)
+            if missing:
+                raise ValueError(f"CSV header is missing columns: {', '.join(sorted(missing))}")
+            continue
+        yield line_no, dict(zip(header, values))
+
+
+def validate_batch(batch, report, storage):
+    # Later rows win when a chunk carries the same bar twice, which keeps the
+    # upsert from touching one row twice in a single statement.
+    bars = {}
+    for line_no, raw in batch:
+        if isinstance(raw, Exception):
+            report.reject(line_no, str(raw))
+            continue
+        try:
+            bar = BulkStockPriceRow.model_validate(raw)
+        except ValidationError as e:
+            report.reject(line_no, "; ".join(err["msg"] for err in e.errors()))
+            continue
+        if not storage.accepts(bar.the_timestamp):
+            report.reject(line_no, f"Bar is older than the retention horizon ({storage.raw_horizon:%Y-%m-%d})")
+            continue
+        bars[(bar.symbol, bar.the_timestamp)] = (
+            bar.symbol, bar.the_timestamp, bar.open, bar.high, bar.low, bar.close, bar.volume
+        )
+    return list(bars.values())
+
+
+async def load_chunk(db, records, storage):
+    # Returns the newest upserted bar per symbol, typed as stored, so the
+    # caller can refresh the price cache without another round trip. Those
+    # bars are also published to the live price stream.
+    async with db.transaction():
+        timestamps = [record[1] for record in records]
+        await storage.ensure_partitions(db, min(timestamps), max(timestamps))
+        await db.copy_records_to_table(STAGING_TABLE, records=records, columns=COLUMNS)
+        latest = await queries.run_dynamic(db, "fetch", "bulk_upsert_prices", f"""
+            WITH upserted AS (
+                INSERT INTO stockpricehistory (symbol, the_timestamp, open, high, low, close, volume)
+                SELECT symbol, the_timestamp, open, high, low, close, volume
+                FROM {STAGING_TABLE}
+                ON CONFLICT (symbol, the_timestamp) DO UPDATE
+                SET open = EXCLUDED.open,
+                    high = EXCLUDED.high,
+                    low = EXCLUDED.low,
+                    close = EXCLUDED.close,
+                    volume = EXCLUDED.volume
+                RETURNING symbol, the_timestamp, open, high, low, close, volume
+            )
+            SELECT DISTINCT ON (symbol) symbol, the_timestamp, open, high, low, close, volume
+            FROM upserted
+            ORDER BY symbol, the_timestamp DESC
+        """)
+        bars = [(record[0], record[1]) for record in records]
+        await refresh_rollups(db, bars)
+        await publish_bars(db, latest)
+        await publish_history(db, bars)
+    return latest
+
+
+class IngestReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.loaded = 0
+        self.rejected_count = 0
+        self.rejected = []
+
+    def reject(self, line_no: int, error: str):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED_REPORTED:
+            self.rejected.append({"line": line_no, "error": error})
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows_received": self.received,
+            "rows_loaded": self.loaded,
+            "rows_rejected": self.rejected_count,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.loaded / elapsed, 1) if elapsed > 0 else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+async def ingest_stream(db, stream, fmt: str, chunk_size: int, price_cache, stats_engine, storage, versions):
+    report = IngestReport()
+    await ensure_staging_table(db)
+
+    async def flush(batch):
+        records = validate_batch(batch, report, storage)
+        if not records:
+            return
+        latest = await load_chunk(db, records, storage)
+        report.loaded += len(records)
+        for row in latest:
+            price_cache.update(row["symbol"], row["the_timestamp"], row["close"])
+        stats_engine.touch((record[0], record[1]) for record in records)
+        versions.bump(*{("symbol", record[0]) for record in records})
+
+    batch = []
+    async for line_no, raw in iter_raw_rows(stream, fmt):
+        report.received += 1
+        batch.append((line_no, raw))
+        if len(batch) >= chunk_size:
+            await flush(batch)
+            batch = []
+    await flush(batch)
+
+    return report.summary()
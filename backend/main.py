@@ -1,39 +1,232 @@
-from fastapi import FastAPI
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
+import asyncio
 import asyncpg
+import logging
 import os
 
+from admission import AdmissionControl, AdmissionMiddleware
+from events import EventBus
+from forecast import ForecastEngine
+from metrics import AppMetrics, StartupTimes
+from profiler import QueryProfile, should_profile
+from pricecache import LatestPriceCache
+from pricefeed import PriceFeed
+from queries import STATEMENTS, init_connection
+from riskmetrics import RiskMetrics
+from sessions import SessionManager
+from rollups import ensure_rollups
+from schema import SCHEMA_LOCK, ensure_functions, ensure_indexes
+from storage import PriceStorage
+from symbolsearch import SymbolSearch
+from statsengine import StatsEngine
+from stocklistfeed import StocklistFeed
+from valuecurve import ValueCurveEngine
+from versions import DataVersions
+
 from routes import loginregister
 from routes import friendship
 from routes import portfolio, portfolioholdings
 from routes import stocks
 from routes import stocklist
+from routes import metrics
+from routes import valuation
+from routes import pricestream
+from routes import riskmetrics
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI()
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.on_event("startup")
-async def startup():
-    app.state.pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"))
-
-@app.on_event("shutdown")
-async def shutdown():
-    await app.state.pool.close()
-
-app.include_router(loginregister.router)
-app.include_router(friendship.router)
-app.include_router(portfolio.router)  
-app.include_router(portfolioholdings.router) 
-app.include_router(stocks.router)
-app.include_router(stocklist.router)
+PRELOAD_MODES = ("lazy", "background", "startup")
+
+def pool_settings():
+    return {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "10")),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        "max_queries": int(os.getenv("DB_POOL_MAX_QUERIES", "50000")),
+        "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300")),
+        "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", str(max(100, 2 * len(STATEMENTS))))),
+        "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", "0")) or None,
+    }
+
+def create_app(preload: str = None) -> FastAPI:
+    # preload controls when the forecasting stack (worker processes running
+    # pandas/statsmodels) is loaded:
+    #   lazy       - on the first forecast request (default)
+    #   background - right after startup, without delaying readiness
+    #   startup    - before the app starts serving
+    preload = preload or os.getenv("ANALYTICS_PRELOAD", "lazy")
+    if preload not in PRELOAD_MODES:
+        raise ValueError(f"ANALYTICS_PRELOAD must be one of {', '.join(PRELOAD_MODES)}")
+
+    app = FastAPI()
+    app.state.metrics = AppMetrics()
+    app.state.admission = AdmissionControl.from_env()
+    app.state.startup = StartupTimes(IMPORT_SECONDS)
+    app.state.analytics_preload = preload
+
+    @app.middleware("http")
+    async def record_route_latency(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # Label by route template, not raw URL, so /stock/AAPL and /stock/MSFT
+        # share one histogram.
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        app.state.metrics.observe_route(request.method, path, time.perf_counter() - started)
+        return response
+
+    @app.middleware("http")
+    async def profile_queries(request: Request, call_next):
+        if not should_profile(request):
+            return await call_next(request)
+
+        profile = request.state.query_profile = QueryProfile()
+        started = time.perf_counter()
+        response = await call_next(request)
+        elapsed = time.perf_counter() - started
+        response.headers["X-Query-Profile"] = profile.header()
+        profile.log_if_slow(request.method, request.url.path, elapsed)
+        return response
+
+    # Cost classes, concurrency limits and per-client rate limits; inside CORS so
+    # 429/503 responses still carry its headers.
+    if os.getenv("ADMISSION_CONTROL", "1") != "0":
+        app.add_middleware(AdmissionMiddleware)
+
+    # CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Bodies above GZIP_MIN_SIZE bytes are compressed for clients that accept it.
+    if int(os.getenv("GZIP_MIN_SIZE", "1000")) > 0:
+        app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1000")))
+
+    async def warm_analytics():
+        try:
+            await app.state.forecast_engine.warm()
+        except Exception:
+            logger.exception("Analytics warm-up failed")
+
+    @app.on_event("startup")
+    async def startup():
+        app.state.startup.begin()
+        # Schema first, on a plain connection: every pooled connection prepares
+        # the registered statements in init_connection, so their tables must exist.
+        app.state.event_bus = EventBus.from_env(os.getenv("DATABASE_URL"))
+        app.state.price_storage = PriceStorage.from_env(app.state.event_bus)
+        app.state.sessions = SessionManager.from_env()
+        app.state.risk_metrics = RiskMetrics.from_env()
+        app.state.symbol_search = SymbolSearch.from_env(os.getenv("DATABASE_URL"))
+        connection = await asyncpg.connect(os.getenv("DATABASE_URL"))
+        try:
+            # Workers started together take turns, so each finds the schema
+            # either untouched or complete; closing the connection unlocks.
+            await connection.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK)
+            await ensure_indexes(connection)
+            await ensure_functions(connection)
+            await app.state.price_storage.setup(connection)
+            await app.state.sessions.setup(connection)
+            await ensure_rollups(connection)
+            await app.state.risk_metrics.setup(connection)
+            await app.state.symbol_search.setup(connection)
+        finally:
+            await connection.close()
+        app.state.startup.mark("schema")
+
+        app.state.pool_settings = pool_settings()
+        app.state.pool_acquire_timeout = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10")) or None
+        app.state.pool = await asyncpg.create_pool(
+            os.getenv("DATABASE_URL"),
+            init=init_connection,
+            **app.state.pool_settings
+        )
+        app.state.startup.mark("pool")
+        app.state.price_cache = LatestPriceCache()
+        app.state.stats_engine = StatsEngine()
+        app.state.stocklist_feed = StocklistFeed(app.state.price_cache, app.state.event_bus)
+        app.state.versions = DataVersions(app.state.price_cache, app.state.event_bus)
+        app.state.value_curves = ValueCurveEngine.from_env(app.state.stats_engine)
+        async with app.state.pool.acquire() as connection:
+            await app.state.price_cache.warm(connection)
+            await app.state.symbol_search.reload(connection)
+        app.state.startup.mark("caches")
+        app.state.sessions.start()
+        app.state.forecast_engine = ForecastEngine.from_env()
+        app.state.forecast_engine.start()
+        app.state.warm_task = None
+        if preload == "startup":
+            await app.state.forecast_engine.warm()
+            app.state.startup.mark("analytics")
+        elif preload == "background":
+            app.state.warm_task = asyncio.create_task(warm_analytics())
+        def on_compacted(local):
+            app.state.stats_engine.reset()
+            # Other workers hear of it with the version bump's broadcast.
+            if local:
+                app.state.versions.bump(("storage",))
+
+        app.state.storage_task = asyncio.create_task(
+            app.state.price_storage.run(app.state.pool, on_compacted=on_compacted)
+        )
+        app.state.price_feed = PriceFeed.from_env(os.getenv("DATABASE_URL"), app.state.price_cache, app.state.stats_engine)
+        app.state.price_feed_task = asyncio.create_task(app.state.price_feed.run(app.state.pool))
+        app.state.event_bus_task = asyncio.create_task(app.state.event_bus.run(app.state.pool))
+        app.state.sessions_task = asyncio.create_task(app.state.sessions.run(app.state.pool))
+        app.state.risk_metrics_task = asyncio.create_task(app.state.risk_metrics.run(app.state.pool))
+        app.state.symbol_search_task = asyncio.create_task(app.state.symbol_search.run(app.state.pool))
+        app.state.startup.finish()
+        logger.info(
+            "Worker ready: import %.3fs, startup %.3fs, analytics preload %s",
+            app.state.startup.import_seconds, app.state.startup.startup_seconds, preload
+        )
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        app.state.storage_task.cancel()
+        app.state.price_feed_task.cancel()
+        app.state.event_bus_task.cancel()
+        app.state.sessions_task.cancel()
+        app.state.risk_metrics_task.cancel()
+        app.state.symbol_search_task.cancel()
+        if app.state.warm_task is not None:
+            app.state.warm_task.cancel()
+        app.state.sessions.shutdown()
+        app.state.forecast_engine.shutdown()
+        await app.state.pool.close()
+
+    app.include_router(loginregister.router)
+    app.include_router(friendship.router)
+    app.include_router(portfolio.router)  
+    app.include_router(portfolioholdings.router) 
+    app.include_router(stocks.router)
+    app.include_router(stocklist.router)
+    app.include_router(metrics.router)
+    app.include_router(valuation.router)
+    app.include_router(pricestream.router)
+    app.include_router(riskmetrics.router)
+
+    return app
+
+# uvicorn main:app serves the default app; uvicorn main:create_app --factory
+# builds one per worker from the environment. Built on first access so the
+# factory path does not build two.
+def __getattr__(name):
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(name)
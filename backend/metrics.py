@@ -0,0 +1,91 @@
+import bisect
+import time
+
+# Upper bounds in milliseconds; the last bucket catches everything slower.
+LATENCY_BUCKETS_MS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction: float):
+        # Upper bound of the bucket holding the given fraction of samples.
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return self.max_ms
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class AppMetrics:
+    def __init__(self):
+        self.acquire_wait = Histogram()
+        self.acquire_timeouts = 0
+        self.routes = {}
+
+    def observe_route(self, method: str, path: str, seconds: float):
+        key = f"{method} {path}"
+        histogram = self.routes.get(key)
+        if histogram is None:
+            histogram = self.routes[key] = Histogram()
+        histogram.observe(seconds)
+
+    def snapshot_routes(self):
+        return {key: histogram.snapshot() for key, histogram in sorted(self.routes.items())}
+
+
+class StartupTimes:
+    # How long this process took to import the app and to get through each
+    # startup phase, so worker cold starts can be tracked.
+    def __init__(self, import_seconds: float):
+        self.import_seconds = round(import_seconds, 3)
+        self.phases = {}
+        self.startup_seconds = None
+        self._started = None
+        self._last = None
+
+    def begin(self):
+        self._started = self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last, 3)
+        self._last = now
+
+    def finish(self):
+        self.startup_seconds = round(time.perf_counter() - self._started, 3)
+
+    def snapshot(self):
+        return {
+            "import_seconds": self.import_seconds,
+            "startup_seconds": self.startup_seconds,
+            "phases": self.phases,
+        }
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 class LoginRequest(BaseModel):
     username: str
@@ -55,4 +57,93 @@ class FullStockPriceInput(BaseModel):
     high: float
     low: float
     close: float
-    volume: int
\ No newline at end of file
+    volume: int
+
+class BulkStockPriceRow(BaseModel):
+    symbol: str
+    the_timestamp: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
+
+    @field_validator("symbol")
+    @classmethod
+    def normalize_symbol(cls, value):
+        value = value.strip().upper()
+        if not value:
+            raise ValueError("symbol must not be empty")
+        return value
+
+    @field_validator("the_timestamp")
+    @classmethod
+    def strip_timezone(cls, value):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @model_validator(mode="after")
+    def check_bar(self):
+        if self.volume < 0:
+            raise ValueError("volume must not be negative")
+        if self.low > min(self.open, self.close) or self.high < max(self.open, self.close):
+            raise ValueError("high/low must bound open and close")
+        return self
+
+
+class BatchForecastRequest(BaseModel):
+    symbols: List[str] = Field(..., min_length=1, max_length=500)
+
+
+class OrderItem(BaseModel):
+    stock_symbol: str
+    shares: int  # positive = buy, negative = sell
+
+
+class BatchOrderRequest(BaseModel):
+    orders: List[OrderItem] = Field(..., min_length=1, max_length=500)
+
+
+class RebalanceRequest(BaseModel):
+    # Either explicit target weights (fractions of total value, the rest
+    # stays in cash) or a stocklist whose items' market values set them.
+    weights: Optional[Dict[str, float]] = None
+    stocklist_id: Optional[int] = None
+    dry_run: bool = False
+
+    @field_validator("weights")
+    @classmethod
+    def normalize_symbols(cls, value):
+        # Matched against the price cache, which holds uppercase symbols.
+        if value is None:
+            return value
+        weights = {}
+        for symbol, weight in value.items():
+            symbol = symbol.strip().upper()
+            if symbol in weights:
+                raise ValueError(f"Duplicate symbol in weights: {symbol}")
+            weights[symbol] = weight
+        return weights
+
+    @model_validator(mode="after")
+    def one_target(self):
+        if (self.weights is None) == (self.stocklist_id is None):
+            raise ValueError("Provide exactly one of weights or stocklist_id")
+        if self.weights is not None:
+            if any(weight < 0 for weight in self.weights.values()):
+                raise ValueError("Weights must be non-negative")
+            if sum(self.weights.values()) > 1 + 1e-9:
+                raise ValueError("Weights must sum to at most 1")
+        return self
+
+
+class BatchValuationRequest(BaseModel):
+    portfolio_ids: List[int] = Field(default_factory=list, max_length=500)
+    stocklist_ids: List[int] = Field(default_factory=list, max_length=500)
+
+    @model_validator(mode="after")
+    def not_empty(self):
+        if not self.portfolio_ids and not self.stocklist_ids:
+            raise ValueError("Provide at least one portfolio_id or stocklist_id")
+        return self
@@ -0,0 +1,85 @@
+import queries
+
+
+# symbol -> (the_timestamp, close) of the newest bar. Warmed at startup, kept
+# current by the price-ingestion routes in this process and by the PriceFeed
+# listener for bars committed by any process, falls back to the DB on a miss.
+# While the listener is down (listening is False) bars from other workers
+# may be missing here, so every read goes to the DB until it reconnects and
+# rewarms. version moves on every change so derived caches can tell they
+# are stale.
+class LatestPriceCache:
+    def __init__(self):
+        self._prices = {}
+        self.listening = False
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def warm(self, db):
+        # Merged rather than replaced: bars heard while the query ran are
+        # newer than its snapshot and are kept.
+        for row in await queries.latest_prices(db):
+            self.update(row["symbol"], row["the_timestamp"], row["close"])
+        self.version += 1
+        return len(self._prices)
+
+    def update(self, symbol: str, the_timestamp, close):
+        current = self._prices.get(symbol)
+        if current is None or the_timestamp >= current[0]:
+            self._prices[symbol] = (the_timestamp, close)
+            self.version += 1
+
+    def invalidate(self, symbol: str):
+        if self._prices.pop(symbol, None) is not None:
+            self.version += 1
+
+    async def get_entry(self, db, symbol: str):
+        entry = self._prices.get(symbol) if self.listening else None
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        row = await queries.latest_price(db, symbol)
+        if not row:
+            return None
+        self.update(symbol, row["the_timestamp"], row["close"])
+        return self._prices[symbol]
+
+    async def get(self, db, symbol: str):
+        entry = await self.get_entry(db, symbol)
+        return entry[1] if entry else None
+
+    async def get_many(self, db, symbols):
+        entries = await self.get_many_entries(db, symbols)
+        return {symbol: entry[1] for symbol, entry in entries.items()}
+
+    async def get_many_entries(self, db, symbols):
+        entries = {}
+        missing = []
+        for symbol in set(symbols):
+            entry = self._prices.get(symbol) if self.listening else None
+            if entry is not None:
+                entries[symbol] = entry
+            else:
+                missing.append(symbol)
+        self.hits += len(entries)
+
+        if missing:
+            self.misses += len(missing)
+            rows = await queries.latest_prices_for(db, missing)
+            for row in rows:
+                self.update(row["symbol"], row["the_timestamp"], row["close"])
+                entries[row["symbol"]] = self._prices[row["symbol"]]
+        return entries
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "symbols": len(self._prices),
+            "listening": self.listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
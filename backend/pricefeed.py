@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime
+
+import asyncpg
+
+import queries
+from events import pack
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "price_bars"
+HISTORY_CHANNEL = "price_history"
+
+
+def bar_message(row):
+    return json.dumps({
+        "symbol": row["symbol"],
+        "time": row["the_timestamp"].isoformat(),
+        "open": row["open"],
+        "high": row["high"],
+        "low": row["low"],
+        "close": row["close"],
+        "volume": row["volume"],
+    })
+
+
+async def publish_bars(db, rows):
+    # Called inside the writing transaction, so listeners only hear about
+    # bars that were committed. Bars are packed several to a notification.
+    payloads = pack(bar_message(row) for row in rows)
+    if payloads:
+        await queries.notify_bars(db, payloads)
+
+
+async def publish_history(db, bars):
+    # bars: iterable of (symbol, the_timestamp) written in this transaction.
+    # Only the earliest day per symbol is sent; that is all a stats engine
+    # needs to know which tail of its series to re-read.
+    earliest = {}
+    for symbol, the_timestamp in bars:
+        day = the_timestamp.date().isoformat()
+        if symbol not in earliest or day < earliest[symbol]:
+            earliest[symbol] = day
+    payloads = pack(json.dumps([symbol, day]) for symbol, day in earliest.items())
+    if payloads:
+        await queries.notify(db, HISTORY_CHANNEL, payloads)
+
+
+class Subscription:
+    # Holds at most one pending message per symbol: a consumer that falls
+    # behind skips straight to the latest bar instead of queueing every one.
+    def __init__(self, symbols):
+        self.symbols = set(symbols)
+        self._pending = {}
+        self._ready = asyncio.Event()
+        self.delivered = 0
+        self.coalesced = 0
+
+    def offer(self, symbol: str, message: str):
+        if symbol in self._pending:
+            self.coalesced += 1
+        self._pending[symbol] = message
+        self._ready.set()
+
+    async def next(self):
+        await self._ready.wait()
+        self._ready.clear()
+        messages, self._pending = list(self._pending.values()), {}
+        self.delivered += len(messages)
+        return messages
+
+
+# One LISTEN connection per process, fanned out to every subscribed client.
+# Each notification is decoded once and its messages handed to the
+# subscriptions for those symbols; nothing here ever waits on a client.
+# Every bar also updates this process's price cache, and every history write
+# marks this process's stats engine stale, so writes by any worker reach all
+# of them.
+class PriceFeed:
+    def __init__(self, dsn, price_cache, stats_engine, max_symbols=200, retry_interval=5.0):
+        self.dsn = dsn
+        self.price_cache = price_cache
+        self.stats_engine = stats_engine
+        self.max_symbols = max_symbols
+        self.retry_interval = retry_interval
+        self._subscribers = defaultdict(set)
+        self.connected = False
+        self.notifications = 0
+        self.bars = 0
+        self.delivered = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls, dsn, price_cache, stats_engine):
+        return cls(
+            dsn,
+            price_cache,
+            stats_engine,
+            max_symbols=int(os.getenv("PRICE_STREAM_MAX_SYMBOLS", "200")),
+            retry_interval=float(os.getenv("PRICE_STREAM_RETRY_INTERVAL", "5")),
+        )
+
+    def check(self, symbols):
+        if len(symbols) > self.max_symbols:
+            raise ValueError(f"At most {self.max_symbols} symbols per subscription")
+
+    def subscribe(self, symbols):
+        self.check(symbols)
+        subscription = Subscription(())
+        self.update(subscription, add=symbols)
+        return subscription
+
+    def update(self, subscription: Subscription, add=(), remove=()):
+        for symbol in remove:
+            subscription.symbols.discard(symbol)
+            self._drop(symbol, subscription)
+        for symbol in add:
+            if len(subscription.symbols) >= self.max_symbols:
+                raise ValueError(f"At most {self.max_symbols} symbols per subscription")
+            subscription.symbols.add(symbol)
+            self._subscribers[symbol].add(subscription)
+
+    def unsubscribe(self, subscription: Subscription):
+        for symbol in subscription.symbols:
+            self._drop(symbol, subscription)
+        self.delivered += subscription.delivered
+        self.coalesced += subscription.coalesced
+
+    def _drop(self, symbol: str, subscription: Subscription):
+        subscribers = self._subscribers.get(symbol)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[symbol]
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.notifications += 1
+        try:
+            bars = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed %s notification", CHANNEL)
+            return
+        for bar in bars:
+            self.bars += 1
+            self.price_cache.update(bar["symbol"], datetime.fromisoformat(bar["time"]), bar["close"])
+            subscribers = self._subscribers.get(bar["symbol"])
+            if not subscribers:
+                continue
+            message = json.dumps(bar)
+            for subscription in subscribers:
+                subscription.offer(bar["symbol"], message)
+
+    def _on_history(self, connection, pid, channel, payload):
+        try:
+            touched = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed %s notification", HISTORY_CHANNEL)
+            return
+        self.stats_engine.touch((symbol, date.fromisoformat(day)) for symbol, day in touched)
+
+    async def run(self, pool):
+        # Keeps the listener connected; bars published while it is down are
+        # not replayed, clients get the next ones once it is back. The price
+        # cache and stats engine are bypassed while disconnected and
+        # rewarmed (or reset) once listening again, so neither serves data
+        # older than a committed bar.
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = loop.create_future()
+                connection.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+                try:
+                    await connection.add_listener(CHANNEL, self._on_notify)
+                    await connection.add_listener(HISTORY_CHANNEL, self._on_history)
+                    async with pool.acquire() as db:
+                        await self.price_cache.warm(db)
+                    self.stats_engine.reset()
+                    self.connected = self.price_cache.listening = self.stats_engine.listening = True
+                    await lost
+                finally:
+                    self.connected = self.price_cache.listening = self.stats_engine.listening = False
+                    await connection.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Price stream listener failed")
+            await asyncio.sleep(self.retry_interval)
+
+    def stats(self):
+        subscriptions = {sub for subs in self._subscribers.values() for sub in subs}
+        return {
+            "connected": self.connected,
+            "subscriptions": len(subscriptions),
+            "symbols": len(self._subscribers),
+            "notifications": self.notifications,
+            "bars": self.bars,
+            "delivered": self.delivered + sum(sub.delivered for sub in subscriptions),
+            "coalesced": self.coalesced + sum(sub.coalesced for sub in subscriptions),
+        }
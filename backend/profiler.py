@@ -0,0 +1,108 @@
+import logging
+import os
+import re
+import time
+
+from queries import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+# "off" (default), "header" to profile only requests sending X-Profile-Queries: 1,
+# or "all" to profile every request.
+PROFILE_MODE = os.getenv("QUERY_PROFILING", "off").lower()
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+
+_STATEMENT_NAMES = {sql: name for name, sql in STATEMENTS.items()}
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql: str):
+    # Registered statements are reported by name; anything else by its text
+    # with literals stripped, so calls differing only in values group together.
+    name = _STATEMENT_NAMES.get(sql)
+    if name is not None:
+        return name
+    normalized = _WHITESPACE.sub(" ", _LITERALS.sub("?", sql)).strip()
+    return normalized[:120]
+
+
+def should_profile(request):
+    if PROFILE_MODE == "all":
+        return True
+    return PROFILE_MODE == "header" and request.headers.get("x-profile-queries") == "1"
+
+
+class QueryProfile:
+    def __init__(self):
+        self.queries = []
+
+    def record(self, sql: str, seconds: float):
+        self.queries.append((fingerprint(sql), seconds))
+
+    def breakdown(self):
+        grouped = {}
+        for name, seconds in self.queries:
+            entry = grouped.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds * 1000
+        return sorted(grouped.items(), key=lambda item: -item[1][1])
+
+    def header(self):
+        total_ms = sum(seconds for _, seconds in self.queries) * 1000
+        top = [f"{name} {count}x {ms:.1f}ms" for name, (count, ms) in self.breakdown()[:3]]
+        # Header values must stay ASCII and short; the log carries the rest.
+        top = [entry.encode("ascii", "replace").decode()[:80] for entry in top]
+        return f"count={len(self.queries)}; db_ms={total_ms:.1f}; top=" + ", ".join(top)
+
+    def log_if_slow(self, method: str, path: str, seconds: float):
+        elapsed_ms = seconds * 1000
+        if elapsed_ms < SLOW_REQUEST_MS:
+            return
+        lines = [
+            f"  {count:>4}x {ms:9.2f}ms  {name}" for name, (count, ms) in self.breakdown()
+        ]
+        logger.warning(
+            "Slow request %s %s took %.1fms with %d queries\n%s",
+            method, path, elapsed_ms, len(self.queries), "\n".join(lines)
+        )
+
+
+class ProfiledConnection:
+    # Stands in for the pooled connection handed to route handlers, timing
+    # every query method and delegating everything else untouched.
+    def __init__(self, connection, profile: QueryProfile):
+        self._connection = connection
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    async def _timed(self, method: str, sql: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await getattr(self._connection, method)(sql, *args, **kwargs)
+        finally:
+            self._profile.record(sql, time.perf_counter() - started)
+
+    async def fetch(self, sql, *args, **kwargs):
+        return await self._timed("fetch", sql, *args, **kwargs)
+
+    async def fetchrow(self, sql, *args, **kwargs):
+        return await self._timed("fetchrow", sql, *args, **kwargs)
+
+    async def fetchval(self, sql, *args, **kwargs):
+        return await self._timed("fetchval", sql, *args, **kwargs)
+
+    async def execute(self, sql, *args, **kwargs):
+        return await self._timed("execute", sql, *args, **kwargs)
+
+    async def executemany(self, sql, *args, **kwargs):
+        return await self._timed("executemany", sql, *args, **kwargs)
+
+    async def copy_records_to_table(self, table_name, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._connection.copy_records_to_table(table_name, **kwargs)
+        finally:
+            self._profile.record(f"COPY {table_name}", time.perf_counter() - started)
@@ -0,0 +1,842 @@
+import logging
+import time
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Every static statement the app runs, declared once by name. init_connection
+# parses and plans all of them into each pooled connection's statement cache,
+# and every call goes through _run so per-statement cost is recorded in one
+# place.
+STATEMENTS = {}
+
+
+def statement(name: str, sql: str):
+    STATEMENTS[name] = sql
+    return name
+
+
+class QueryStats:
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, name: str, seconds: float):
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0}
+        ms = seconds * 1000
+        entry["calls"] += 1
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def snapshot(self):
+        return {
+            name: {
+                "calls": entry["calls"],
+                "total_ms": round(entry["total_ms"], 3),
+                "avg_ms": round(entry["total_ms"] / entry["calls"], 3),
+                "max_ms": round(entry["max_ms"], 3),
+            }
+            for name, entry in sorted(self._stats.items(), key=lambda item: -item[1]["total_ms"])
+        }
+
+
+query_stats = QueryStats()
+_warm_unavailable_logged = False
+
+
+async def init_connection(connection):
+    # numeric arrives as float instead of Decimal; cash and prices are
+    # already treated as floats everywhere they are used.
+    await connection.set_type_codec(
+        "numeric", encoder=str, decoder=float, schema="pg_catalog", format="text"
+    )
+    # asyncpg keys its per-connection prepared statement cache on the query
+    # text, so preparing through it here means routes never pay parse/plan.
+    # The public Connection.prepare() bypasses that cache (use_cache=False)
+    # and its statements would never be reused by fetch/execute, so this
+    # goes through the internal _get_statement; asyncpg is pinned in
+    # requirements.txt for that reason. If an upgrade drops it, connections
+    # still work and statements are prepared on first use instead.
+    get_statement = getattr(connection, "_get_statement", None)
+    if get_statement is None:
+        global _warm_unavailable_logged
+        if not _warm_unavailable_logged:
+            _warm_unavailable_logged = True
+            logger.warning("asyncpg %s has no _get_statement; statements are prepared on first use", asyncpg.__version__)
+        return
+    for sql in STATEMENTS.values():
+        await get_statement(sql, None)
+    # Preparing ends without a Sync, which leaves the server inside an
+    # implicit transaction until the next query; a BEGIN sent first would
+    # land in it, and one with an isolation level is refused.
+    await connection.execute("SELECT 1")
+
+
+async def _run(db, method: str, name: str, *args):
+    started = time.perf_counter()
+    try:
+        return await getattr(db, method)(STATEMENTS[name], *args)
+    finally:
+        query_stats.record(name, time.perf_counter() - started)
+
+
+async def run_dynamic(db, method: str, name: str, sql: str, *args):
+    # For statements assembled per request (filters, cursors); timed under
+    # name but not prepared up front.
+    started = time.perf_counter()
+    try:
+        return await getattr(db, method)(sql, *args)
+    finally:
+        query_stats.record(name, time.perf_counter() - started)
+
+
+# Users
+
+FIND_USER_LOGIN = statement("find_user_login", """
+    SELECT user_id, username, password FROM users WHERE username = $1
+""")
+SET_USER_PASSWORD = statement("set_user_password", "UPDATE users SET password = $2 WHERE user_id = $1")
+FIND_USER_ID = statement("find_user_id", "SELECT user_id FROM users WHERE username = $1")
+CREATE_USER = statement("create_user", """
+    INSERT INTO users (username, password)
+    VALUES ($1, $2)
+    RETURNING user_id, username
+""")
+
+
+async def find_user_login(db, username: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_USER_LOGIN, username)
+
+
+async def set_user_password(db, user_id: int, password_hash: str) -> str:
+    return await _run(db, "execute", SET_USER_PASSWORD, user_id, password_hash)
+
+
+async def find_user_id(db, username: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_USER_ID, username)
+
+
+async def create_user(db, username: str, password: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", CREATE_USER, username, password)
+
+
+# Sessions
+
+REVOKE_SESSION = statement("revoke_session", """
+    INSERT INTO revokedsessions (session_id, expires_at) VALUES ($1, $2)
+    ON CONFLICT (session_id) DO NOTHING
+""")
+REVOKED_SESSIONS = statement("revoked_sessions", """
+    SELECT session_id, expires_at FROM revokedsessions WHERE expires_at > now()
+""")
+PRUNE_REVOKED_SESSIONS = statement("prune_revoked_sessions", "DELETE FROM revokedsessions WHERE expires_at <= now()")
+
+
+async def revoke_session(db, session_id: str, expires_at) -> str:
+    return await _run(db, "execute", REVOKE_SESSION, session_id, expires_at)
+
+
+async def revoked_sessions(db) -> list:
+    return await _run(db, "fetch", REVOKED_SESSIONS)
+
+
+async def prune_revoked_sessions(db) -> str:
+    return await _run(db, "execute", PRUNE_REVOKED_SESSIONS)
+
+
+# Friendships
+
+FIND_RECENT_REJECTION = statement("find_recent_rejection", """
+    SELECT * FROM friendships
+    WHERE (
+        (sender_id = $1 AND receiver_id = $2)
+        OR (sender_id = $2 AND receiver_id = $1)
+    )
+    AND status = 'rejected'
+    AND last_timestamp >= NOW() - INTERVAL '5 minutes'
+""")
+FIND_FRIENDSHIP = statement("find_friendship", """
+    SELECT * FROM friendships
+    WHERE (sender_id = $1 AND receiver_id = $2)
+       OR (sender_id = $2 AND receiver_id = $1)
+""")
+DELETE_REVERSE_FRIENDSHIP = statement("delete_reverse_friendship", """
+    DELETE FROM friendships
+    WHERE sender_id = $2 AND receiver_id = $1
+""")
+UPSERT_PENDING_FRIENDSHIP = statement("upsert_pending_friendship", """
+    INSERT INTO friendships (sender_id, receiver_id, status)
+    VALUES ($1, $2, 'pending')
+    ON CONFLICT (sender_id, receiver_id) DO UPDATE
+    SET status = 'pending', last_timestamp = CURRENT_TIMESTAMP
+""")
+SET_PENDING_FRIENDSHIP_STATUS = statement("set_pending_friendship_status", """
+    UPDATE friendships
+    SET status = $3, last_timestamp = CURRENT_TIMESTAMP
+    WHERE sender_id = $1 AND receiver_id = $2 AND status = 'pending'
+""")
+FIND_ACCEPTED_FRIENDSHIP = statement("find_accepted_friendship", """
+    SELECT * FROM friendships
+    WHERE ((sender_id = $1 AND receiver_id = $2)
+        OR (sender_id = $2 AND receiver_id = $1))
+      AND status = 'accepted'
+""")
+DELETE_FRIENDSHIP = statement("delete_friendship", """
+    DELETE FROM friendships
+    WHERE (sender_id = $1 AND receiver_id = $2)
+       OR (sender_id = $2 AND receiver_id = $1)
+""")
+INSERT_REJECTED_FRIENDSHIP = statement("insert_rejected_friendship", """
+    INSERT INTO friendships (sender_id, receiver_id, status)
+    VALUES ($1, $2, 'rejected')
+""")
+LIST_FRIENDS = statement("list_friends", """
+    SELECT u.user_id, u.username
+    FROM friendships f
+    JOIN users u ON (u.user_id = CASE WHEN f.sender_id = $1 THEN f.receiver_id ELSE f.sender_id END)
+    WHERE f.status = 'accepted' AND ($1 = f.sender_id OR $1 = f.receiver_id)
+""")
+LIST_INCOMING_REQUESTS = statement("list_incoming_requests", """
+    SELECT u.user_id, u.username, f.last_timestamp
+    FROM friendships f
+    JOIN users u ON u.user_id = f.sender_id
+    WHERE f.receiver_id = $1 AND f.status = 'pending'
+""")
+LIST_OUTGOING_REQUESTS = statement("list_outgoing_requests", """
+    SELECT u.user_id, u.username, f.last_timestamp
+    FROM friendships f
+    JOIN users u ON u.user_id = f.receiver_id
+    WHERE f.sender_id = $1 AND f.status = 'pending'
+""")
+
+
+async def find_recent_rejection(db, sender_id: int, receiver_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_RECENT_REJECTION, sender_id, receiver_id)
+
+
+async def find_friendship(db, sender_id: int, receiver_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_FRIENDSHIP, sender_id, receiver_id)
+
+
+async def delete_reverse_friendship(db, sender_id: int, receiver_id: int) -> str:
+    return await _run(db, "execute", DELETE_REVERSE_FRIENDSHIP, sender_id, receiver_id)
+
+
+async def upsert_pending_friendship(db, sender_id: int, receiver_id: int) -> str:
+    return await _run(db, "execute", UPSERT_PENDING_FRIENDSHIP, sender_id, receiver_id)
+
+
+async def set_pending_friendship_status(db, sender_id: int, receiver_id: int, status: str) -> str:
+    return await _run(db, "execute", SET_PENDING_FRIENDSHIP_STATUS, sender_id, receiver_id, status)
+
+
+async def find_accepted_friendship(db, user_id: int, friend_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_ACCEPTED_FRIENDSHIP, user_id, friend_id)
+
+
+async def delete_friendship(db, user_id: int, friend_id: int) -> str:
+    return await _run(db, "execute", DELETE_FRIENDSHIP, user_id, friend_id)
+
+
+async def insert_rejected_friendship(db, sender_id: int, receiver_id: int) -> str:
+    return await _run(db, "execute", INSERT_REJECTED_FRIENDSHIP, sender_id, receiver_id)
+
+
+async def list_friends(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_FRIENDS, user_id)
+
+
+async def list_incoming_requests(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_INCOMING_REQUESTS, user_id)
+
+
+async def list_outgoing_requests(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_OUTGOING_REQUESTS, user_id)
+
+
+# Portfolios
+
+CREATE_PORTFOLIO = statement("create_portfolio", """
+    INSERT INTO portfolios (name, user_id, cash_balance)
+    VALUES ($1, $2, $3)
+    RETURNING portfolio_id, name, cash_balance
+""")
+LIST_PORTFOLIOS = statement("list_portfolios", """
+    SELECT portfolio_id, name, cash_balance FROM portfolios WHERE user_id = $1
+""")
+GET_CASH_BALANCE = statement("get_cash_balance", """
+    SELECT cash_balance FROM portfolios WHERE portfolio_id = $1
+""")
+SET_CASH_BALANCE = statement("set_cash_balance", """
+    UPDATE portfolios SET cash_balance = $1 WHERE portfolio_id = $2
+""")
+ADD_CASH = statement("add_cash", """
+    UPDATE portfolios SET cash_balance = cash_balance + $1
+    WHERE portfolio_id = $2
+""")
+FIND_PORTFOLIO_BY_NAME = statement("find_portfolio_by_name", """
+    SELECT portfolio_id FROM portfolios WHERE name = $1
+""")
+FIND_USER_PORTFOLIO_BY_NAME = statement("find_user_portfolio_by_name", """
+    SELECT portfolio_id FROM portfolios WHERE name = $1 AND user_id = $2
+""")
+
+
+async def create_portfolio(db, name: str, user_id: int, cash_balance: float) -> asyncpg.Record:
+    return await _run(db, "fetchrow", CREATE_PORTFOLIO, name, user_id, cash_balance)
+
+
+async def list_portfolios(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_PORTFOLIOS, user_id)
+
+
+async def get_cash_balance(db, portfolio_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", GET_CASH_BALANCE, portfolio_id)
+
+
+async def set_cash_balance(db, portfolio_id: int, cash_balance: float) -> str:
+    return await _run(db, "execute", SET_CASH_BALANCE, cash_balance, portfolio_id)
+
+
+async def add_cash(db, portfolio_id: int, amount: float) -> str:
+    return await _run(db, "execute", ADD_CASH, amount, portfolio_id)
+
+
+async def find_portfolio_by_name(db, name: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_PORTFOLIO_BY_NAME, name)
+
+
+async def find_user_portfolio_by_name(db, name: str, user_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_USER_PORTFOLIO_BY_NAME, name, user_id)
+
+
+# Holdings and transactions
+
+GET_HOLDING_SHARES = statement("get_holding_shares", """
+    SELECT shares FROM portfolioholdings WHERE portfolio_id = $1 AND stock_symbol = $2
+""")
+DELETE_HOLDING = statement("delete_holding", """
+    DELETE FROM portfolioholdings WHERE portfolio_id = $1 AND stock_symbol = $2
+""")
+SET_HOLDING_SHARES = statement("set_holding_shares", """
+    UPDATE portfolioholdings SET shares = $1 WHERE portfolio_id = $2 AND stock_symbol = $3
+""")
+INSERT_HOLDING = statement("insert_holding", """
+    INSERT INTO portfolioholdings (portfolio_id, stock_symbol, shares) VALUES ($1, $2, $3)
+""")
+INSERT_TRANSACTION = statement("insert_transaction", """
+    INSERT INTO transactions (portfolio_id, stock_symbol, shares, total_price, the_timestamp, trans_type)
+    VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP, $5)
+""")
+LIST_HOLDINGS_DETAILED = statement("list_holdings_detailed", """
+    SELECT
+        ph.stock_symbol,
+        s.company_name,
+        ph.shares,
+        p.name AS portfolio_name
+    FROM portfolioholdings ph
+    JOIN portfolios p ON p.portfolio_id = ph.portfolio_id
+    JOIN stocks s ON s.stock_symbol = ph.stock_symbol
+    WHERE ph.portfolio_id = $1
+""")
+LIST_HOLDINGS = statement("list_holdings", """
+    SELECT stock_symbol, shares FROM portfolioholdings WHERE portfolio_id = $1
+""")
+EXECUTE_TRADES = statement("execute_trades", """
+    SELECT order_index, outcome, reason, order_total, cash_after
+    FROM execute_trades($1, $2::text[], $3::int[], $4::float8[])
+""")
+
+VALUATION_POSITIONS = statement("valuation_positions", """
+    SELECT 'portfolio' AS kind, p.portfolio_id AS container_id, p.cash_balance,
+           h.stock_symbol, h.shares
+    FROM portfolios p
+    LEFT JOIN portfolioholdings h ON h.portfolio_id = p.portfolio_id
+    WHERE p.portfolio_id = ANY($1::int[])
+    UNION ALL
+    SELECT 'stocklist', s.stocklist_id, NULL, i.stock_symbol, i.shares
+    FROM stocklists s
+    LEFT JOIN stocklistitems i ON i.stocklist_id = s.stocklist_id
+    WHERE s.stocklist_id = ANY($2::int[])
+""")
+
+LEDGER_SINCE = statement("ledger_since", """
+    SELECT transaction_id, the_timestamp, stock_symbol, shares, total_price, trans_type
+    FROM transactions
+    WHERE portfolio_id = $1 AND transaction_id > $2
+    ORDER BY transaction_id
+""")
+
+
+async def get_holding_shares(db, portfolio_id: int, stock_symbol: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", GET_HOLDING_SHARES, portfolio_id, stock_symbol)
+
+
+async def delete_holding(db, portfolio_id: int, stock_symbol: str) -> str:
+    return await _run(db, "execute", DELETE_HOLDING, portfolio_id, stock_symbol)
+
+
+async def set_holding_shares(db, portfolio_id: int, stock_symbol: str, shares: int) -> str:
+    return await _run(db, "execute", SET_HOLDING_SHARES, shares, portfolio_id, stock_symbol)
+
+
+async def insert_holding(db, portfolio_id: int, stock_symbol: str, shares: int) -> str:
+    return await _run(db, "execute", INSERT_HOLDING, portfolio_id, stock_symbol, shares)
+
+
+async def insert_transaction(db, portfolio_id: int, stock_symbol: str, shares: int, total_price: float, trans_type: str) -> str:
+    return await _run(db, "execute", INSERT_TRANSACTION, portfolio_id, stock_symbol, shares, total_price, trans_type)
+
+
+async def list_holdings_detailed(db, portfolio_id: int) -> list:
+    return await _run(db, "fetch", LIST_HOLDINGS_DETAILED, portfolio_id)
+
+
+async def list_holdings(db, portfolio_id: int) -> list:
+    return await _run(db, "fetch", LIST_HOLDINGS, portfolio_id)
+
+
+async def valuation_positions(db, portfolio_ids: list, stocklist_ids: list) -> list:
+    # One row per position, plus a NULL-symbol row for empty containers.
+    return await _run(db, "fetch", VALUATION_POSITIONS, portfolio_ids, stocklist_ids)
+
+
+async def ledger_since(db, portfolio_id: int, after_transaction_id: int) -> list:
+    return await _run(db, "fetch", LEDGER_SINCE, portfolio_id, after_transaction_id)
+
+
+async def execute_trades(db, portfolio_id: int, symbols: list, shares: list, prices: list) -> list:
+    return await _run(db, "fetch", EXECUTE_TRADES, portfolio_id, symbols, shares, prices)
+
+
+# Stocklists and reviews
+
+LIST_USER_STOCKLISTS = statement("list_user_stocklists", """
+    SELECT stocklist_id, name, is_public FROM stocklists
+    WHERE creator_id = $1
+""")
+CREATE_STOCKLIST = statement("create_stocklist", """
+    INSERT INTO stocklists (name, is_public, creator_id)
+    VALUES ($1, $2, $3)
+    RETURNING stocklist_id
+""")
+GET_STOCKLIST = statement("get_stocklist", "SELECT * FROM stocklists WHERE stocklist_id = $1")
+DELETE_STOCKLIST_ITEMS = statement("delete_stocklist_items", "DELETE FROM stocklistitems WHERE stocklist_id = $1")
+DELETE_STOCKLIST_SHARES = statement("delete_stocklist_shares", "DELETE FROM sharedstocklists WHERE stocklist_id = $1")
+DELETE_STOCKLIST = statement("delete_stocklist", "DELETE FROM stocklists WHERE stocklist_id = $1")
+ADD_STOCKLIST_ITEM = statement("add_stocklist_item", """
+    INSERT INTO stocklistitems (stocklist_id, stock_symbol, shares)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (stocklist_id, stock_symbol) DO UPDATE
+    SET shares = stocklistitems.shares + EXCLUDED.shares
+""")
+REMOVE_STOCKLIST_ITEM = statement("remove_stocklist_item", """
+    DELETE FROM stocklistitems WHERE stocklist_id = $1 AND stock_symbol = $2
+""")
+LIST_STOCKLIST_ITEMS = statement("list_stocklist_items", """
+    SELECT stock_symbol, shares FROM stocklistitems WHERE stocklist_id = $1
+""")
+SHARE_STOCKLIST = statement("share_stocklist", """
+    INSERT INTO sharedstocklists (stocklist_id, sharedto_id)
+    VALUES ($1, $2)
+    ON CONFLICT DO NOTHING
+""")
+LIST_SHARED_USERS = statement("list_shared_users", """
+    SELECT u.user_id, u.username
+    FROM sharedstocklists s
+    JOIN users u ON s.sharedto_id = u.user_id
+    WHERE s.stocklist_id = $1
+""")
+LIST_PUBLIC_STOCKLISTS = statement("list_public_stocklists", """
+    SELECT s.stocklist_id, s.name, u.username AS owner_username
+    FROM stocklists s
+    JOIN users u ON s.creator_id = u.user_id
+    WHERE s.is_public = TRUE
+""")
+PUBLIC_STOCKLIST_SUMMARIES = statement("public_stocklist_summaries", """
+    SELECT s.stocklist_id, s.name, u.username AS owner_username,
+           coalesce(i.symbols, '{}') AS symbols,
+           coalesce(i.shares, '{}') AS shares,
+           r.review_count
+    FROM stocklists s
+    JOIN users u ON s.creator_id = u.user_id
+    CROSS JOIN LATERAL (
+        SELECT array_agg(stock_symbol ORDER BY stock_symbol) AS symbols,
+               array_agg(shares ORDER BY stock_symbol) AS shares
+        FROM stocklistitems
+        WHERE stocklist_id = s.stocklist_id
+    ) i
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS review_count FROM reviews WHERE stocklist_id = s.stocklist_id
+    ) r
+    WHERE s.is_public = TRUE AND ($1::int[] IS NULL OR s.stocklist_id = ANY($1::int[]))
+""")
+LIST_STOCKLISTS_SHARED_WITH = statement("list_stocklists_shared_with", """
+    SELECT s.stocklist_id, s.name, u.username AS owner_username
+    FROM sharedstocklists sh
+    JOIN stocklists s ON sh.stocklist_id = s.stocklist_id
+    JOIN users u ON s.creator_id = u.user_id
+    WHERE sh.sharedto_id = $1
+""")
+LIST_STOCKLIST_REVIEWS = statement("list_stocklist_reviews", """
+    SELECT r.review_id, r.reviewer_id, u.username, r.content, r.the_timestamp
+    FROM reviews r
+    JOIN users u ON r.reviewer_id = u.user_id
+    WHERE r.stocklist_id = $1
+""")
+LIST_REVIEWS_BY_USER = statement("list_reviews_by_user", """
+    SELECT r.review_id, r.stocklist_id, s.name AS stocklist_name, r.content, r.the_timestamp
+    FROM reviews r
+    JOIN stocklists s ON r.stocklist_id = s.stocklist_id
+    WHERE r.reviewer_id = $1
+""")
+FIND_REVIEW = statement("find_review", """
+    SELECT 1 FROM reviews
+    WHERE reviewer_id = $1 AND stocklist_id = $2
+""")
+CREATE_REVIEW = statement("create_review", """
+    INSERT INTO reviews (reviewer_id, stocklist_id, content)
+    VALUES ($1, $2, $3)
+""")
+DELETE_REVIEW = statement("delete_review", "DELETE FROM reviews WHERE review_id = $1 RETURNING stocklist_id")
+DELETE_USER_REVIEW = statement("delete_user_review", """
+    DELETE FROM reviews
+    WHERE reviewer_id = $1 AND stocklist_id = $2
+""")
+
+
+async def list_user_stocklists(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_USER_STOCKLISTS, user_id)
+
+
+async def create_stocklist(db, name: str, is_public: bool, creator_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", CREATE_STOCKLIST, name, is_public, creator_id)
+
+
+async def get_stocklist(db, stocklist_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", GET_STOCKLIST, stocklist_id)
+
+
+async def delete_stocklist(db, stocklist_id: int):
+    await _run(db, "execute", DELETE_STOCKLIST_ITEMS, stocklist_id)
+    await _run(db, "execute", DELETE_STOCKLIST_SHARES, stocklist_id)
+    await _run(db, "execute", DELETE_STOCKLIST, stocklist_id)
+
+
+async def add_stocklist_item(db, stocklist_id: int, stock_symbol: str, shares: int) -> str:
+    return await _run(db, "execute", ADD_STOCKLIST_ITEM, stocklist_id, stock_symbol, shares)
+
+
+async def remove_stocklist_item(db, stocklist_id: int, stock_symbol: str) -> str:
+    return await _run(db, "execute", REMOVE_STOCKLIST_ITEM, stocklist_id, stock_symbol)
+
+
+async def list_stocklist_items(db, stocklist_id: int) -> list:
+    return await _run(db, "fetch", LIST_STOCKLIST_ITEMS, stocklist_id)
+
+
+async def share_stocklist(db, stocklist_id: int, sharedto_id: int) -> str:
+    return await _run(db, "execute", SHARE_STOCKLIST, stocklist_id, sharedto_id)
+
+
+async def list_shared_users(db, stocklist_id: int) -> list:
+    return await _run(db, "fetch", LIST_SHARED_USERS, stocklist_id)
+
+
+async def list_public_stocklists(db) -> list:
+    return await _run(db, "fetch", LIST_PUBLIC_STOCKLISTS)
+
+
+async def public_stocklist_summaries(db, stocklist_ids) -> list:
+    # stocklist_ids=None loads every public list.
+    return await _run(db, "fetch", PUBLIC_STOCKLIST_SUMMARIES, stocklist_ids)
+
+
+async def list_stocklists_shared_with(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_STOCKLISTS_SHARED_WITH, user_id)
+
+
+async def list_stocklist_reviews(db, stocklist_id: int) -> list:
+    return await _run(db, "fetch", LIST_STOCKLIST_REVIEWS, stocklist_id)
+
+
+async def list_reviews_by_user(db, user_id: int) -> list:
+    return await _run(db, "fetch", LIST_REVIEWS_BY_USER, user_id)
+
+
+async def find_review(db, reviewer_id: int, stocklist_id: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", FIND_REVIEW, reviewer_id, stocklist_id)
+
+
+async def create_review(db, reviewer_id: int, stocklist_id: int, content: str) -> str:
+    return await _run(db, "execute", CREATE_REVIEW, reviewer_id, stocklist_id, content)
+
+
+async def delete_review(db, review_id: int):
+    return await _run(db, "fetchval", DELETE_REVIEW, review_id)
+
+
+async def delete_user_review(db, reviewer_id: int, stocklist_id: int) -> str:
+    return await _run(db, "execute", DELETE_USER_REVIEW, reviewer_id, stocklist_id)
+
+
+# Prices
+
+INSERT_PRICE = statement("insert_price", """
+    INSERT INTO stockpricehistory (symbol, open, high, low, close, volume)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING symbol, the_timestamp, open, high, low, close, volume
+""")
+NOTIFY_BARS = statement("notify_bars", "SELECT pg_notify('price_bars', payload) FROM unnest($1::text[]) AS payload")
+NOTIFY = statement("notify", "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload")
+# The newest bar per symbol is read from its latest month rollup, which
+# always holds it and survives compaction of the raw history.
+LATEST_PRICES = statement("latest_prices", """
+    SELECT DISTINCT ON (symbol) symbol, last_ts AS the_timestamp, close
+    FROM stockpricerollups
+    WHERE resolution = 'month'
+    ORDER BY symbol, bucket DESC
+""")
+LATEST_PRICE = statement("latest_price", """
+    SELECT last_ts AS the_timestamp, close
+    FROM stockpricerollups
+    WHERE symbol = $1 AND resolution = 'month'
+    ORDER BY bucket DESC
+    LIMIT 1
+""")
+LATEST_PRICES_FOR = statement("latest_prices_for", """
+    SELECT DISTINCT ON (symbol) symbol, last_ts AS the_timestamp, close
+    FROM stockpricerollups
+    WHERE symbol = ANY($1::text[]) AND resolution = 'month'
+    ORDER BY symbol, bucket DESC
+""")
+
+
+async def insert_price(db, symbol: str, open: float, high: float, low: float, close: float, volume: int) -> asyncpg.Record:
+    return await _run(db, "fetchrow", INSERT_PRICE, symbol, open, high, low, close, volume)
+
+
+async def notify_bars(db, payloads) -> list:
+    return await _run(db, "fetch", NOTIFY_BARS, payloads)
+
+
+async def notify(db, channel: str, payloads) -> list:
+    return await _run(db, "fetch", NOTIFY, channel, payloads)
+
+
+async def latest_prices(db) -> list:
+    return await _run(db, "fetch", LATEST_PRICES)
+
+
+async def latest_price(db, symbol: str) -> asyncpg.Record:
+    return await _run(db, "fetchrow", LATEST_PRICE, symbol)
+
+
+async def latest_prices_for(db, symbols: list) -> list:
+    return await _run(db, "fetch", LATEST_PRICES_FOR, symbols)
+
+
+# Children of a partitioned table with their bounds, row estimates and size.
+PARTITION_STATS = statement("partition_stats", """
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound,
+           c.reltuples::bigint AS estimated_rows,
+           pg_total_relation_size(c.oid) AS bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass($1)
+    ORDER BY c.relname
+""")
+
+
+async def partition_stats(db, parent: str) -> list:
+    return await _run(db, "fetch", PARTITION_STATS, parent)
+
+
+SEARCH_STOCKS = statement("search_stocks", "SELECT stock_symbol, company_name FROM stocks")
+
+
+async def search_stocks(db) -> list:
+    return await _run(db, "fetch", SEARCH_STOCKS)
+
+
+# Rollups
+
+REFRESH_ROLLUPS = statement("refresh_rollups", """
+    WITH touched AS (
+        SELECT DISTINCT t.symbol, r.resolution, date_trunc(r.resolution, t.ts)::date AS bucket
+        FROM unnest($1::text[], $2::timestamp[]) AS t(symbol, ts)
+        CROSS JOIN unnest($3::text[]) AS r(resolution)
+    )
+    INSERT INTO stockpricerollups
+    SELECT t.symbol, t.resolution, t.bucket,
+           (array_agg(h.open ORDER BY h.the_timestamp))[1],
+           max(h.high), min(h.low),
+           (array_agg(h.close ORDER BY h.the_timestamp DESC))[1],
+           sum(h.volume), sum(h.close), count(*),
+           min(h.the_timestamp), max(h.the_timestamp)
+    FROM touched t
+    JOIN stockpricehistory h
+      ON h.symbol = t.symbol
+     AND h.the_timestamp >= t.bucket
+     AND h.the_timestamp < t.bucket + ('1 ' || t.resolution)::interval
+    GROUP BY t.symbol, t.resolution, t.bucket
+    ON CONFLICT (symbol, resolution, bucket) DO UPDATE
+    SET open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        close = EXCLUDED.close,
+        volume = EXCLUDED.volume,
+        close_sum = EXCLUDED.close_sum,
+        bar_count = EXCLUDED.bar_count,
+        first_ts = EXCLUDED.first_ts,
+        last_ts = EXCLUDED.last_ts
+""")
+ROLLUPS = statement("rollups", """
+    SELECT bucket, open, high, low, close, volume, close_sum, bar_count
+    FROM stockpricerollups
+    WHERE symbol = $1 AND resolution = $2
+    ORDER BY bucket ASC
+""")
+ROLLUPS_FOR = statement("rollups_for", """
+    SELECT symbol, bucket, open, high, low, close, volume, close_sum, bar_count
+    FROM stockpricerollups
+    WHERE symbol = ANY($1::text[]) AND resolution = $2
+    ORDER BY symbol, bucket ASC
+""")
+# Bars for one symbol over a bucket range. At day resolution, weeks whose
+# daily rollups were compacted away come back as their weekly bar.
+BARS = statement("bars", """
+    SELECT bucket, open, high, low, close, volume
+    FROM stockpricerollups
+    WHERE symbol = $1 AND resolution = $2 AND bucket >= $3 AND bucket <= $4
+    UNION ALL
+    SELECT w.bucket, w.open, w.high, w.low, w.close, w.volume
+    FROM stockpricerollups w
+    WHERE $2 = 'day' AND w.symbol = $1 AND w.resolution = 'week'
+      AND w.bucket >= $3 AND w.bucket <= $4
+      AND NOT EXISTS (
+          SELECT 1 FROM stockpricerollups d
+          WHERE d.symbol = w.symbol AND d.resolution = 'day'
+            AND d.bucket >= w.bucket AND d.bucket < w.bucket + 7
+      )
+    ORDER BY bucket
+""")
+# Weeks whose daily rollups were compacted away are represented by their
+# weekly bar, dated on its last trading day.
+DAILY_CLOSES_SINCE = statement("daily_closes_since", """
+    SELECT t.symbol, r.bucket, r.close
+    FROM unnest($1::text[], $2::date[]) AS t(symbol, since)
+    CROSS JOIN LATERAL (
+        SELECT d.bucket, d.close
+        FROM stockpricerollups d
+        WHERE d.symbol = t.symbol AND d.resolution = 'day' AND d.bucket >= t.since
+        UNION ALL
+        SELECT w.last_ts::date, w.close
+        FROM stockpricerollups w
+        WHERE w.symbol = t.symbol AND w.resolution = 'week' AND w.last_ts::date >= t.since
+          AND NOT EXISTS (
+              SELECT 1 FROM stockpricerollups d
+              WHERE d.symbol = w.symbol AND d.resolution = 'day'
+                AND d.bucket >= w.bucket AND d.bucket < w.bucket + 7
+          )
+    ) r
+    ORDER BY t.symbol, r.bucket
+""")
+
+
+async def refresh_rollups(db, symbols: list, days: list, resolutions: list) -> str:
+    return await _run(db, "execute", REFRESH_ROLLUPS, symbols, days, resolutions)
+
+
+async def rollups(db, symbol: str, resolution: str) -> list:
+    return await _run(db, "fetch", ROLLUPS, symbol, resolution)
+
+
+async def rollups_for(db, symbols: list, resolution: str) -> list:
+    return await _run(db, "fetch", ROLLUPS_FOR, symbols, resolution)
+
+
+async def bars(db, symbol: str, resolution: str, start, end) -> list:
+    return await _run(db, "fetch", BARS, symbol, resolution, start, end)
+
+
+async def daily_closes_since(db, symbols: list, since: list) -> list:
+    return await _run(db, "fetch", DAILY_CLOSES_SINCE, symbols, since)
+
+
+# Risk metrics
+
+# Each symbol's daily closes since $1 as two arrays, day numbers since the
+# epoch and closes; compacted weeks contribute their weekly close.
+RISK_WINDOW = statement("risk_window", """
+    SELECT c.symbol,
+           array_agg(c.bucket - DATE '1970-01-01' ORDER BY c.bucket) AS days,
+           array_agg(c.close ORDER BY c.bucket) AS closes
+    FROM (
+        SELECT d.symbol, d.bucket, d.close
+        FROM stockpricerollups d
+        WHERE d.resolution = 'day' AND d.bucket >= $1 AND d.close IS NOT NULL
+        UNION ALL
+        SELECT w.symbol, w.last_ts::date, w.close
+        FROM stockpricerollups w
+        WHERE w.resolution = 'week' AND w.last_ts::date >= $1 AND w.close IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM stockpricerollups d
+              WHERE d.symbol = w.symbol AND d.resolution = 'day'
+                AND d.bucket >= w.bucket AND d.bucket < w.bucket + 7
+          )
+    ) c
+    GROUP BY c.symbol
+    ORDER BY c.symbol
+""")
+RISK_METRICS_COMPUTED_AT = statement("risk_metrics_computed_at", "SELECT max(computed_at) FROM riskmetrics")
+CLEAR_RISK_METRICS = statement("clear_risk_metrics", "DELETE FROM riskmetrics")
+INSERT_RISK_METRICS = statement("insert_risk_metrics", """
+    INSERT INTO riskmetrics (
+        symbol, benchmark, beta, volatility, annual_return, sharpe, max_drawdown,
+        observations, first_day, last_day, computed_at
+    )
+    SELECT t.symbol, $10, t.beta, t.volatility, t.annual_return, t.sharpe, t.max_drawdown,
+           t.observations, t.first_day, t.last_day, $11
+    FROM unnest(
+        $1::text[], $2::float8[], $3::float8[], $4::float8[], $5::float8[], $6::float8[],
+        $7::int[], $8::date[], $9::date[]
+    ) AS t(symbol, beta, volatility, annual_return, sharpe, max_drawdown, observations, first_day, last_day)
+""")
+RISK_METRIC_COLUMNS = """
+    symbol, benchmark, beta, volatility, annual_return, sharpe, max_drawdown,
+    observations, first_day, last_day, computed_at
+"""
+
+
+async def risk_window(db, since) -> list:
+    return await _run(db, "fetch", RISK_WINDOW, since)
+
+
+async def risk_metrics_computed_at(db):
+    return await _run(db, "fetchval", RISK_METRICS_COMPUTED_AT)
+
+
+async def replace_risk_metrics(db, symbols: list, beta: list, volatility: list, annual_return: list, sharpe: list,
+                               max_drawdown: list, observations: list, first_day: list, last_day: list,
+                               benchmark: str, computed_at) -> str:
+    # Called inside a transaction, so readers see the old or the new snapshot.
+    await _run(db, "execute", CLEAR_RISK_METRICS)
+    return await _run(
+        db, "execute", INSERT_RISK_METRICS, symbols, beta, volatility, annual_return, sharpe, max_drawdown,
+        observations, first_day, last_day, benchmark, computed_at
+    )
+
+
+# SET LOCAL takes no parameters; set_config(..., true) is its bindable form
+# and likewise lasts until the end of the current transaction.
+SET_TRANSACTION_TIMEOUTS = statement("set_transaction_timeouts", """
+    SELECT set_config('statement_timeout', $1, true),
+           set_config('idle_in_transaction_session_timeout', $2, true)
+""")
+
+
+async def set_transaction_timeouts(db, statement_ms: int, idle_ms: int):
+    await _run(db, "execute", SET_TRANSACTION_TIMEOUTS, str(statement_ms), str(idle_ms))
@@ -0,0 +1,64 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+CENT = Decimal("0.01")
+
+
+def order_total(shares, price) -> Decimal:
+    # What execute_trades charges or credits for an order: the float8 price
+    # as Postgres converts it to numeric, times the shares, rounded half away
+    # from zero to the cent.
+    return (abs(int(shares)) * Decimal(f"{price:.15g}")).quantize(CENT, ROUND_HALF_UP)
+
+
+def plan_rebalance(symbols, shares, prices, weights, cash):
+    # symbols/shares/prices/weights are aligned per symbol; every symbol is
+    # either held, targeted, or both. Targets are whole shares rounded down,
+    # so the buys always fit inside the value the sells free up.
+    symbols = np.asarray(symbols)
+    shares = np.asarray(shares, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    total_value = cash + float(shares @ prices)
+    target = np.floor(weights * total_value / prices).astype(np.int64)
+    delta = target - shares
+
+    # Sells first so their proceeds fund the buys when executed in order.
+    order = np.lexsort((symbols, delta > 0))
+    order = order[delta[order] != 0]
+
+    # Each order is charged its total rounded to the cent, which can leave a
+    # fully invested plan a cent or two short by its last buy; walk the
+    # orders as execute_trades will and trim any buy the cash left can't cover.
+    cash_left = Decimal(f"{cash:.15g}")
+    for i in order:
+        if delta[i] > 0:
+            affordable = max(0, int(cash_left / Decimal(f"{prices[i]:.15g}")))
+            delta[i] = min(int(delta[i]), affordable)
+            while delta[i] > 0 and order_total(delta[i], prices[i]) > cash_left:
+                delta[i] -= 1
+            cash_left -= order_total(delta[i], prices[i])
+        else:
+            cash_left += order_total(delta[i], prices[i])
+    target = shares + delta
+    order = order[delta[order] != 0]
+
+    trades = [
+        {
+            "stock_symbol": str(symbols[i]),
+            "current_shares": int(shares[i]),
+            "target_shares": int(target[i]),
+            "shares": int(delta[i]),
+            "price": float(prices[i]),
+            "target_weight": round(float(weights[i]), 6),
+            "estimated_value": float(order_total(delta[i], prices[i])) * (1 if delta[i] > 0 else -1),
+        }
+        for i in order
+    ]
+    return {
+        "total_value": round(total_value, 2),
+        "estimated_cash_after": float(cash_left),
+        "trades": trades,
+    }
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import queries
+from statsengine import EPOCH
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS = 252
+RISK_LOCK = 0x5249534B  # advisory lock key, one computation at a time across workers
+METRICS = ["beta", "volatility", "annual_return", "sharpe", "max_drawdown"]
+
+
+def close_matrix(rows):
+    # rows: (symbol, day numbers, closes) per symbol, as returned by
+    # risk_window. Scattered into one (days x symbols) matrix in a single
+    # assignment; days a symbol has no close stay NaN.
+    lengths = [len(row["days"]) for row in rows]
+    days = np.concatenate([np.asarray(row["days"], dtype=np.int64) for row in rows])
+    closes = np.concatenate([np.asarray(row["closes"], dtype=np.float64) for row in rows])
+    all_days, day_index = np.unique(days, return_inverse=True)
+    matrix = np.full((len(all_days), len(rows)), np.nan)
+    matrix[day_index, np.repeat(np.arange(len(rows)), lengths)] = closes
+    return all_days, matrix
+
+
+def compute_metrics(closes, benchmark_col=None, risk_free_rate=0.0, min_observations=20):
+    # Every metric for every column at once. A return spans from a symbol's
+    # previous close to its next one, so a missing day never shows up as a
+    # flat return.
+    present = ~np.isnan(closes)
+    rows = np.arange(len(closes))[:, None]
+    last_seen = np.maximum.accumulate(np.where(present, rows, -1), axis=0)
+    filled = np.take_along_axis(closes, np.maximum(last_seen, 0), axis=0)
+    filled[last_seen < 0] = np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = closes[1:] / filled[:-1] - 1.0
+        observed = ~np.isnan(returns)
+        n = observed.sum(axis=0)
+        values = np.where(observed, returns, 0.0)
+        mean = values.sum(axis=0) / n
+        var = (np.where(observed, values - mean, 0.0) ** 2).sum(axis=0) / (n - 1)
+        volatility = np.sqrt(var * TRADING_DAYS)
+        annual_return = mean * TRADING_DAYS
+        sharpe = (annual_return - risk_free_rate) / volatility
+
+        # Beta over the days both the symbol and the benchmark traded.
+        beta = np.full(closes.shape[1], np.nan)
+        if benchmark_col is not None:
+            bench = returns[:, benchmark_col][:, None]
+            both = observed & ~np.isnan(bench)
+            m = both.sum(axis=0)
+            x = np.where(both, returns, 0.0)
+            y = np.where(both, bench, 0.0)
+            dx = np.where(both, x - x.sum(axis=0) / m, 0.0)
+            dy = np.where(both, y - y.sum(axis=0) / m, 0.0)
+            beta = (dx * dy).sum(axis=0) / (dy * dy).sum(axis=0)
+            beta[m < min_observations] = np.nan
+
+        peak = np.fmax.accumulate(filled, axis=0)
+        drawdown = np.where(present, filled / peak - 1.0, np.inf).min(axis=0)
+
+    too_short = n < min_observations
+    for metric in (volatility, annual_return, sharpe, drawdown):
+        metric[too_short] = np.nan
+
+    first = present.argmax(axis=0)
+    last = len(closes) - 1 - present[::-1].argmax(axis=0)
+    return {
+        "beta": beta,
+        "volatility": volatility,
+        "annual_return": annual_return,
+        "sharpe": sharpe,
+        "max_drawdown": drawdown,
+        "observations": n,
+        "first": first,
+        "last": last,
+    }
+
+
+def _column(values, digits=6):
+    values = np.round(values.astype(np.float64), digits)
+    return [None if not np.isfinite(value) else float(value) for value in values]
+
+
+def _day(number) -> date:
+    return EPOCH + timedelta(days=int(number))
+
+
+# Universe-wide risk metrics: beta against RISK_BENCHMARK, annualized
+# volatility and return, Sharpe ratio and maximum drawdown for every symbol
+# with daily closes in the last RISK_LOOKBACK_DAYS. One query returns each
+# symbol's closes as arrays, they are aligned into a single matrix and every
+# metric is computed column-wise in NumPy. The background job recomputes
+# every interval and replaces the riskmetrics table, which the endpoint reads
+# from, so every worker serves the same snapshot; the advisory lock and the
+# freshness check keep workers from repeating each other's run.
+class RiskMetrics:
+    def __init__(self, benchmark="SPY", lookback_days=365, risk_free_rate=0.0, min_observations=20, interval=3600.0):
+        self.benchmark = benchmark
+        self.lookback_days = lookback_days
+        self.risk_free_rate = risk_free_rate
+        self.min_observations = min_observations
+        self.interval = interval
+        self.last_run = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            benchmark=os.getenv("RISK_BENCHMARK", "SPY").upper(),
+            lookback_days=int(os.getenv("RISK_LOOKBACK_DAYS", "365")),
+            risk_free_rate=float(os.getenv("RISK_FREE_RATE", "0")),
+            min_observations=int(os.getenv("RISK_MIN_OBSERVATIONS", "20")),
+            interval=float(os.getenv("RISK_INTERVAL", "3600")),
+        )
+
+    async def setup(self, db):
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS riskmetrics (
+                symbol TEXT PRIMARY KEY,
+                benchmark TEXT NOT NULL,
+                beta DOUBLE PRECISION,
+                volatility DOUBLE PRECISION,
+                annual_return DOUBLE PRECISION,
+                sharpe DOUBLE PRECISION,
+                max_drawdown DOUBLE PRECISION,
+                observations INTEGER NOT NULL,
+                first_day DATE,
+                last_day DATE,
+                computed_at TIMESTAMP NOT NULL
+            )
+        """)
+
+    async def compute(self, db, force=False, now=None):
+        now = now or datetime.now()
+        result = {"started": now, "symbols": 0, "benchmark": self.benchmark}
+
+        # A session lock rather than a transaction one: the window is read,
+        # the metrics computed and the snapshot replaced with no transaction
+        # open in between, so the connection never sits idle in one while
+        # NumPy runs.
+        if not await db.fetchval("SELECT pg_try_advisory_lock($1)", RISK_LOCK):
+            result["skipped"] = "another computation is running"
+            return result
+        try:
+            computed_at = await queries.risk_metrics_computed_at(db)
+            if not force and computed_at is not None and now - computed_at < timedelta(seconds=self.interval / 2):
+                result["skipped"] = "computed recently"
+                return result
+
+            since = now.date() - timedelta(days=self.lookback_days)
+            rows = await queries.risk_window(db, since)
+            loaded = datetime.now()
+            symbols = [row["symbol"] for row in rows]
+            columns = [[] for _ in range(len(METRICS) + 3)]
+            if rows:
+                # NumPy work runs on a thread so the event loop keeps serving.
+                benchmark_col = symbols.index(self.benchmark) if self.benchmark in symbols else None
+                days, metrics = await asyncio.to_thread(self._compute, rows, benchmark_col)
+                columns = [_column(metrics[name]) for name in METRICS] + [
+                    metrics["observations"].tolist(),
+                    [_day(days[i]) for i in metrics["first"]],
+                    [_day(days[i]) for i in metrics["last"]],
+                ]
+            async with db.transaction():
+                await queries.replace_risk_metrics(db, symbols, *columns, self.benchmark, now)
+        finally:
+            await db.execute("SELECT pg_advisory_unlock($1)", RISK_LOCK)
+
+        result["symbols"] = len(symbols)
+        result["benchmark_found"] = self.benchmark in symbols
+        result["load_seconds"] = round((loaded - now).total_seconds(), 3)
+        result["elapsed_seconds"] = round((datetime.now() - now).total_seconds(), 3)
+        self.last_run = result
+        return result
+
+    def _compute(self, rows, benchmark_col):
+        days, closes = close_matrix(rows)
+        return days, compute_metrics(closes, benchmark_col, self.risk_free_rate, self.min_observations)
+
+    async def run(self, pool):
+        while True:
+            try:
+                async with pool.acquire() as connection:
+                    await self.compute(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Risk metrics computation failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "benchmark": self.benchmark,
+            "lookback_days": self.lookback_days,
+            "risk_free_rate": self.risk_free_rate,
+            "min_observations": self.min_observations,
+            "interval_seconds": self.interval,
+            "last_run": self.last_run,
+        }
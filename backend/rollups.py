@@ -0,0 +1,74 @@
+from datetime import date, datetime
+
+import queries
+
+RESOLUTIONS = ["day", "week", "month"]
+
+
+async def ensure_rollups(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stockpricerollups (
+            symbol TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket DATE NOT NULL,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION,
+            volume BIGINT,
+            close_sum DOUBLE PRECISION NOT NULL,
+            bar_count INTEGER NOT NULL,
+            first_ts TIMESTAMP,
+            last_ts TIMESTAMP,
+            PRIMARY KEY (symbol, resolution, bucket)
+        )
+    """)
+
+    # One-off backfill the first time the table is created against an
+    # existing price history; afterwards the ingestion paths keep it current.
+    if await db.fetchval("SELECT NOT EXISTS (SELECT 1 FROM stockpricerollups)"):
+        await db.execute("""
+            INSERT INTO stockpricerollups
+            SELECT h.symbol, r.resolution, date_trunc(r.resolution, h.the_timestamp)::date,
+                   (array_agg(h.open ORDER BY h.the_timestamp))[1],
+                   max(h.high), min(h.low),
+                   (array_agg(h.close ORDER BY h.the_timestamp DESC))[1],
+                   sum(h.volume), sum(h.close), count(*),
+                   min(h.the_timestamp), max(h.the_timestamp)
+            FROM stockpricehistory h
+            CROSS JOIN unnest($1::text[]) AS r(resolution)
+            GROUP BY 1, 2, 3
+            ON CONFLICT DO NOTHING
+        """, RESOLUTIONS)
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+async def refresh_rollups(db, bars):
+    # bars: iterable of (symbol, the_timestamp). Only the day/week/month
+    # buckets those bars fall into are recomputed, from the raw rows in them,
+    # so re-ingesting an existing bar never double counts.
+    touched = {(symbol, _as_datetime(the_timestamp).date()) for symbol, the_timestamp in bars}
+    if not touched:
+        return
+    symbols = [symbol for symbol, _ in touched]
+    days = [datetime(d.year, d.month, d.day) for _, d in touched]
+
+    await queries.refresh_rollups(db, symbols, days, RESOLUTIONS)
+
+
+async def fetch_rollups(db, symbol: str, resolution: str):
+    return await queries.rollups(db, symbol, resolution)
+
+
+async def fetch_rollups_many(db, symbols, resolution: str):
+    grouped = {}
+    for row in await queries.rollups_for(db, list(symbols), resolution):
+        grouped.setdefault(row["symbol"], []).append(row)
+    return grouped
@@ -1,50 +1,61 @@
 from fastapi import APIRouter, HTTPException, Depends
 from models import LoginRequest, RegisterRequest
-from dependencies import get_db
+from dependencies import get_db, get_sessions, get_current_user
+import queries
 
 router = APIRouter()
 
 @router.post("/login")
-async def login(request_data: LoginRequest, db = Depends(get_db)):
-    query = """
-        SELECT user_id, username FROM users
-        WHERE username = $1 AND password = $2
-    """
-    result = await db.fetchrow(query, request_data.username, request_data.password)
+async def login(request_data: LoginRequest, db = Depends(get_db), sessions = Depends(get_sessions)):
+    result = await queries.find_user_login(db, request_data.username)
 
-    if not result:
+    if not result or not await sessions.check_password(request_data.password, result["password"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    return {"user_id": result["user_id"], "username": result["username"]}
+    if not result["password"].startswith("scrypt$"):
+        await queries.set_user_password(db, result["user_id"], await sessions.hash_password(request_data.password))
+
+    token, expires_at = sessions.issue(result["user_id"], result["username"])
+    return {"user_id": result["user_id"], "username": result["username"], "token": token, "expires_at": expires_at}
 
 @router.post("/register")
-async def register(request_data: RegisterRequest, db = Depends(get_db)):
-    query_check = "SELECT user_id FROM users WHERE username = $1"
-    existing_user = await db.fetchrow(query_check, request_data.username)
+async def register(request_data: RegisterRequest, db = Depends(get_db), sessions = Depends(get_sessions)):
+    existing_user = await queries.find_user_id(db, request_data.username)
 
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    query_insert = """
-        INSERT INTO users (username, password)
-        VALUES ($1, $2)
-        RETURNING user_id, username
-    """
-    result = await db.fetchrow(query_insert, request_data.username, request_data.password)
+    password_hash = await sessions.hash_password(request_data.password)
+    result = await queries.create_user(db, request_data.username, password_hash)
+
+    token, expires_at = sessions.issue(result["user_id"], result["username"])
+    return {"user_id": result["user_id"], "username": result["username"], "token": token, "expires_at": expires_at}
+
+@router.get("/me")
+async def get_me(user = Depends(get_current_user)):
+    return {"user_id": user.user_id, "username": user.username, "expires_at": user.expires_at}
+
+@router.post("/logout")
+async def logout(user = Depends(get_current_user), db = Depends(get_db), sessions = Depends(get_sessions)):
+    await sessions.revoke(db, user)
+    return {"message": "Logged out"}
 
-    return {"user_id": result["user_id"], "username": result["username"]}
+@router.get("/sessions/stats")
+async def get_session_stats(sessions = Depends(get_sessions)):
+    return sessions.stats()
 
+# The logged-in user's id comes with /login and /me; these remain for
+# looking up other users by name.
 @router.get("/user-id")
 async def get_user_id(username: str, db = Depends(get_db)):
-    result = await db.fetchrow("SELECT user_id FROM users WHERE username = $1", username)
+    result = await queries.find_user_id(db, username)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     return {"user_id": result["user_id"]}
 
-@router.get("/get-user-id")
+@router.get("/get-user-id", deprecated=True)
 async def get_user_id(username: str, db = Depends(get_db)):
-    query = "SELECT user_id FROM users WHERE username = $1"
-    result = await db.fetchrow(query, username)
+    result = await queries.find_user_id(db, username)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     return {"user_id": result["user_id"]}
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Request
+from queries import query_stats
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics(request: Request):
+    state = request.app.state
+    pool = state.pool
+    return {
+        "pool": {
+            "size": pool.get_size(),
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "idle": pool.get_idle_size(),
+            "in_use": pool.get_size() - pool.get_idle_size(),
+            "acquire_timeout": state.pool_acquire_timeout,
+            "settings": state.pool_settings,
+        },
+        "acquire_wait": state.metrics.acquire_wait.snapshot(),
+        "acquire_timeouts": state.metrics.acquire_timeouts,
+        "routes": state.metrics.snapshot_routes(),
+        "not_modified": state.versions.not_modified,
+        "event_bus": state.event_bus.stats(),
+        "admission": state.admission.stats(),
+        "startup": {**state.startup.snapshot(), "analytics_preload": state.analytics_preload},
+    }
+
+@router.get("/metrics/queries")
+async def get_query_metrics():
+    return query_stats.snapshot()
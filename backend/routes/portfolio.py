@@ -1,59 +1,64 @@
-from fastapi import APIRouter, HTTPException, Depends
-from dependencies import get_db
+from fastapi import APIRouter, HTTPException, Depends, Query
+from dependencies import get_db, get_stats_engine, get_value_curves, get_versions
+from versions import versioned, query_int
 from models import CreatePortfolioRequest
-import pandas as pd
+from datetime import date
+import queries
 
 router = APIRouter()
 
 @router.post("/create-portfolio")
-async def create_portfolio(request: CreatePortfolioRequest, db=Depends(get_db)):
-    query = """
-        INSERT INTO portfolios (name, user_id, cash_balance)
-        VALUES ($1, $2, $3)
-        RETURNING portfolio_id, name, cash_balance
-    """
-    result = await db.fetchrow(query, request.name, request.user_id, request.cash_balance)
+async def create_portfolio(request: CreatePortfolioRequest, db=Depends(get_db), versions=Depends(get_versions)):
+    result = await queries.create_portfolio(db, request.name, request.user_id, request.cash_balance)
+    versions.remember_owner(result["portfolio_id"], request.user_id)
+    versions.bump(("user_portfolios", request.user_id))
     return dict(result)
 
-@router.get("/portfolios")
-async def get_user_portfolios(user_id: int, db=Depends(get_db)):
-    query = "SELECT portfolio_id, name, cash_balance FROM portfolios WHERE user_id = $1"
-    rows = await db.fetch(query, user_id)
+@router.get("/portfolios", dependencies=[versioned("portfolios", lambda r: [("user_portfolios", query_int(r, "user_id"))])])
+async def get_user_portfolios(user_id: int, db=Depends(get_db), versions=Depends(get_versions)):
+    rows = await queries.list_portfolios(db, user_id)
+    for row in rows:
+        versions.remember_owner(row["portfolio_id"], user_id)
     return [dict(row) for row in rows]
 
 
 @router.get("/portfolio/{portfolio_id}/stats")
-async def get_portfolio_stats(portfolio_id: int, db=Depends(get_db)):
-    # Step 1: Fetch all historical price data for each stock in the portfolio
-    query = """
-        SELECT ph.stock_symbol, sph.the_timestamp, sph.close
-        FROM portfolioholdings ph
-        JOIN stockpricehistory sph ON sph.symbol = ph.stock_symbol
-        WHERE ph.portfolio_id = $1
-        ORDER BY sph.the_timestamp
-    """
-    rows = await db.fetch(query, portfolio_id)
-
-    if not rows:
-        raise HTTPException(status_code=404, detail="No data found for this portfolio")
-
-    # Step 2: Convert to DataFrame
-    df = pd.DataFrame(rows, columns=["stock_symbol", "timestamp", "close"])
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
+async def get_portfolio_stats(
+    portfolio_id: int,
+    lookback_days: int = Query(None, ge=2),
+    db=Depends(get_db),
+    stats_engine=Depends(get_stats_engine)
+):
+    rows = await queries.list_holdings(db, portfolio_id)
 
-    # Step 3: Pivot to time series matrix
-    pivoted = df.pivot(index="timestamp", columns="stock_symbol", values="close")
-    pivoted.dropna(inplace=True)
-    pivoted = pivoted.astype(float)
+    stats = None
+    if rows:
+        stats = await stats_engine.portfolio_stats(db, [row["stock_symbol"] for row in rows], lookback_days)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No data found for this portfolio")
 
+    return stats
 
-    # Step 4: Compute stats
-    cov_matrix = pivoted.cov().round(2)
-    corr_matrix = pivoted.corr().round(2)
-    covs = (pivoted.std() / pivoted.mean()).round(4)  # Coefficient of variation
+@router.get("/portfolio/{portfolio_id}/value-history")
+async def get_portfolio_value_history(
+    portfolio_id: int,
+    start: date = None,
+    end: date = None,
+    db=Depends(get_db),
+    value_curves=Depends(get_value_curves)
+):
+    curve = await value_curves.curve(db, portfolio_id)
+    if curve is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
 
-    return {
-        "coefficient_of_variation": covs.to_dict(),
-        "covariance_matrix": cov_matrix.to_dict(),
-        "correlation_matrix": corr_matrix.to_dict()
-    }
\ No newline at end of file
+    days, cash, market_value = curve
+    return [
+        {
+            "date": day,
+            "cash": round(float(cash[i]), 2),
+            "market_value": round(float(market_value[i]), 2),
+            "total_value": round(float(cash[i] + market_value[i]), 2)
+        }
+        for i, day in enumerate(days)
+        if (start is None or day >= start) and (end is None or day <= end)
+    ]
@@ -1,9 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
-from dependencies import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from dependencies import acquire_connection, get_db, get_price_cache, get_versions
+from versions import versioned
 from pydantic import BaseModel
+from models import BatchOrderRequest, RebalanceRequest
+from rebalance import plan_rebalance
+from datetime import datetime
+import base64
+import json
+import math
+import os
+import queries
 
 router = APIRouter()
 
+# Bounds on the transaction a transaction export holds open: per batch fetch,
+# and for how long a slow reader may leave it idle between batches.
+EXPORT_STATEMENT_TIMEOUT = float(os.getenv("TRANSACTION_EXPORT_STATEMENT_TIMEOUT", "30"))
+EXPORT_IDLE_TIMEOUT = float(os.getenv("TRANSACTION_EXPORT_IDLE_TIMEOUT", "60"))
+
 class StockTransactionRequest(BaseModel):
     portfolio_id: int
     stock_symbol: str
@@ -17,234 +33,386 @@ class CashTransferByNameRequest(BaseModel):
     amount: float
     target_portfolio_name: str
 
+async def execute_orders(db, price_cache, portfolio_id: int, orders):
+    # Prices come from the cache up front; validation and every write for
+    # the whole list then happen in one call to execute_trades.
+    symbols = [symbol for symbol, _ in orders]
+    prices = await price_cache.get_many(db, symbols)
+    rows = await queries.execute_trades(
+        db,
+        portfolio_id,
+        symbols,
+        [shares for _, shares in orders],
+        [prices.get(symbol) for symbol in symbols]
+    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return rows
+
 @router.post("/portfolio/transaction")
-async def handle_stock_transaction(req: StockTransactionRequest, db=Depends(get_db)):
+async def handle_stock_transaction(
+    req: StockTransactionRequest,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    versions=Depends(get_versions)
+):
     if req.shares == 0:
         raise HTTPException(status_code=400, detail="Transaction must involve at least 1 share")
 
-    price_row = await db.fetchrow("""
-        SELECT close FROM stockpricehistory
-        WHERE symbol = $1
-        ORDER BY timestamp DESC
-        LIMIT 1
-    """, req.stock_symbol)
-    if not price_row:
-        raise HTTPException(status_code=404, detail="Stock price not found")
-
-    price_per_share = price_row["close"]
-    total_price = abs(req.shares) * price_per_share
-
-    portfolio = await db.fetchrow(
-        "SELECT cash_balance FROM portfolios WHERE portfolio_id = $1",
-        req.portfolio_id
-    )
+    [result] = await execute_orders(db, price_cache, req.portfolio_id, [(req.stock_symbol, req.shares)])
+    if result["outcome"] != "filled":
+        status_code = 404 if result["reason"] == "Stock price not found" else 400
+        raise HTTPException(status_code=status_code, detail=result["reason"])
+
+    versions.bump_portfolio(req.portfolio_id)
+    return {"status": "success", "new_cash_balance": result["cash_after"]}
+
+@router.post("/portfolio/{portfolio_id}/orders")
+async def submit_orders(
+    portfolio_id: int,
+    req: BatchOrderRequest,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    versions=Depends(get_versions)
+):
+    rows = await execute_orders(db, price_cache, portfolio_id, [(order.stock_symbol, order.shares) for order in req.orders])
+    versions.bump_portfolio(portfolio_id)
+
+    results = [
+        {
+            "stock_symbol": order.stock_symbol,
+            "shares": order.shares,
+            "status": row["outcome"],
+            "detail": row["reason"],
+            "total_price": row["order_total"]
+        }
+        for order, row in zip(req.orders, rows)
+    ]
+    return {
+        "portfolio_id": portfolio_id,
+        "filled": sum(1 for result in results if result["status"] == "filled"),
+        "rejected": sum(1 for result in results if result["status"] == "rejected"),
+        "cash_balance": rows[-1]["cash_after"],
+        "results": results
+    }
+
+@router.post("/portfolio/{portfolio_id}/rebalance")
+async def rebalance_portfolio(
+    portfolio_id: int,
+    req: RebalanceRequest,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    versions=Depends(get_versions)
+):
+    portfolio = await queries.get_cash_balance(db, portfolio_id)
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
-    current_cash = portfolio["cash_balance"]
-    is_buy = req.shares > 0
-    trans_type = "buy" if is_buy else "sell"
-
-    if not is_buy:
-        holding = await db.fetchrow(
-            "SELECT shares FROM portfolioholdings WHERE portfolio_id = $1 AND stock_symbol = $2",
-            req.portfolio_id, req.stock_symbol
-        )
-        if not holding or holding["shares"] < abs(req.shares):
-            raise HTTPException(status_code=400, detail="Insufficient shares to sell")
-
-    if is_buy and current_cash < total_price:
-        raise HTTPException(status_code=400, detail="Insufficient cash")
+    if req.stocklist_id is not None:
+        if not await queries.get_stocklist(db, req.stocklist_id):
+            raise HTTPException(status_code=404, detail="Stocklist not found")
+        items = {row["stock_symbol"]: row["shares"] or 0 for row in await queries.list_stocklist_items(db, req.stocklist_id)}
+        targets = list(items)
+    else:
+        # Checked here rather than in the model: a validation error echoes
+        # its input, and NaN cannot be encoded in the JSON response.
+        if not all(math.isfinite(weight) for weight in req.weights.values()):
+            raise HTTPException(status_code=422, detail="Weights must be finite")
+        targets = list(req.weights)
+
+    held = {row["stock_symbol"]: row["shares"] for row in await queries.list_holdings(db, portfolio_id)}
+    prices = await price_cache.get_many(db, list(set(held) | set(targets)))
+
+    missing = sorted(symbol for symbol in targets if symbol not in prices)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"No price available for: {', '.join(missing)}")
+    # A zero, negative or non-finite price cannot size a position.
+    unusable = sorted(
+        symbol for symbol in (set(held) & set(prices)) | set(targets)
+        if not math.isfinite(prices[symbol]) or prices[symbol] <= 0
+    )
+    if unusable:
+        raise HTTPException(status_code=409, detail=f"Unusable price for: {', '.join(unusable)}")
+
+    if req.stocklist_id is not None:
+        # The stocklist is fully invested in proportion to its items' values.
+        values = {symbol: shares * prices[symbol] for symbol, shares in items.items()}
+        total = sum(values.values())
+        if total <= 0:
+            raise HTTPException(status_code=400, detail="Stocklist has no value to rebalance towards")
+        weights = {symbol: value / total for symbol, value in values.items()}
+    else:
+        weights = req.weights
+
+    # Holdings without a price cannot be valued, so they are left untouched.
+    symbols = sorted((set(held) & set(prices)) | set(weights))
+    plan = plan_rebalance(
+        symbols,
+        [held.get(symbol, 0) for symbol in symbols],
+        [prices[symbol] for symbol in symbols],
+        [weights.get(symbol, 0.0) for symbol in symbols],
+        portfolio["cash_balance"]
+    )
+    result = {"portfolio_id": portfolio_id, "dry_run": req.dry_run, "executed": False, **plan}
+    if req.dry_run or not plan["trades"]:
+        return result
 
+    # All or nothing: the first order execute_trades rejects (holdings or
+    # cash changed since planning) rolls the whole rebalance back.
     async with db.transaction():
-        new_cash = current_cash - total_price if is_buy else current_cash + total_price
-        await db.execute(
-            "UPDATE portfolios SET cash_balance = $1 WHERE portfolio_id = $2",
-            new_cash, req.portfolio_id
-        )
-
-        holding = await db.fetchrow(
-            "SELECT shares FROM portfolioholdings WHERE portfolio_id = $1 AND stock_symbol = $2",
-            req.portfolio_id, req.stock_symbol
+        rows = await queries.execute_trades(
+            db,
+            portfolio_id,
+            [trade["stock_symbol"] for trade in plan["trades"]],
+            [trade["shares"] for trade in plan["trades"]],
+            [trade["price"] for trade in plan["trades"]]
         )
-        if holding:
-            new_shares = holding["shares"] + req.shares
-            if new_shares < 0:
-                raise HTTPException(status_code=400, detail="Negative share count not allowed")
-            elif new_shares == 0:
-                await db.execute(
-                    "DELETE FROM portfolioholdings WHERE portfolio_id = $1 AND stock_symbol = $2",
-                    req.portfolio_id, req.stock_symbol
+        for trade, row in zip(plan["trades"], rows):
+            if row["outcome"] != "filled":
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Rebalance aborted, {trade['stock_symbol']}: {row['reason']}"
                 )
-            else:
-                await db.execute(
-                    "UPDATE portfolioholdings SET shares = $1 WHERE portfolio_id = $2 AND stock_symbol = $3",
-                    new_shares, req.portfolio_id, req.stock_symbol
-                )
-        else:
-            await db.execute(
-                "INSERT INTO portfolioholdings (portfolio_id, stock_symbol, shares) VALUES ($1, $2, $3)",
-                req.portfolio_id, req.stock_symbol, req.shares
-            )
 
-        await db.execute(
-            """
-            INSERT INTO transactions (portfolio_id, stock_symbol, shares, total_price, the_timestamp, trans_type)
-            VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP, $5)
-            """,
-            req.portfolio_id,
-            req.stock_symbol,
-            abs(req.shares),
-            total_price,
-            trans_type
-        )
-
-    return {"status": "success", "new_cash_balance": new_cash}
-
-@router.get("/portfolio/{portfolio_id}/holdings")
-async def get_portfolio_holdings(portfolio_id: int, db=Depends(get_db)):
-    query = """
-        SELECT 
-            ph.stock_symbol,
-            s.company_name,
-            ph.shares,
-            sph.close AS latest_price,
-            (ph.shares * sph.close) AS market_value,
-            p.name AS portfolio_name
-        FROM portfolioholdings ph
-        JOIN portfolios p ON p.portfolio_id = ph.portfolio_id
-        JOIN stocks s ON s.stock_symbol = ph.stock_symbol
-        JOIN LATERAL (
-            SELECT close
-            FROM stockpricehistory
-            WHERE symbol = ph.stock_symbol
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ) sph ON TRUE
-        WHERE ph.portfolio_id = $1
-    """
-    rows = await db.fetch(query, portfolio_id)
-    return [dict(row) for row in rows]
+    versions.bump_portfolio(portfolio_id)
+    result["executed"] = True
+    result["cash_balance"] = rows[-1]["cash_after"]
+    return result
+
+@router.get(
+    "/portfolio/{portfolio_id}/holdings",
+    dependencies=[versioned("holdings", lambda r: [("portfolio", int(r.path_params["portfolio_id"])), ("prices",)])]
+)
+async def get_portfolio_holdings(portfolio_id: int, db=Depends(get_db), price_cache=Depends(get_price_cache)):
+    rows = await queries.list_holdings_detailed(db, portfolio_id)
+    prices = await price_cache.get_many(db, [row["stock_symbol"] for row in rows])
+
+    holdings = []
+    for row in rows:
+        latest_price = prices.get(row["stock_symbol"])
+        if latest_price is None:
+            continue
+        holdings.append({
+            "stock_symbol": row["stock_symbol"],
+            "company_name": row["company_name"],
+            "shares": row["shares"],
+            "latest_price": latest_price,
+            "market_value": row["shares"] * latest_price,
+            "portfolio_name": row["portfolio_name"]
+        })
+    return holdings
 
 @router.get("/portfolio/{portfolio_id}/value")
-async def get_portfolio_value(portfolio_id: int, db=Depends(get_db)):
-    result = await db.fetchrow("""
-        SELECT 
-            SUM(ph.shares * sph.close) AS total_market_value
-        FROM portfolioholdings ph
-        JOIN LATERAL (
-            SELECT close
-            FROM stockpricehistory
-            WHERE symbol = ph.stock_symbol
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ) sph ON TRUE
-        WHERE ph.portfolio_id = $1
-    """, portfolio_id)
-    return {"portfolio_id": portfolio_id, "market_value": float(result["total_market_value"] or 0.0)}
+async def get_portfolio_value(portfolio_id: int, db=Depends(get_db), price_cache=Depends(get_price_cache)):
+    rows = await queries.list_holdings(db, portfolio_id)
+    prices = await price_cache.get_many(db, [row["stock_symbol"] for row in rows])
+    total_market_value = sum(
+        row["shares"] * float(prices[row["stock_symbol"]])
+        for row in rows if row["stock_symbol"] in prices
+    )
+    return {"portfolio_id": portfolio_id, "market_value": float(total_market_value)}
 
 @router.post("/portfolio/{portfolio_id}/deposit")
-async def deposit_cash(portfolio_id: int, req: CashOperationRequest, db=Depends(get_db)):
+async def deposit_cash(portfolio_id: int, req: CashOperationRequest, db=Depends(get_db), versions=Depends(get_versions)):
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
-    await db.execute(
-        """
-        UPDATE portfolios SET cash_balance = cash_balance + $1
-        WHERE portfolio_id = $2
-        """, req.amount, portfolio_id
-    )
+    await queries.add_cash(db, portfolio_id, req.amount)
+    versions.bump_portfolio(portfolio_id)
 
     return {"status": "success", "message": f"${req.amount} deposited"}
 
 @router.post("/portfolio/{portfolio_id}/withdraw")
-async def withdraw_cash(portfolio_id: int, req: CashOperationRequest, db=Depends(get_db)):
+async def withdraw_cash(portfolio_id: int, req: CashOperationRequest, db=Depends(get_db), versions=Depends(get_versions)):
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
-    row = await db.fetchrow("SELECT cash_balance FROM portfolios WHERE portfolio_id = $1", portfolio_id)
+    row = await queries.get_cash_balance(db, portfolio_id)
     if not row:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
     if row["cash_balance"] < req.amount:
         raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    await db.execute(
-        """
-        UPDATE portfolios SET cash_balance = cash_balance - $1
-        WHERE portfolio_id = $2
-        """, req.amount, portfolio_id
-    )
+    await queries.add_cash(db, portfolio_id, -req.amount)
+    versions.bump_portfolio(portfolio_id)
 
     return {"status": "success", "message": f"${req.amount} withdrawn"}
 
 @router.post("/portfolio/{portfolio_id}/transfer")
-async def transfer_cash(portfolio_id: int, req: CashTransferByNameRequest, db=Depends(get_db)):
+async def transfer_cash(portfolio_id: int, req: CashTransferByNameRequest, db=Depends(get_db), versions=Depends(get_versions)):
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
     # Find the target portfolio ID based on name
-    target = await db.fetchrow(
-        "SELECT portfolio_id FROM portfolios WHERE name = $1",
-        req.target_portfolio_name
-    )
+    target = await queries.find_portfolio_by_name(db, req.target_portfolio_name)
     if not target:
         raise HTTPException(status_code=404, detail="Target portfolio not found")
 
     target_id = target["portfolio_id"]
 
     # Check source cash
-    sender_cash = await db.fetchval(
-        "SELECT cash_balance FROM portfolios WHERE portfolio_id = $1", portfolio_id
-    )
-    if sender_cash is None or sender_cash < req.amount:
+    sender = await queries.get_cash_balance(db, portfolio_id)
+    if sender is None or sender["cash_balance"] < req.amount:
         raise HTTPException(status_code=400, detail="Insufficient funds")
 
     async with db.transaction():
-        await db.execute(
-            "UPDATE portfolios SET cash_balance = cash_balance - $1 WHERE portfolio_id = $2",
-            req.amount, portfolio_id
-        )
-        await db.execute(
-            "UPDATE portfolios SET cash_balance = cash_balance + $1 WHERE portfolio_id = $2",
-            req.amount, target_id
-        )
+        await queries.add_cash(db, portfolio_id, -req.amount)
+        await queries.add_cash(db, target_id, req.amount)
+    versions.bump_portfolio(portfolio_id)
+    versions.bump_portfolio(target_id)
 
     return {"status": "success", "message": f"Transferred ${req.amount} to {req.target_portfolio_name}"}
 
 @router.get("/portfolio/{portfolio_id}/cash")
 async def get_cash_balance(portfolio_id: int, db=Depends(get_db)):
-    result = await db.fetchrow("SELECT cash_balance FROM portfolios WHERE portfolio_id = $1", portfolio_id)
+    result = await queries.get_cash_balance(db, portfolio_id)
     if not result:
         raise HTTPException(status_code=404, detail="Portfolio not found")
     return {"cash_balance": float(result["cash_balance"])}
 
 @router.get("/portfolio/id-by-name")
 async def get_portfolio_id_by_name(name: str, user_id: int, db=Depends(get_db)):
-    result = await db.fetchrow(
-        "SELECT portfolio_id FROM portfolios WHERE name = $1 AND user_id = $2",
-        name, user_id
-    )
+    result = await queries.find_user_portfolio_by_name(db, name, user_id)
     if not result:
         raise HTTPException(status_code=404, detail="Portfolio not found")
     return {"portfolio_id": result["portfolio_id"]}
 
-@router.get("/portfolio/user-transactions")
-async def get_user_transactions(user_id: int, db=Depends(get_db)):
-    query = """
-        SELECT 
-            t.transaction_id,
-            t.portfolio_id,
-            p.name AS portfolio_name,
-            t.stock_symbol,
-            t.shares,
-            t.total_price,
-            t.the_timestamp,
-            t.trans_type
+TRANSACTION_COLUMNS = """
+    t.transaction_id,
+    t.portfolio_id,
+    p.name AS portfolio_name,
+    t.stock_symbol,
+    t.shares,
+    t.total_price,
+    t.the_timestamp,
+    t.trans_type
+"""
+
+class TransactionFilters:
+    def __init__(
+        self,
+        user_id: int,
+        portfolio_id: int = None,
+        stock_symbol: str = None,
+        trans_type: str = Query(None, pattern="^(buy|sell)$"),
+        start: datetime = None,
+        end: datetime = None
+    ):
+        self.user_id = user_id
+        self.portfolio_id = portfolio_id
+        self.stock_symbol = stock_symbol
+        self.trans_type = trans_type
+        self.start = start
+        self.end = end
+
+    def where(self, after=None):
+        clauses = ["p.user_id = $1"]
+        args = [self.user_id]
+
+        def add(clause, value):
+            args.append(value)
+            clauses.append(clause.format(f"${len(args)}"))
+
+        if self.portfolio_id is not None:
+            add("t.portfolio_id = {}", self.portfolio_id)
+        if self.stock_symbol:
+            add("t.stock_symbol = {}", self.stock_symbol.upper())
+        if self.trans_type:
+            add("t.trans_type = {}", self.trans_type)
+        if self.start:
+            add("t.the_timestamp >= {}", self.start)
+        if self.end:
+            add("t.the_timestamp < {}", self.end)
+        if after is not None:
+            args.extend(after)
+            clauses.append(f"(t.the_timestamp, t.transaction_id) < (${len(args) - 1}, ${len(args)})")
+        return " AND ".join(clauses), args
+
+def transactions_query(where: str, limit_param: str = ""):
+    return f"""
+        SELECT {TRANSACTION_COLUMNS}
         FROM transactions t
         JOIN portfolios p ON p.portfolio_id = t.portfolio_id
-        WHERE p.user_id = $1
-        ORDER BY t.the_timestamp DESC
+        WHERE {where}
+        ORDER BY t.the_timestamp DESC, t.transaction_id DESC
+        {limit_param}
     """
-    rows = await db.fetch(query, user_id)
-    return [dict(row) for row in rows]
\ No newline at end of file
+
+def encode_cursor(row):
+    raw = f"{row['the_timestamp'].isoformat()}|{row['transaction_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        the_timestamp, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(the_timestamp), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/portfolio/user-transactions")
+async def get_user_transactions(filters: TransactionFilters = Depends(), db=Depends(get_db)):
+    where, args = filters.where()
+    rows = await queries.run_dynamic(db, "fetch", "user_transactions", transactions_query(where), *args)
+    return [dict(row) for row in rows]
+
+@router.get("/portfolio/user-transactions/page")
+async def get_user_transactions_page(
+    filters: TransactionFilters = Depends(),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str = None,
+    db=Depends(get_db)
+):
+    where, args = filters.where(decode_cursor(cursor) if cursor else None)
+    args.append(limit + 1)
+    rows = await queries.run_dynamic(db, "fetch", "user_transactions_page", transactions_query(where, f"LIMIT ${len(args)}"), *args)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "transactions": [dict(row) for row in rows],
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None
+    }
+
+class HeldConnectionResponse(StreamingResponse):
+    # Streams a body reading from a connection checked out by the handler and
+    # returns it to the pool however the response ends, including when the
+    # client leaves before the first chunk and the body never starts.
+    def __init__(self, content, pool, connection, **kwargs):
+        super().__init__(content, **kwargs)
+        self.pool = pool
+        self.connection = connection
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                await self.pool.release(self.connection)
+
+@router.get("/portfolio/user-transactions/stream")
+async def stream_user_transactions(request: Request, filters: TransactionFilters = Depends()):
+    where, args = filters.where()
+    query = transactions_query(where)
+    state = request.app.state
+
+    # Holds its own connection for the life of the response: a server-side
+    # cursor needs an open transaction, and rows are fetched in small batches
+    # so memory stays flat however long the history is. Checked out here, not
+    # through get_db, which would release it before the body is sent, so a
+    # starved pool is still a 503; no query profile, as its header has gone
+    # out by the time the body runs. A reader that stops pulling rows for
+    # EXPORT_IDLE_TIMEOUT has its session ended by the server.
+    connection = await acquire_connection(state)
+
+    async def stream():
+        async with connection.transaction(readonly=True):
+            await queries.set_transaction_timeouts(
+                connection, int(EXPORT_STATEMENT_TIMEOUT * 1000), int(EXPORT_IDLE_TIMEOUT * 1000)
+            )
+            async for row in connection.cursor(query, *args, prefetch=500):
+                yield json.dumps(jsonable_encoder(dict(row))) + "\n"
+
+    return HeldConnectionResponse(stream(), state.pool, connection, media_type="application/x-ndjson")
@@ -0,0 +1,120 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+from dependencies import acquire_connection, get_price_cache, get_price_feed
+
+router = APIRouter()
+
+HEARTBEAT_SECONDS = float(os.getenv("PRICE_STREAM_HEARTBEAT", "15"))
+
+def parse_symbols(value) -> list:
+    if isinstance(value, str):
+        value = value.split(",")
+    return sorted({symbol.strip().upper() for symbol in value if symbol.strip()})
+
+async def snapshot(state, price_cache, symbols) -> list:
+    # The current quote per symbol, so a new subscriber starts from the
+    # latest price rather than waiting for the next bar.
+    if not symbols:
+        return []
+    connection = await acquire_connection(state)
+    try:
+        entries = await price_cache.get_many_entries(connection, symbols)
+    finally:
+        await state.pool.release(connection)
+    return [
+        json.dumps({"symbol": symbol, "time": entries[symbol][0].isoformat(), "close": entries[symbol][1]})
+        for symbol in sorted(entries)
+    ]
+
+@router.get("/stock/stream")
+async def stream_prices_sse(
+    request: Request,
+    symbols: str,
+    price_cache=Depends(get_price_cache),
+    feed=Depends(get_price_feed)
+):
+    symbols = parse_symbols(symbols)
+    if not symbols:
+        raise HTTPException(status_code=400, detail="Subscribe to at least one symbol")
+    try:
+        feed.check(symbols)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def stream():
+        # Subscribed only once the body is being sent: the generator's
+        # finally does not run if it is never iterated.
+        subscription = None
+        try:
+            subscription = feed.subscribe(symbols)
+            for message in await snapshot(request.app.state, price_cache, symbols):
+                yield f"event: quote\ndata: {message}\n\n"
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscription.next(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                for message in messages:
+                    yield f"event: bar\ndata: {message}\n\n"
+        finally:
+            if subscription is not None:
+                feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/stock/stream")
+async def stream_prices_ws(websocket: WebSocket, feed=Depends(get_price_feed)):
+    # Clients pass ?symbols=AAPL,MSFT and may later send
+    # {"subscribe": [...]} or {"unsubscribe": [...]}.
+    price_cache = websocket.app.state.price_cache
+    await websocket.accept()
+    try:
+        subscription = feed.subscribe(parse_symbols(websocket.query_params.get("symbols", "")))
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    async def send(messages):
+        for message in messages:
+            await websocket.send_text(message)
+
+    async def pump():
+        # Sending waits on the socket, so a slow client only holds back its
+        # own subscription, which coalesces meanwhile.
+        await send(await snapshot(websocket.app.state, price_cache, subscription.symbols))
+        while True:
+            await send(await subscription.next())
+
+    async def listen():
+        while True:
+            try:
+                request = await websocket.receive_json()
+                added = parse_symbols(request.get("subscribe", []))
+                feed.update(subscription, add=added, remove=parse_symbols(request.get("unsubscribe", [])))
+            except (ValueError, AttributeError, TypeError) as e:
+                await websocket.send_json({"error": str(e) or "Invalid subscription message"})
+                continue
+            await send(await snapshot(websocket.app.state, price_cache, added))
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(listen())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        feed.unsubscribe(subscription)
+
+@router.get("/stock/stream/stats")
+async def get_price_stream_stats(feed=Depends(get_price_feed)):
+    return feed.stats()
@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Depends, Query
+from dependencies import get_current_user, get_db, get_risk_metrics
+import queries
+
+router = APIRouter()
+
+RISK_SORTS = ["symbol", "beta", "volatility", "annual_return", "sharpe", "max_drawdown", "observations"]
+
+class RiskFilters:
+    def __init__(
+        self,
+        symbols: str = None,
+        min_beta: float = None,
+        max_beta: float = None,
+        min_volatility: float = None,
+        max_volatility: float = None,
+        min_sharpe: float = None,
+        max_sharpe: float = None,
+        min_annual_return: float = None,
+        max_annual_return: float = None,
+        max_drawdown_above: float = Query(None, le=0, description="drawdowns are negative; -0.2 keeps those above -20%"),
+        min_observations: int = None
+    ):
+        self.symbols = sorted({s.strip().upper() for s in symbols.split(",") if s.strip()}) if symbols else None
+        self.bounds = [
+            ("beta", ">=", min_beta), ("beta", "<=", max_beta),
+            ("volatility", ">=", min_volatility), ("volatility", "<=", max_volatility),
+            ("sharpe", ">=", min_sharpe), ("sharpe", "<=", max_sharpe),
+            ("annual_return", ">=", min_annual_return), ("annual_return", "<=", max_annual_return),
+            ("max_drawdown", ">=", max_drawdown_above),
+            ("observations", ">=", min_observations),
+        ]
+
+    def where(self):
+        clauses = ["TRUE"]
+        args = []
+
+        def add(clause, value):
+            args.append(value)
+            clauses.append(clause.format(f"${len(args)}"))
+
+        if self.symbols:
+            add("symbol = ANY({}::text[])", self.symbols)
+        for column, op, value in self.bounds:
+            if value is not None:
+                add(f"{column} {op} {{}}", value)
+        return " AND ".join(clauses), args
+
+@router.get("/stock/risk-metrics")
+async def get_risk_metrics_table(
+    filters: RiskFilters = Depends(),
+    sort: str = Query("symbol", pattern=f"^({'|'.join(RISK_SORTS)})$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db=Depends(get_db)
+):
+    where, args = filters.where()
+    args.extend([limit, offset])
+    # sort and order are whitelisted above; symbol breaks ties so pages are stable.
+    rows = await queries.run_dynamic(db, "fetch", "risk_metrics_page", f"""
+        SELECT {queries.RISK_METRIC_COLUMNS}, count(*) OVER () AS total
+        FROM riskmetrics
+        WHERE {where}
+        ORDER BY {sort} {order.upper()} NULLS LAST, symbol
+        LIMIT ${len(args) - 1} OFFSET ${len(args)}
+    """, *args)
+
+    return {
+        "total": rows[0]["total"] if rows else 0,
+        "computed_at": rows[0]["computed_at"] if rows else None,
+        "benchmark": rows[0]["benchmark"] if rows else None,
+        "metrics": [
+            {key: value for key, value in row.items() if key not in ("total", "computed_at", "benchmark")}
+            for row in rows
+        ]
+    }
+
+@router.get("/stock/risk-metrics/stats")
+async def get_risk_metrics_stats(risk_metrics=Depends(get_risk_metrics)):
+    return risk_metrics.stats()
+
+@router.post("/stock/risk-metrics/refresh")
+async def refresh_risk_metrics(
+    user=Depends(get_current_user),
+    db=Depends(get_db),
+    risk_metrics=Depends(get_risk_metrics)
+):
+    # Logged-in users only, and never forced: a snapshot newer than half the
+    # interval is kept, as it is for the background job.
+    return await risk_metrics.compute(db)
@@ -1,62 +1,64 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi import Request
-from dependencies import get_db
+from dependencies import get_db, get_price_cache, get_stocklist_feed, get_versions
+from versions import versioned, query_int
 from models import StocklistCreate, StocklistItem, ShareRequest, DeleteStocklistRequest, ReviewCreate
+import base64
+import json
+import math
+import queries
 
 router = APIRouter()
 
-@router.get("/get-stocklists")
+@router.get("/get-stocklists", dependencies=[versioned("stocklists", lambda r: [("user_stocklists", query_int(r, "user_id"))])])
 async def get_stocklists(user_id: int, db = Depends(get_db)):
-    query = """
-        SELECT stocklist_id, name, is_public FROM stocklists
-        WHERE creator_id = $1
-    """
-    rows = await db.fetch(query, user_id)
+    rows = await queries.list_user_stocklists(db, user_id)
     return [dict(row) for row in rows]
 
 @router.post("/create-stocklist")
-async def create_stocklist(request: StocklistCreate, db = Depends(get_db)):
-    query = """
-        INSERT INTO stocklists (name, is_public, creator_id)
-        VALUES ($1, $2, $3)
-        RETURNING stocklist_id
-    """
-    row = await db.fetchrow(query, request.name, request.is_public, request.creator_id)
+async def create_stocklist(
+    request: StocklistCreate,
+    db = Depends(get_db),
+    feed = Depends(get_stocklist_feed),
+    versions = Depends(get_versions)
+):
+    row = await queries.create_stocklist(db, request.name, request.is_public, request.creator_id)
+    feed.invalidate(row["stocklist_id"])
+    versions.bump(("user_stocklists", request.creator_id))
     return {"stocklist_id": row["stocklist_id"]}
 
 @router.delete("/delete-stocklist")
-async def delete_stocklist(request: DeleteStocklistRequest, db = Depends(get_db)):
-    check = await db.fetchrow("SELECT * FROM stocklists WHERE stocklist_id = $1 AND creator_id = $2", request.stocklist_id, request.user_id)
-    if not check:
+async def delete_stocklist(
+    request: DeleteStocklistRequest,
+    db = Depends(get_db),
+    feed = Depends(get_stocklist_feed),
+    versions = Depends(get_versions)
+):
+    check = await queries.get_stocklist(db, request.stocklist_id)
+    if not check or check["creator_id"] != request.user_id:
         raise HTTPException(status_code=403, detail="You do not own this stocklist")
 
-    await db.execute("DELETE FROM stocklistitems WHERE stocklist_id = $1", request.stocklist_id)
-    await db.execute("DELETE FROM sharedstocklists WHERE stocklist_id = $1", request.stocklist_id)
-    await db.execute("DELETE FROM stocklists WHERE stocklist_id = $1", request.stocklist_id)
+    await queries.delete_stocklist(db, request.stocklist_id)
+    feed.invalidate(request.stocklist_id)
+    versions.bump(("user_stocklists", request.user_id))
     return {"message": "Stocklist deleted"}
 
 @router.post("/stocklists/{stocklist_id}/add-stock")
-async def add_stocklist_item(stocklist_id: int, item: StocklistItem, db = Depends(get_db)):
-    await db.execute("""
-        INSERT INTO stocklistitems (stocklist_id, stock_symbol, shares)
-        VALUES ($1, $2, $3)
-        ON CONFLICT (stocklist_id, stock_symbol) DO UPDATE
-        SET shares = stocklistitems.shares + EXCLUDED.shares
-    """, stocklist_id, item.stock_symbol, item.shares)
+async def add_stocklist_item(stocklist_id: int, item: StocklistItem, db = Depends(get_db), feed = Depends(get_stocklist_feed)):
+    await queries.add_stocklist_item(db, stocklist_id, item.stock_symbol, item.shares)
+    feed.invalidate(stocklist_id)
     return {"message": "Stock added to list"}
 
 @router.delete("/stocklists/{stocklist_id}/remove-stock/{stock_symbol}")
-async def remove_stocklist_item(stocklist_id: int, stock_symbol: str, db = Depends(get_db)):
-    await db.execute(
-        "DELETE FROM stocklistitems WHERE stocklist_id = $1 AND stock_symbol = $2",
-        stocklist_id, stock_symbol
-    )
+async def remove_stocklist_item(stocklist_id: int, stock_symbol: str, db = Depends(get_db), feed = Depends(get_stocklist_feed)):
+    await queries.remove_stocklist_item(db, stocklist_id, stock_symbol)
+    feed.invalidate(stocklist_id)
     return {"message": "Stock removed from list"}
 
 
 @router.post("/stocklists/{stocklist_id}/share")
 async def share_stocklist(stocklist_id: int, request: ShareRequest, db = Depends(get_db)):
-    list_info = await db.fetchrow("SELECT * FROM stocklists WHERE stocklist_id = $1", stocklist_id)
+    list_info = await queries.get_stocklist(db, stocklist_id)
     if not list_info:
         raise HTTPException(status_code=404, detail="Stocklist not found")
     if list_info["is_public"]:
@@ -64,33 +66,17 @@ async def share_stocklist(stocklist_id: int, request: ShareRequest, db = Depends
     if list_info["creator_id"] != request.owner_id:
         raise HTTPException(status_code=403, detail="Only the owner can share the stocklist")
 
-    await db.execute("""
-        INSERT INTO sharedstocklists (stocklist_id, sharedto_id)
-        VALUES ($1, $2)
-        ON CONFLICT DO NOTHING
-    """, stocklist_id, request.sharedto_id)
+    await queries.share_stocklist(db, stocklist_id, request.sharedto_id)
     return {"message": "Stocklist shared"}
 
 @router.get("/stocklists/{stocklist_id}/shared-users")
 async def get_shared_users(stocklist_id: int, db=Depends(get_db)):
-    query = """
-        SELECT u.user_id, u.username
-        FROM sharedstocklists s
-        JOIN users u ON s.sharedto_id = u.user_id
-        WHERE s.stocklist_id = $1
-    """
-    rows = await db.fetch(query, stocklist_id)
+    rows = await queries.list_shared_users(db, stocklist_id)
     return [{"user_id": row["user_id"], "username": row["username"]} for row in rows]
 
 @router.get("/stocklists/{stocklist_id}/my-reviews")
 async def get_reviews(stocklist_id: int, db = Depends(get_db)):
-    query = """
-        SELECT r.review_id, r.reviewer_id, u.username, r.content, r.the_timestamp
-        FROM reviews r
-        JOIN users u ON r.reviewer_id = u.user_id
-        WHERE r.stocklist_id = $1
-    """
-    rows = await db.fetch(query, stocklist_id)
+    rows = await queries.list_stocklist_reviews(db, stocklist_id)
     return [{
         "review_id": row["review_id"],
         "reviewer_id": row["reviewer_id"],
@@ -100,87 +86,90 @@ async def get_reviews(stocklist_id: int, db = Depends(get_db)):
     } for row in rows]
 
 @router.delete("/reviews/{review_id}")
-async def delete_review(review_id: int, db = Depends(get_db)):
-    await db.execute("DELETE FROM reviews WHERE review_id = $1", review_id)
+async def delete_review(review_id: int, db = Depends(get_db), feed = Depends(get_stocklist_feed)):
+    stocklist_id = await queries.delete_review(db, review_id)
+    if stocklist_id is not None:
+        feed.invalidate(stocklist_id)
     return {"message": "Review deleted"}
 
 @router.get("/stocklists/{stocklist_id}/value")
-async def get_stocklist_value(stocklist_id: int, db=Depends(get_db)):
-    result = await db.fetchrow("""
-        SELECT 
-            SUM(i.shares * sp.close) AS total_market_value
-        FROM stocklistitems i
-        JOIN LATERAL (
-            SELECT close
-            FROM stockpricehistory
-            WHERE stock_symbol = i.stock_symbol
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ) sp ON TRUE
-        WHERE i.stocklist_id = $1
-    """, stocklist_id)
+async def get_stocklist_value(stocklist_id: int, db=Depends(get_db), price_cache=Depends(get_price_cache)):
+    rows = await queries.list_stocklist_items(db, stocklist_id)
+    prices = await price_cache.get_many(db, [row["stock_symbol"] for row in rows])
+    total_market_value = sum(
+        row["shares"] * float(prices[row["stock_symbol"]])
+        for row in rows if row["stock_symbol"] in prices
+    )
 
     return {
         "stocklist_id": stocklist_id,
-        "value": float(result["total_market_value"] or 0.0)
+        "value": float(total_market_value)
     }
 
 @router.get("/stocklists/get-public-stocklists")
 async def get_public_stocklists(db = Depends(get_db)):
-    query = """
-        SELECT s.stocklist_id, s.name, u.username AS owner_username
-        FROM stocklists s
-        JOIN users u ON s.creator_id = u.user_id
-        WHERE s.is_public = TRUE
-    """
-    rows = await db.fetch(query)
+    rows = await queries.list_public_stocklists(db)
     return [dict(row) for row in rows]
 
+def encode_feed_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_feed_cursor(cursor: str, sort: str):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != (1 if sort == "newest" else 2):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # (id,) or (count or value, id); bool is an int to Python but never a key.
+    *values, stocklist_id = key
+    if not isinstance(stocklist_id, int) or isinstance(stocklist_id, bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for value in values:
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
+
+@router.get("/stocklists/public-feed")
+async def get_public_feed(
+    sort: str = Query("newest", pattern="^(newest|most_reviewed|highest_value)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = None,
+    db = Depends(get_db),
+    feed = Depends(get_stocklist_feed)
+):
+    after = decode_feed_cursor(cursor, sort) if cursor else None
+    rows, next_key = await feed.page(db, sort, after, limit)
+    return {
+        "stocklists": rows,
+        "next_cursor": encode_feed_cursor(next_key) if next_key is not None else None
+    }
+
 @router.get("/stocklists/stocklists-shared-with-me")
 async def get_shared_stocklists(user_id: int, db = Depends(get_db)):
-    query = """
-        SELECT s.stocklist_id, s.name, u.username AS owner_username
-        FROM sharedstocklists sh
-        JOIN stocklists s ON sh.stocklist_id = s.stocklist_id
-        JOIN users u ON s.creator_id = u.user_id
-        WHERE sh.sharedto_id = $1
-    """
-    rows = await db.fetch(query, user_id)
+    rows = await queries.list_stocklists_shared_with(db, user_id)
     return [dict(row) for row in rows]
 
 @router.post("/create-review")
-async def create_review(request: ReviewCreate, db = Depends(get_db)):
-    existing = await db.fetchrow("""
-        SELECT 1 FROM reviews
-        WHERE reviewer_id = $1 AND stocklist_id = $2
-    """, request.reviewer_id, request.stocklist_id)
+async def create_review(request: ReviewCreate, db = Depends(get_db), feed = Depends(get_stocklist_feed)):
+    existing = await queries.find_review(db, request.reviewer_id, request.stocklist_id)
 
     if existing:
         raise HTTPException(status_code=400, detail="You have already reviewed this stocklist")
 
-    await db.execute("""
-        INSERT INTO reviews (reviewer_id, stocklist_id, content)
-        VALUES ($1, $2, $3)
-    """, request.reviewer_id, request.stocklist_id, request.content)
+    await queries.create_review(db, request.reviewer_id, request.stocklist_id, request.content)
+    feed.invalidate(request.stocklist_id)
     return {"message": "Review added"}
 
 @router.delete("/delete-review")
-async def delete_user_review(user_id: int, stocklist_id: int, db = Depends(get_db)):
-    result = await db.execute("""
-        DELETE FROM reviews
-        WHERE reviewer_id = $1 AND stocklist_id = $2
-    """, user_id, stocklist_id)
+async def delete_user_review(user_id: int, stocklist_id: int, db = Depends(get_db), feed = Depends(get_stocklist_feed)):
+    result = await queries.delete_user_review(db, user_id, stocklist_id)
+    feed.invalidate(stocklist_id)
     return {"message": "Review deleted", "details": result}
 
 @router.get("/my-reviews-for-others")
 async def get_my_reviews(user_id: int, db = Depends(get_db)):
-    query = """
-        SELECT r.review_id, r.stocklist_id, s.name AS stocklist_name, r.content, r.the_timestamp
-        FROM reviews r
-        JOIN stocklists s ON r.stocklist_id = s.stocklist_id
-        WHERE r.reviewer_id = $1
-    """
-    rows = await db.fetch(query, user_id)
+    rows = await queries.list_reviews_by_user(db, user_id)
     return [
         {
             "review_id": row["review_id"],
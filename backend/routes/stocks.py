@@ -1,92 +1,257 @@
-from fastapi import APIRouter, HTTPException, Depends
-from dependencies import get_db
-from models import FullStockPriceInput
-from fastapi import APIRouter, HTTPException, Depends
-from dependencies import get_db
-import pandas as pd
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import json
+import numpy as np
+from dependencies import get_db, get_price_cache, get_forecast_engine, get_stats_engine, get_price_storage, get_versions, get_symbol_search
+from datetime import date, datetime
+from forecast import ForecastTimeout
+from ingest import ingest_stream
+from pricefeed import publish_bars, publish_history
+from rollups import fetch_rollups, fetch_rollups_many, refresh_rollups
+from models import FullStockPriceInput, BatchForecastRequest
+from versions import versioned
+import queries
 
 router = APIRouter()
 
+NOT_ENOUGH_DATA = "Not enough data to make predictions"
+
+def monthly_closes(rows):
+    if not rows or sum(row["bar_count"] for row in rows) < 12:
+        return None
+    return [row["bucket"] for row in rows], [row["close_sum"] / row["bar_count"] for row in rows]
+
 @router.get("/stock/{symbol}/latest-price")
-async def get_latest_price(symbol: str, db=Depends(get_db)):
-    row = await db.fetchrow(
-        "SELECT close FROM stockpricehistory WHERE symbol = $1 ORDER BY the_timestamp DESC LIMIT 1",
-        symbol.upper()
-    )
-    if not row:
+async def get_latest_price(symbol: str, db=Depends(get_db), price_cache=Depends(get_price_cache)):
+    price = await price_cache.get(db, symbol.upper())
+    if price is None:
         raise HTTPException(status_code=404, detail="Stock not found or invalid")
-    return {"symbol": symbol.upper(), "latest_price": row["close"]}
+    return {"symbol": symbol.upper(), "latest_price": price}
+
+@router.get("/stock/search")
+async def search_stocks(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    symbol_search=Depends(get_symbol_search)
+):
+    # Served from memory without a connection, so it can run per keystroke.
+    return {"query": q, "results": symbol_search.search(q, limit)}
+
+@router.get("/stock/search/stats")
+async def get_symbol_search_stats(symbol_search=Depends(get_symbol_search)):
+    return symbol_search.stats()
+
+@router.get("/stock/price-cache/stats")
+async def get_price_cache_stats(price_cache=Depends(get_price_cache)):
+    return price_cache.stats()
 
 @router.post("/stock/add-price")
-async def add_full_stock_price(data: FullStockPriceInput, db=Depends(get_db)):
-    query = """
-        INSERT INTO stockpricehistory (symbol, open, high, low, close, volume)
-        VALUES ($1, $2, $3, $4, $5, $6)
-    """
-    await db.execute(query,
-        data.stock_symbol.upper(),
-        data.open,
-        data.high,
-        data.low,
-        data.close,
-        data.volume
-    )
+async def add_full_stock_price(
+    data: FullStockPriceInput,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    stats_engine=Depends(get_stats_engine),
+    storage=Depends(get_price_storage),
+    versions=Depends(get_versions)
+):
+    async with db.transaction():
+        now = datetime.now()
+        await storage.ensure_partitions(db, now, now)
+        row = await queries.insert_price(
+            db,
+            data.stock_symbol.upper(),
+            data.open,
+            data.high,
+            data.low,
+            data.close,
+            data.volume
+        )
+        bars = [(row["symbol"], row["the_timestamp"])]
+        await refresh_rollups(db, bars)
+        await publish_bars(db, [row])
+        await publish_history(db, bars)
+    price_cache.update(row["symbol"], row["the_timestamp"], row["close"])
+    stats_engine.touch([(row["symbol"], row["the_timestamp"])])
+    versions.bump(("symbol", row["symbol"]))
     return {"message": "Full stock price data added successfully"}
 
-@router.get("/stock/{symbol}/history")
+@router.post("/stock/bulk-prices")
+async def bulk_add_stock_prices(
+    request: Request,
+    format: str = Query(None, pattern="^(csv|ndjson)$"),
+    chunk_size: int = Query(5000, ge=100, le=50000),
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    stats_engine=Depends(get_stats_engine),
+    storage=Depends(get_price_storage),
+    versions=Depends(get_versions)
+):
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if "json" in content_type else "csv"
+
+    try:
+        return await ingest_stream(db, request.stream(), format, chunk_size, price_cache, stats_engine, storage, versions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/stock/storage/stats")
+async def get_price_storage_stats(db=Depends(get_db), storage=Depends(get_price_storage)):
+    return await storage.stats(db)
+
+BAR_RESOLUTIONS = {"1d": "day", "1w": "week", "1M": "month"}
+BAR_LAYOUT = "time:int64,open:float64,high:float64,low:float64,close:float64,volume:int64;little-endian;columnar"
+
+def bar_columns(rows):
+    # Missing prices become NaN and missing volume 0 so every column keeps
+    # a fixed-width dtype.
+    epoch_days = np.array([row["bucket"].toordinal() for row in rows], dtype="<i8") - date(1970, 1, 1).toordinal()
+    return {
+        "time": epoch_days * 86400,
+        "open": np.array([row["open"] for row in rows], dtype="<f8"),
+        "high": np.array([row["high"] for row in rows], dtype="<f8"),
+        "low": np.array([row["low"] for row in rows], dtype="<f8"),
+        "close": np.array([row["close"] for row in rows], dtype="<f8"),
+        "volume": np.array([row["volume"] or 0 for row in rows], dtype="<i8"),
+    }
+
+def symbol_keys(request):
+    return [("symbol", request.path_params["symbol"].upper())]
+
+@router.get("/stock/{symbol}/bars", dependencies=[versioned("bars", lambda r: symbol_keys(r) + [("storage",)])])
+async def get_bars(
+    symbol: str,
+    response: Response,
+    resolution: str = Query("1d", pattern="^(1d|1w|1M)$"),
+    start: date = None,
+    end: date = None,
+    format: str = Query("columns", pattern="^(columns|rows|binary)$"),
+    db=Depends(get_db)
+):
+    # The responses below are built directly, so the ETag set by the
+    # version check is carried over by hand.
+    headers = {"ETag": response.headers["etag"]}
+    symbol = symbol.upper()
+    rows = await queries.bars(db, symbol, BAR_RESOLUTIONS[resolution], start or date.min, end or date.max)
+
+    if format == "rows":
+        return JSONResponse([
+            {
+                "time": row["bucket"].isoformat(),
+                "open": row["open"],
+                "high": row["high"],
+                "low": row["low"],
+                "close": row["close"],
+                "volume": row["volume"]
+            }
+            for row in rows
+        ], headers=headers)
+
+    if format == "binary":
+        # Columns back to back, each len(rows) values wide; time is epoch
+        # seconds at the start of the bucket.
+        body = b"".join(column.tobytes() for column in bar_columns(rows).values())
+        return Response(
+            content=body,
+            media_type="application/octet-stream",
+            headers={**headers, "X-Bar-Count": str(len(rows)), "X-Bar-Layout": BAR_LAYOUT}
+        )
+
+    return JSONResponse({
+        "symbol": symbol,
+        "resolution": resolution,
+        "time": [row["bucket"].isoformat() for row in rows],
+        "open": [row["open"] for row in rows],
+        "high": [row["high"] for row in rows],
+        "low": [row["low"] for row in rows],
+        "close": [row["close"] for row in rows],
+        "volume": [row["volume"] for row in rows]
+    }, headers=headers)
+
+@router.get("/stock/{symbol}/history", dependencies=[versioned("history", symbol_keys)])
 async def get_monthly_history(symbol: str, db=Depends(get_db)):
-    import pandas as pd
-
-    query = """
-        SELECT the_timestamp, close
-        FROM stockpricehistory
-        WHERE symbol = $1
-        ORDER BY the_timestamp ASC
-    """
-    rows = await db.fetch(query, symbol.upper())
-    
+    rows = await fetch_rollups(db, symbol.upper(), "month")
+
     if not rows:
         raise HTTPException(status_code=404, detail="No historical data found")
 
-    df = pd.DataFrame(rows, columns=["the_timestamp", "close"])
-    df["the_timestamp"] = pd.to_datetime(df["the_timestamp"])
-    df.set_index("the_timestamp", inplace=True)
-
-    monthly = df["close"].resample("M").mean().dropna()
-
     return [
-        {"month": date.strftime("%b %Y"), "avg_close": round(close, 2)}
-        for date, close in monthly.items()
+        {"month": row["bucket"].strftime("%b %Y"), "avg_close": round(row["close_sum"] / row["bar_count"], 2)}
+        for row in rows
     ]
 
 @router.get("/stock/{symbol}/predict")
-async def predict_stock(symbol: str, db=Depends(get_db)):
-    query = """
-        SELECT the_timestamp, close
-        FROM stockpricehistory
-        WHERE symbol = $1
-        ORDER BY the_timestamp ASC
-    """
-    rows = await db.fetch(query, symbol.upper())
+async def predict_stock(
+    symbol: str,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    forecast_engine=Depends(get_forecast_engine)
+):
+    symbol = symbol.upper()
+    latest = await price_cache.get_entry(db, symbol)
+    if latest is None:
+        raise HTTPException(status_code=400, detail=NOT_ENOUGH_DATA)
 
-    if not rows or len(rows) < 12:
-        raise HTTPException(status_code=400, detail="Not enough data to make predictions")
+    cached = forecast_engine.get_cached(symbol, latest[0])
+    if cached is not None:
+        return cached
 
-    df = pd.DataFrame(rows, columns=["the_timestamp", "close"])
-    df["the_timestamp"] = pd.to_datetime(df["the_timestamp"])
-    df.set_index("the_timestamp", inplace=True)
+    series = monthly_closes(await fetch_rollups(db, symbol, "month"))
+    if series is None:
+        raise HTTPException(status_code=400, detail=NOT_ENOUGH_DATA)
 
-    monthly = df["close"].resample("M").mean().dropna().astype(float)
+    try:
+        return await forecast_engine.forecast(symbol, latest[0], *series)
+    except ForecastTimeout:
+        raise HTTPException(status_code=503, detail="Forecast is taking too long, try again shortly")
 
-    model = ExponentialSmoothing(monthly, trend="add")
-    fit = model.fit()
+@router.post("/stock/predict/batch")
+async def predict_stocks_batch(
+    request: BatchForecastRequest,
+    db=Depends(get_db),
+    price_cache=Depends(get_price_cache),
+    forecast_engine=Depends(get_forecast_engine)
+):
+    symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in request.symbols))
+    latest = await price_cache.get_many_entries(db, symbols)
 
-    forecast = fit.forecast(12)
-    future_months = pd.date_range(start=monthly.index[-1] + pd.offsets.MonthEnd(1), periods=12, freq='M')
+    ready = {}
+    pending = []
+    for symbol in symbols:
+        if symbol not in latest:
+            ready[symbol] = {"symbol": symbol, "error": NOT_ENOUGH_DATA}
+            continue
+        cached = forecast_engine.get_cached(symbol, latest[symbol][0])
+        if cached is not None:
+            ready[symbol] = {"symbol": symbol, "forecast": cached}
+        else:
+            pending.append(symbol)
 
-    return [
-        {"month": date.strftime("%b %Y"), "predicted_close": round(pred, 2)}
-        for date, pred in zip(future_months, forecast)
-    ]
+    # Every DB read happens here, before streaming starts, so the pooled
+    # connection is released while the fits run.
+    rollups = await fetch_rollups_many(db, pending, "month") if pending else {}
+
+    async def fit(symbol):
+        series = monthly_closes(rollups.get(symbol))
+        if series is None:
+            return {"symbol": symbol, "error": NOT_ENOUGH_DATA}
+        try:
+            forecast = await forecast_engine.forecast(symbol, latest[symbol][0], *series)
+        except ForecastTimeout:
+            return {"symbol": symbol, "error": "Forecast timed out"}
+        except Exception as e:
+            return {"symbol": symbol, "error": str(e) or type(e).__name__}
+        return {"symbol": symbol, "forecast": forecast}
+
+    async def stream():
+        for result in ready.values():
+            yield json.dumps(result) + "\n"
+        for next_result in asyncio.as_completed([fit(symbol) for symbol in pending]):
+            yield json.dumps(await next_result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/stock/forecast-engine/stats")
+async def get_forecast_engine_stats(forecast_engine=Depends(get_forecast_engine)):
+    return forecast_engine.stats()
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends
+from dependencies import get_db, get_price_cache
+from models import BatchValuationRequest
+import queries
+
+router = APIRouter()
+
+@router.post("/valuations")
+async def get_valuations(req: BatchValuationRequest, db=Depends(get_db), price_cache=Depends(get_price_cache)):
+    portfolio_ids = list(dict.fromkeys(req.portfolio_ids))
+    stocklist_ids = list(dict.fromkeys(req.stocklist_ids))
+    rows = await queries.valuation_positions(db, portfolio_ids, stocklist_ids)
+
+    # Each distinct symbol is priced once, however many containers hold it.
+    prices = await price_cache.get_many(db, {row["stock_symbol"] for row in rows if row["stock_symbol"]})
+
+    portfolios = {}
+    stocklists = {}
+    unpriced = set()
+    for row in rows:
+        if row["kind"] == "portfolio":
+            entry = portfolios.setdefault(row["container_id"], {
+                "portfolio_id": row["container_id"],
+                "cash_balance": float(row["cash_balance"]),
+                "market_value": 0.0
+            })
+        else:
+            entry = stocklists.setdefault(row["container_id"], {
+                "stocklist_id": row["container_id"],
+                "market_value": 0.0
+            })
+
+        symbol = row["stock_symbol"]
+        if symbol is None:
+            continue
+        if symbol not in prices:
+            unpriced.add(symbol)
+            continue
+        entry["market_value"] += (row["shares"] or 0) * prices[symbol]
+
+    for entry in portfolios.values():
+        entry["market_value"] = round(entry["market_value"], 2)
+        entry["total_value"] = round(entry["cash_balance"] + entry["market_value"], 2)
+    for entry in stocklists.values():
+        entry["market_value"] = round(entry["market_value"], 2)
+
+    return {
+        "portfolios": [portfolios[pid] for pid in portfolio_ids if pid in portfolios],
+        "stocklists": [stocklists[sid] for sid in stocklist_ids if sid in stocklists],
+        "totals": {
+            "cash_balance": round(sum(entry["cash_balance"] for entry in portfolios.values()), 2),
+            "portfolio_market_value": round(sum(entry["market_value"] for entry in portfolios.values()), 2),
+            "portfolio_total_value": round(sum(entry["total_value"] for entry in portfolios.values()), 2),
+            "stocklist_market_value": round(sum(entry["market_value"] for entry in stocklists.values()), 2)
+        },
+        "not_found": {
+            "portfolio_ids": [pid for pid in portfolio_ids if pid not in portfolios],
+            "stocklist_ids": [sid for sid in stocklist_ids if sid not in stocklists]
+        },
+        "unpriced_symbols": sorted(unpriced)
+    }
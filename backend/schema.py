@@ -0,0 +1,124 @@
+SCHEMA_LOCK = 0x5343484D  # advisory lock key, held by a worker while it sets up the schema
+
+# Indexes the newer query paths rely on. Created at startup so an existing
+# database picks them up without a separate migration step.
+INDEXES = [
+    # Keyset pagination over a user's transactions.
+    """
+    CREATE INDEX IF NOT EXISTS transactions_portfolio_time_idx
+    ON transactions (portfolio_id, the_timestamp DESC, transaction_id DESC)
+    """,
+    # Review counts per stocklist for the public feed.
+    """
+    CREATE INDEX IF NOT EXISTS reviews_stocklist_idx ON reviews (stocklist_id)
+    """,
+]
+
+
+async def ensure_indexes(db):
+    for statement in INDEXES:
+        await db.execute(statement)
+
+
+# Server-side functions. Replaced on every startup so the deployed body
+# always matches the code.
+FUNCTIONS = [
+    # Executes a list of orders against one portfolio in a single call. The
+    # portfolio row is locked first, so concurrent orders on the same
+    # portfolio queue up instead of reading the same balance; each later
+    # statement in the function sees their committed results. Orders are
+    # applied in sequence and one that fails its checks is rejected without
+    # affecting the others. Returns one row per order, or no rows when the
+    # portfolio does not exist.
+    """
+    CREATE OR REPLACE FUNCTION execute_trades(
+        p_portfolio_id INT,
+        p_symbols TEXT[],
+        p_shares INT[],
+        p_prices DOUBLE PRECISION[]
+    )
+    RETURNS TABLE (
+        order_index INT,
+        outcome TEXT,
+        reason TEXT,
+        order_total NUMERIC,
+        cash_after NUMERIC
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_cash NUMERIC;
+        v_held INT;
+        v_total NUMERIC;
+        v_shares INT;
+        i INT;
+    BEGIN
+        SELECT p.cash_balance INTO v_cash
+        FROM portfolios p
+        WHERE p.portfolio_id = p_portfolio_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN;
+        END IF;
+
+        FOR i IN 1 .. coalesce(array_length(p_symbols, 1), 0) LOOP
+            order_index := i - 1;
+            v_shares := p_shares[i];
+            order_total := NULL;
+
+            IF v_shares = 0 THEN
+                outcome := 'rejected';
+                reason := 'Transaction must involve at least 1 share';
+            ELSIF p_prices[i] IS NULL THEN
+                outcome := 'rejected';
+                reason := 'Stock price not found';
+            ELSE
+                v_total := round(abs(v_shares) * p_prices[i]::NUMERIC, 2);
+                SELECT h.shares INTO v_held
+                FROM portfolioholdings h
+                WHERE h.portfolio_id = p_portfolio_id AND h.stock_symbol = p_symbols[i];
+
+                IF v_shares > 0 AND v_cash < v_total THEN
+                    outcome := 'rejected';
+                    reason := 'Insufficient cash';
+                ELSIF v_shares < 0 AND coalesce(v_held, 0) < -v_shares THEN
+                    outcome := 'rejected';
+                    reason := 'Insufficient shares to sell';
+                ELSE
+                    IF v_held IS NULL THEN
+                        INSERT INTO portfolioholdings (portfolio_id, stock_symbol, shares)
+                        VALUES (p_portfolio_id, p_symbols[i], v_shares);
+                    ELSIF v_held + v_shares = 0 THEN
+                        DELETE FROM portfolioholdings h
+                        WHERE h.portfolio_id = p_portfolio_id AND h.stock_symbol = p_symbols[i];
+                    ELSE
+                        UPDATE portfolioholdings h SET shares = v_held + v_shares
+                        WHERE h.portfolio_id = p_portfolio_id AND h.stock_symbol = p_symbols[i];
+                    END IF;
+
+                    INSERT INTO transactions (portfolio_id, stock_symbol, shares, total_price, the_timestamp, trans_type)
+                    VALUES (
+                        p_portfolio_id, p_symbols[i], abs(v_shares), v_total, CURRENT_TIMESTAMP,
+                        CASE WHEN v_shares > 0 THEN 'buy' ELSE 'sell' END
+                    );
+
+                    v_cash := v_cash - sign(v_shares) * v_total;
+                    outcome := 'filled';
+                    reason := NULL;
+                    order_total := v_total;
+                END IF;
+            END IF;
+
+            cash_after := v_cash;
+            RETURN NEXT;
+        END LOOP;
+
+        UPDATE portfolios p SET cash_balance = v_cash WHERE p.portfolio_id = p_portfolio_id;
+    END
+    $$
+    """,
+]
+
+
+async def ensure_functions(db):
+    for statement in FUNCTIONS:
+        await db.execute(statement)
@@ -0,0 +1,201 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+HASH_BYTES = 32  # keeps the encoded hash within users.password VARCHAR(100)
+
+
+def hash_password(password: str, salt: bytes = None) -> str:
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=HASH_BYTES)
+    return "$".join([
+        "scrypt", str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode()
+    ])
+
+
+def check_password(password: str, stored: str) -> bool:
+    if not stored.startswith("scrypt$"):
+        # Accounts created before hashing still hold the plain password;
+        # login rehashes it on the first success.
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, n, r, p, salt, digest = stored.split("$")
+    digest = base64.b64decode(digest)
+    candidate = hashlib.scrypt(
+        password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p), dklen=len(digest)
+    )
+    return hmac.compare_digest(candidate, digest)
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class Identity:
+    def __init__(self, user_id: int, username: str, session_id: str, expires_at: int):
+        self.user_id = user_id
+        self.username = username
+        self.session_id = session_id
+        self.expires_at = expires_at
+
+
+class InvalidSession(Exception):
+    pass
+
+
+# Stateless session tokens: base64(payload).base64(HMAC-SHA256), checked
+# against SESSION_SECRET alone, so authenticating a request needs no query.
+# Verified tokens are kept in a bounded LRU so repeat requests skip even the
+# HMAC. Logout records the session in revokedsessions; every process keeps
+# the unexpired revocations in memory and reloads them every sync interval.
+# Password hashing (scrypt) runs on a small thread pool to keep a burst of
+# logins off the event loop.
+class SessionManager:
+    def __init__(self, secret: bytes, ttl=43200, cache_size=10000, hash_workers=4, sync_interval=5.0):
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.hash_workers = hash_workers
+        self.sync_interval = sync_interval
+        self._identities = OrderedDict()
+        self._revoked = {}
+        self._executor = None
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        secret = os.getenv("SESSION_SECRET")
+        if not secret:
+            logger.warning("SESSION_SECRET is not set; sessions will not survive a restart or span workers")
+            secret = secrets.token_hex(32)
+        return cls(
+            secret.encode(),
+            ttl=int(os.getenv("SESSION_TTL_SECONDS", "43200")),
+            cache_size=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+            hash_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+            sync_interval=float(os.getenv("SESSION_REVOCATION_SYNC", "5")),
+        )
+
+    async def setup(self, db):
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS revokedsessions (
+                session_id TEXT PRIMARY KEY,
+                expires_at TIMESTAMPTZ NOT NULL,
+                revoked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix="password-hash")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def hash_password(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, hash_password, password)
+
+    async def check_password(self, password: str, stored: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, check_password, password, stored)
+
+    def _sign(self, body: bytes) -> bytes:
+        return hmac.new(self.secret, body, hashlib.sha256).digest()
+
+    def issue(self, user_id: int, username: str):
+        expires_at = int(time.time()) + self.ttl
+        payload = {"uid": user_id, "name": username, "sid": secrets.token_urlsafe(12), "exp": expires_at}
+        body = _b64(json.dumps(payload, separators=(",", ":")).encode())
+        return body + "." + _b64(self._sign(body.encode())), expires_at
+
+    def verify(self, token: str) -> Identity:
+        identity = self._identities.get(token)
+        if identity is not None:
+            self.hits += 1
+            self._identities.move_to_end(token)
+        else:
+            self.misses += 1
+            identity = self._decode(token)
+            self._identities[token] = identity
+            while len(self._identities) > self.cache_size:
+                self._identities.popitem(last=False)
+
+        if identity.expires_at <= time.time():
+            self._identities.pop(token, None)
+            self.rejected += 1
+            raise InvalidSession("Session expired")
+        if identity.session_id in self._revoked:
+            self.rejected += 1
+            raise InvalidSession("Session revoked")
+        return identity
+
+    def _decode(self, token: str) -> Identity:
+        try:
+            body, signature = token.split(".")
+            valid = hmac.compare_digest(_unb64(signature), self._sign(body.encode()))
+            payload = json.loads(_unb64(body)) if valid else None
+        except ValueError:
+            valid = False
+        if not valid:
+            self.rejected += 1
+            raise InvalidSession("Invalid session token")
+        return Identity(payload["uid"], payload["name"], payload["sid"], payload["exp"])
+
+    async def revoke(self, db, identity: Identity):
+        expires_at = datetime.fromtimestamp(identity.expires_at, timezone.utc)
+        await queries.revoke_session(db, identity.session_id, expires_at)
+        self._revoked[identity.session_id] = expires_at
+
+    async def sync(self, db):
+        rows = await queries.revoked_sessions(db)
+        # Local revocations are kept until they expire in case this read
+        # started before their insert committed.
+        now = datetime.now(timezone.utc)
+        revoked = {session_id: expires_at for session_id, expires_at in self._revoked.items() if expires_at > now}
+        revoked.update((row["session_id"], row["expires_at"]) for row in rows)
+        self._revoked = revoked
+
+    async def run(self, pool):
+        # Picks up logouts handled by other workers and drops revocations
+        # once their tokens would have expired anyway.
+        while True:
+            try:
+                async with pool.acquire() as connection:
+                    await queries.prune_revoked_sessions(connection)
+                    await self.sync(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Session revocation sync failed")
+            await asyncio.sleep(self.sync_interval)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cached_identities": len(self._identities),
+            "revoked_sessions": len(self._revoked),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,173 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+import queries
+
+EPOCH = date(1970, 1, 1)
+
+
+def day_number(value):
+    if hasattr(value, "date"):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+# Keeps each symbol's daily close series (from the day rollups) in memory as
+# NumPy arrays. Ingestion only records the earliest day it touched per symbol;
+# the next stats call re-reads just that tail and splices it in, so a new bar
+# costs one short range read instead of a reload of the whole history.
+# Writes by other workers arrive through the PriceFeed listener; while it is
+# disconnected (listening is False) nothing is kept between calls.
+class StatsEngine:
+    def __init__(self):
+        self._series = {}
+        self._stale = {}
+        self.listening = False
+
+    def reset(self):
+        # After compaction rewrites history, or after the listener reconnects
+        # having maybe missed writes, every series reloads on next use.
+        self._series = {}
+        self._stale = {}
+
+    def touch(self, bars):
+        # Recorded even for symbols not loaded yet: one may be loading right
+        # now from a read that started before this bar was committed.
+        for symbol, the_timestamp in bars:
+            day = day_number(the_timestamp)
+            if symbol not in self._stale or day < self._stale[symbol]:
+                self._stale[symbol] = day
+
+    async def _read(self, db, since):
+        # since: symbol -> first day number to read, None for all of it.
+        rows = await queries.daily_closes_since(
+            db, list(since), [date.min if day is None else EPOCH + timedelta(days=day) for day in since.values()]
+        )
+        fresh = {symbol: ([], []) for symbol in since}
+        for row in rows:
+            days, closes = fresh[row["symbol"]]
+            days.append(day_number(row["bucket"]))
+            closes.append(row["close"])
+        return {
+            symbol: (np.asarray(days, dtype=np.int64), np.asarray(closes, dtype=np.float64))
+            for symbol, (days, closes) in fresh.items()
+        }
+
+    async def _sync(self, db, symbols):
+        # symbol -> (day numbers, closes) for symbols, brought up to date.
+        if not self.listening:
+            # Writes by other workers may be going unheard; read everything
+            # and keep nothing.
+            self.reset()
+            return await self._read(db, dict.fromkeys(symbols))
+
+        # The stale marks are taken before the read, so a touch that lands
+        # while it runs stays marked for the next call.
+        since = {}
+        for symbol in symbols:
+            stale = self._stale.pop(symbol, None)
+            if symbol not in self._series:
+                since[symbol] = None
+            elif stale is not None:
+                since[symbol] = stale
+        try:
+            fresh = await self._read(db, since) if since else {}
+        except BaseException:
+            self.touch((symbol, EPOCH + timedelta(days=day)) for symbol, day in since.items() if day is not None)
+            raise
+
+        series = {}
+        for symbol in symbols:
+            current = self._series.get(symbol)
+            if current is None and since.get(symbol, 0) is not None:
+                # Reset while reading; a tail alone is not a series.
+                series.update(await self._read(db, {symbol: None}))
+                continue
+            if symbol not in since:
+                series[symbol] = current
+                continue
+            days, closes = fresh[symbol]
+            if since[symbol] is not None:
+                keep = np.searchsorted(current[0], since[symbol])
+                days = np.concatenate([current[0][:keep], days])
+                closes = np.concatenate([current[1][:keep], closes])
+            series[symbol] = self._series[symbol] = (days, closes)
+        return series
+
+    async def daily_series(self, db, symbols):
+        # symbol -> (day numbers, closes), brought up to date first.
+        return await self._sync(db, sorted(set(symbols)))
+
+    async def portfolio_stats(self, db, symbols, lookback_days=None):
+        series = await self._sync(db, sorted(set(symbols)))
+        symbols = [symbol for symbol in series if len(series[symbol][0])]
+        if not symbols:
+            return None
+
+        cutoff = None
+        if lookback_days is not None:
+            cutoff = max(series[symbol][0][-1] for symbol in symbols) - lookback_days
+
+        closes_by_symbol = {}
+        returns_by_symbol = {}
+        for symbol in symbols:
+            days, closes = series[symbol]
+            if cutoff is not None:
+                start = np.searchsorted(days, cutoff)
+                days, closes = days[start:], closes[start:]
+            closes_by_symbol[symbol] = closes
+            returns_by_symbol[symbol] = (days[1:], closes[1:] / closes[:-1] - 1.0)
+
+        # Align every symbol's returns on the union of their dates; gaps stay
+        # NaN and are excluded pairwise below.
+        all_days = np.unique(np.concatenate([days for days, _ in returns_by_symbol.values()]))
+        matrix = np.full((len(all_days), len(symbols)), np.nan)
+        for col, symbol in enumerate(symbols):
+            days, returns = returns_by_symbol[symbol]
+            matrix[np.searchsorted(all_days, days), col] = returns
+
+        cov, corr = pairwise_comoments(matrix)
+
+        return {
+            "coefficient_of_variation": {
+                symbol: _clean(np.std(closes, ddof=1) / np.mean(closes), 4) if len(closes) > 1 else None
+                for symbol, closes in closes_by_symbol.items()
+            },
+            "covariance_matrix": _matrix_dict(symbols, cov, 6),
+            "correlation_matrix": _matrix_dict(symbols, corr, 4),
+            "lookback_days": lookback_days,
+            "observations": len(all_days),
+        }
+
+
+def pairwise_comoments(matrix):
+    # Pairwise-complete sample covariance and correlation of the columns,
+    # computed with a handful of matrix products instead of per-pair loops.
+    present = (~np.isnan(matrix)).astype(np.float64)
+    values = np.nan_to_num(matrix)
+
+    n = present.T @ present
+    sum_x = values.T @ present
+    sum_xx = (values * values).T @ present
+    sum_xy = values.T @ values
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = (sum_xy - sum_x * sum_x.T / n) / (n - 1)
+        var = (sum_xx - sum_x * sum_x / n) / (n - 1)
+        corr = cov / np.sqrt(var * var.T)
+    cov[n < 2] = np.nan
+    corr[n < 2] = np.nan
+    return cov, corr
+
+
+def _clean(value, digits):
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else round(value, digits)
+
+
+def _matrix_dict(symbols, matrix, digits):
+    return {
+        col_symbol: {row_symbol: _clean(matrix[row, col], digits) for row, row_symbol in enumerate(symbols)}
+        for col, col_symbol in enumerate(symbols)
+    }
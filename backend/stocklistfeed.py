@@ -0,0 +1,144 @@
+import queries
+
+CHANNEL = "stocklists_changed"
+
+SORTS = {
+    "newest": lambda entry: (entry["stocklist_id"],),
+    "most_reviewed": lambda entry: (entry["review_count"], entry["stocklist_id"]),
+    "highest_value": lambda entry: (entry["market_value"], entry["stocklist_id"]),
+}
+
+
+# Every public stocklist with its items and review count, held in memory so
+# the browse feed never aggregates per request. Writes to a list, its items
+# or its reviews mark just that list stale, here and (over the event bus) in
+# every other worker, and the next read reloads those lists in one query.
+# A worker whose listener is down may miss those marks, so it reloads
+# everything on every read until it reconnects. Market values are
+# recomputed from the price cache whenever its version has moved, and each
+# sort order is kept until something changes.
+class StocklistFeed:
+    def __init__(self, price_cache, bus):
+        self.price_cache = price_cache
+        self.bus = bus
+        self.listening = False
+        self._lists = {}
+        self._loaded = False
+        self._generation = 0
+        self._stale = set()
+        self._priced_at = None
+        self._orders = {}
+        bus.subscribe(CHANNEL, self._on_changed)
+        bus.on_connect(self._connected)
+        bus.on_lost(self._lost)
+
+    def invalidate(self, stocklist_id: int):
+        self._stale.add(stocklist_id)
+        self.bus.publish(CHANNEL, stocklist_id)
+
+    def _on_changed(self, stocklist_ids):
+        self._stale.update(stocklist_ids)
+
+    def _connected(self):
+        self._loaded = False
+        self._generation += 1
+        self.listening = True
+
+    def _lost(self):
+        self.listening = False
+
+    async def _sync(self, db):
+        # Marks are taken before the read; one that lands while it runs
+        # stays for the next call.
+        full = not self._loaded or not self.listening
+        generation = self._generation
+        ids, self._stale = self._stale, set()
+        try:
+            if full:
+                rows = await queries.public_stocklist_summaries(db, None)
+            elif ids:
+                rows = await queries.public_stocklist_summaries(db, list(ids))
+            else:
+                return
+        except BaseException:
+            self._stale |= ids
+            raise
+
+        if generation != self._generation:
+            # The listener reconnected during the read, which may predate
+            # writes it never heard about.
+            return await self._sync(db)
+        if full:
+            self._lists = {}
+            self._loaded = True
+        else:
+            # Lists that were deleted or made private simply do not come back.
+            for stocklist_id in ids:
+                self._lists.pop(stocklist_id, None)
+        for row in rows:
+            self._lists[row["stocklist_id"]] = {
+                "stocklist_id": row["stocklist_id"],
+                "name": row["name"],
+                "owner_username": row["owner_username"],
+                "items": dict(zip(row["symbols"], row["shares"])),
+                "review_count": row["review_count"],
+            }
+        self._priced_at = None
+        self._orders = {}
+
+    async def _price(self, db):
+        version = self.price_cache.version
+        if self._priced_at is not None and self._priced_at == version:
+            return
+        symbols = {symbol for entry in self._lists.values() for symbol in entry["items"]}
+        prices = await self.price_cache.get_many(db, symbols)
+        # Lists loaded during the await are priced too, but with symbols not
+        # looked up here counted as unpriced until the next call.
+        complete = True
+        for entry in self._lists.values():
+            complete = complete and symbols.issuperset(entry["items"])
+            entry["market_value"] = round(sum(
+                (shares or 0) * prices[symbol]
+                for symbol, shares in entry["items"].items() if symbol in prices
+            ), 2)
+        self._priced_at = version if complete else None
+        self._orders.pop("highest_value", None)
+
+    async def page(self, db, sort: str, after, limit: int):
+        await self._sync(db)
+        await self._price(db)
+
+        order = self._orders.get(sort)
+        if order is None:
+            key = SORTS[sort]
+            entries = sorted(self._lists.values(), key=key, reverse=True)
+            order = self._orders[sort] = ([key(entry) for entry in entries], entries)
+        keys, entries = order
+
+        # keys are descending and unique (the id breaks ties), so the page
+        # starts at the first key below the cursor.
+        start = 0
+        if after is not None:
+            hi = len(keys)
+            while start < hi:
+                mid = (start + hi) // 2
+                if keys[mid] >= after:
+                    start = mid + 1
+                else:
+                    hi = mid
+
+        chunk = entries[start:start + limit]
+        has_more = start + limit < len(entries)
+        rows = [
+            {
+                "stocklist_id": entry["stocklist_id"],
+                "name": entry["name"],
+                "owner_username": entry["owner_username"],
+                "item_count": len(entry["items"]),
+                "review_count": entry["review_count"],
+                "market_value": entry["market_value"],
+            }
+            for entry in chunk
+        ]
+        next_key = SORTS[sort](chunk[-1]) if has_more else None
+        return rows, next_key
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+PARENT = "stockpricehistory"
+LEGACY = "stockpricehistory_legacy"
+COMPACTION_LOCK = 0x5354434B  # advisory lock key, one compaction at a time across workers
+PARTITION_LOCK = 0x50415254  # advisory lock key, one partition created at a time
+CHANNEL = "price_storage"
+
+_BOUNDS = re.compile(r"FROM \((.*?)\) TO \((.*?)\)")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months: int):
+    year, month = divmod(value.month - 1 + months, 12)
+    return datetime(value.year + year, month + 1, 1)
+
+
+def week_start(value):
+    day = datetime(value.year, value.month, value.day)
+    return day - timedelta(days=day.weekday())
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y%m}"
+
+
+def _bound(text: str):
+    text = text.strip()
+    if text in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(text.strip("'"))
+
+
+# Storage management for the raw price history. stockpricehistory becomes a
+# table range-partitioned by month (an existing table is kept whole as the
+# first partition), and partitions are created ahead of time and on demand
+# by ingestion. Compaction applies the retention policy:
+#   - raw bars older than PRICE_RAW_RETENTION_MONTHS are dropped, since the
+#     day/week/month rollups already hold them downsampled, and bars older
+#     than that horizon are no longer accepted;
+#   - daily rollups older than PRICE_DAILY_RETENTION_MONTHS are dropped, and
+#     readers fall back to the weekly bar for those weeks.
+# Compaction removes history for good, so it only runs from the background
+# job in run(), never on request. Horizons are kept in pricecompaction so
+# every worker agrees on them. The worker that compacts announces it on the
+# event bus and the others reload horizons and partitions then; every tick
+# reloads them too, in case an announcement was missed.
+class PriceStorage:
+    def __init__(self, bus, partitioned=True, months_ahead=2, raw_retention_months=0,
+                 daily_retention_months=0, interval=3600.0):
+        self.bus = bus
+        self.partitioned = partitioned
+        self.months_ahead = months_ahead
+        self.raw_retention_months = raw_retention_months
+        self.daily_retention_months = daily_retention_months
+        self.interval = interval
+        self._legacy_until = None
+        self._months = set()
+        self.raw_horizon = None
+        self.daily_horizon = None
+        self.last_compaction = None
+        self._compacted_elsewhere = asyncio.Event()
+        bus.subscribe(CHANNEL, lambda messages: self._compacted_elsewhere.set())
+        bus.on_connect(self._compacted_elsewhere.set)
+
+    @classmethod
+    def from_env(cls, bus):
+        return cls(
+            bus,
+            partitioned=os.getenv("PRICE_PARTITIONING", "1") != "0",
+            months_ahead=int(os.getenv("PRICE_PARTITIONS_AHEAD", "2")),
+            raw_retention_months=int(os.getenv("PRICE_RAW_RETENTION_MONTHS", "0")),
+            daily_retention_months=int(os.getenv("PRICE_DAILY_RETENTION_MONTHS", "0")),
+            interval=float(os.getenv("PRICE_COMPACTION_INTERVAL", "3600")),
+        )
+
+    async def setup(self, db):
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS pricecompaction (
+                resolution TEXT PRIMARY KEY,
+                compacted_before TIMESTAMP NOT NULL
+            )
+        """)
+        if self.partitioned:
+            async with db.transaction():
+                await self._convert(db)
+            await self._load_partitions(db)
+            now = datetime.now()
+            await self.ensure_partitions(db, now, add_months(now, self.months_ahead))
+        await self._load_horizons(db)
+
+    async def _convert(self, db):
+        # Run under the startup schema lock, so of several workers starting
+        # at once only the first sees a plain table here.
+        kind = await db.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", PARENT)
+        if kind != "r":
+            return
+
+        latest = await db.fetchval(f"SELECT max(the_timestamp) FROM {PARENT}")
+        boundary = add_months(latest, 1) if latest else month_start(datetime.now())
+        logger.warning("Partitioning %s; existing rows stay in %s up to %s", PARENT, LEGACY, boundary)
+
+        await db.execute(f"ALTER TABLE {PARENT} RENAME TO {LEGACY}")
+        pkey = await db.fetchval(
+            "SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass AND contype = 'p'", LEGACY
+        )
+        if pkey:
+            await db.execute(f'ALTER TABLE {LEGACY} RENAME CONSTRAINT "{pkey}" TO {LEGACY}_pkey')
+        await db.execute(f"""
+            CREATE TABLE {PARENT} (
+                LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                PRIMARY KEY (symbol, the_timestamp)
+            ) PARTITION BY RANGE (the_timestamp)
+        """)
+        await db.execute(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION {LEGACY} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+        )
+
+    async def _load_partitions(self, db):
+        rows = await db.fetch("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass($1)
+        """, PARENT)
+        self._months = set()
+        self._legacy_until = None
+        for row in rows:
+            match = _BOUNDS.search(row["bound"])
+            if not match:
+                continue
+            lower, upper = _bound(match.group(1)), _bound(match.group(2))
+            if lower is None:
+                self._legacy_until = upper
+            else:
+                self._months.add(lower)
+
+    async def reload(self, db):
+        if self.partitioned:
+            await self._load_partitions(db)
+        await self._load_horizons(db)
+
+    async def _load_horizons(self, db):
+        rows = await db.fetch("SELECT resolution, compacted_before FROM pricecompaction")
+        horizons = {row["resolution"]: row["compacted_before"] for row in rows}
+        self.raw_horizon = horizons.get("raw")
+        self.daily_horizon = horizons.get("day")
+
+    async def ensure_partitions(self, db, start, end):
+        if not self.partitioned:
+            return
+        month = month_start(start)
+        while month <= end:
+            covered = month in self._months or (self._legacy_until is not None and month < self._legacy_until)
+            if not covered:
+                # Held to the end of the caller's transaction; another worker
+                # creating the same month makes IF NOT EXISTS a no-op here.
+                await db.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK)
+                await db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                )
+                self._months.add(month)
+            month = add_months(month, 1)
+
+    def accepts(self, the_timestamp):
+        return self.raw_horizon is None or the_timestamp >= self.raw_horizon
+
+    async def compact(self, db, now=None):
+        now = now or datetime.now()
+        result = {"started": now, "dropped_partitions": [], "raw_rows_deleted": 0, "daily_rows_deleted": 0}
+
+        async with db.transaction():
+            if not await db.fetchval("SELECT pg_try_advisory_xact_lock($1)", COMPACTION_LOCK):
+                result["skipped"] = "another compaction is running"
+                await self.reload(db)
+                return result
+            await self._load_horizons(db)
+            changed = False
+
+            if self.raw_retention_months:
+                # New bars are refused before a month boundary, but raw rows
+                # are only removed up to the Monday before it, so no week,
+                # month or day bucket that can still receive a bar ever loses
+                # raw rows it would be recomputed from.
+                horizon = add_months(month_start(now), -self.raw_retention_months)
+                if self.raw_horizon is None or horizon > self.raw_horizon:
+                    cutoff = week_start(horizon)
+                    if self.partitioned:
+                        await self._load_partitions(db)
+                        for month in sorted(self._months):
+                            if add_months(month, 1) <= cutoff:
+                                await db.execute(f"DROP TABLE IF EXISTS {partition_name(month)}")
+                                self._months.discard(month)
+                                result["dropped_partitions"].append(partition_name(month))
+                    status = await db.execute(f"DELETE FROM {PARENT} WHERE the_timestamp < $1", cutoff)
+                    result["raw_rows_deleted"] = int(status.split()[-1])
+                    await self._set_horizon(db, "raw", horizon)
+                    self.raw_horizon = horizon
+                    changed = True
+
+            if self.daily_retention_months and self.raw_horizon is not None:
+                # Daily rollups can only go where the raw bars are gone too,
+                # otherwise a late bar would recreate a lone day in a week
+                # that readers serve from its weekly bar.
+                horizon = min(
+                    week_start(add_months(month_start(now), -self.daily_retention_months)),
+                    week_start(self.raw_horizon)
+                )
+                if self.daily_horizon is None or horizon > self.daily_horizon:
+                    status = await db.execute(
+                        "DELETE FROM stockpricerollups WHERE resolution = 'day' AND bucket < $1", horizon.date()
+                    )
+                    result["daily_rows_deleted"] = int(status.split()[-1])
+                    await self._set_horizon(db, "day", horizon)
+                    self.daily_horizon = horizon
+                    changed = True
+
+            if self.partitioned:
+                await self.ensure_partitions(db, now, add_months(now, self.months_ahead))
+
+        if changed:
+            self.bus.publish(CHANNEL, "compacted")
+        result["elapsed_seconds"] = round((datetime.now() - now).total_seconds(), 3)
+        self.last_compaction = result
+        return result
+
+    async def _set_horizon(self, db, resolution: str, horizon):
+        await db.execute("""
+            INSERT INTO pricecompaction (resolution, compacted_before) VALUES ($1, $2)
+            ON CONFLICT (resolution) DO UPDATE SET compacted_before = EXCLUDED.compacted_before
+        """, resolution, horizon)
+
+    async def run(self, pool, on_compacted=None):
+        # Background maintenance: keeps partitions ahead of time and applies
+        # the retention policy every interval. on_compacted(local) is called
+        # after history was removed, here (local) or by another worker.
+        while True:
+            try:
+                if self._compacted_elsewhere.is_set():
+                    self._compacted_elsewhere.clear()
+                    async with pool.acquire() as connection:
+                        await self.reload(connection)
+                    if on_compacted:
+                        on_compacted(False)
+                else:
+                    async with pool.acquire() as connection:
+                        result = await self.compact(connection)
+                    if on_compacted and (result["raw_rows_deleted"] or result["daily_rows_deleted"]):
+                        on_compacted(True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Price history compaction failed")
+            try:
+                await asyncio.wait_for(self._compacted_elsewhere.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stats(self, db):
+        rows = await queries.partition_stats(db, PARENT)
+        return {
+            "partitioned": self.partitioned,
+            "partitions": [dict(row) for row in rows],
+            "policy": {
+                "raw_retention_months": self.raw_retention_months,
+                "daily_retention_months": self.daily_retention_months,
+                "partitions_ahead": self.months_ahead,
+                "interval_seconds": self.interval,
+            },
+            "raw_horizon": self.raw_horizon,
+            "daily_horizon": self.daily_horizon,
+            "last_compaction": self.last_compaction,
+        }
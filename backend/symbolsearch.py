@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+
+import asyncpg
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "stocks_changed"
+_TOKEN = re.compile(r"[^\W_]+")
+
+# Scores per way a query term can match; an entry's score is the sum over
+# its terms, and every term has to match.
+EXACT_SYMBOL, SYMBOL_PREFIX, FIRST_WORD, OTHER_WORD, FUZZY = 100, 80, 60, 50, 20
+
+
+def tokenize(text: str):
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def _deletes(text: str):
+    return {text[:i] + text[i + 1:] for i in range(len(text))}
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    # One insertion, deletion, substitution or adjacent transposition.
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (
+            i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+        )
+    return a[i:] == b[i + 1:]
+
+
+# Immutable once built; a refresh builds a new one and swaps it in, so a
+# search never sees a half-built index.
+class SymbolIndex:
+    def __init__(self, rows, fuzzy_min=3, fuzzy_max=8, cache_size=4096):
+        self.fuzzy_min = fuzzy_min
+        self.fuzzy_max = fuzzy_max
+        self.cache_size = cache_size
+        # Autocomplete repeats the same short prefixes constantly, and those
+        # match the most entries, so results are kept per query.
+        self._results = OrderedDict()
+        self.symbols = sorted(
+            ((row["stock_symbol"].upper(), row["company_name"] or "") for row in rows), key=lambda item: item[0].lower()
+        )
+        self.size = len(self.symbols)
+
+        # Sorted (ticker, entry) and (name token, entry, position) lists:
+        # every prefix lookup is a bisect plus a walk over the matches.
+        self._tickers = [symbol.lower() for symbol, _ in self.symbols]
+        words = []
+        for entry, (symbol, name) in enumerate(self.symbols):
+            for position, token in enumerate(dict.fromkeys(tokenize(name))):
+                words.append((token, entry, position))
+        words.sort()
+        self._words = words
+        self._word_keys = [token for token, _, _ in words]
+
+        # Fuzzy prefixes, SymSpell style: every ticker and word prefix of
+        # fuzzy_min..fuzzy_max characters is filed under itself and each of
+        # its one-character deletions. A query prefix within one edit of an
+        # indexed prefix shares at least one of those keys with it.
+        self._variants = {}
+        for token in set(self._tickers) | set(self._word_keys):
+            for length in range(self.fuzzy_min, min(len(token), self.fuzzy_max) + 1):
+                prefix = token[:length]
+                for key in _deletes(prefix) | {prefix}:
+                    self._variants.setdefault(key, set()).add(prefix)
+
+    def _prefixed(self, keys, prefix):
+        start = bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return start, end
+
+    def _term_scores(self, term: str, last: bool):
+        # entry -> best score for one query term. Earlier terms of a
+        # multi-word query must match a whole word; the last one, still
+        # being typed, may match any prefix.
+        scores = {}
+
+        def offer(entry, score):
+            if score > scores.get(entry, 0):
+                scores[entry] = score
+
+        start, end = self._prefixed(self._tickers, term)
+        for entry in range(start, end):
+            offer(entry, EXACT_SYMBOL if self._tickers[entry] == term else SYMBOL_PREFIX)
+
+        start, end = self._prefixed(self._word_keys, term)
+        for token, entry, position in self._words[start:end]:
+            if last or token == term:
+                offer(entry, FIRST_WORD if position == 0 else OTHER_WORD)
+
+        if len(term) >= self.fuzzy_min:
+            # Longer terms are compared on their first fuzzy_max characters.
+            term = term[:self.fuzzy_max]
+            prefixes = set()
+            for key in _deletes(term) | {term}:
+                prefixes |= self._variants.get(key, set())
+            for prefix in prefixes:
+                if prefix == term or not within_one_edit(prefix, term):
+                    continue
+                start, end = self._prefixed(self._tickers, prefix)
+                for entry in range(start, end):
+                    offer(entry, FUZZY)
+                start, end = self._prefixed(self._word_keys, prefix)
+                for token, entry, _ in self._words[start:end]:
+                    if last or len(token) <= len(prefix) + 1:
+                        offer(entry, FUZZY)
+        return scores
+
+    def search(self, query: str, limit: int = 10):
+        terms = tuple(tokenize(query))
+        if not terms:
+            return []
+        key = (terms, limit)
+        results = self._results.get(key)
+        if results is None:
+            results = self._results[key] = self._search(terms, limit)
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+        return results
+
+    def _search(self, terms, limit):
+        totals = None
+        for i, term in enumerate(terms):
+            scores = self._term_scores(term, last=i == len(terms) - 1)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {entry: totals[entry] + score for entry, score in scores.items() if entry in totals}
+            if not totals:
+                return []
+
+        # Best score first, then shorter tickers (the usual listing) first.
+        ranked = heapq.nsmallest(
+            limit, totals.items(), key=lambda item: (-item[1], len(self.symbols[item[0]][0]), item[0])
+        )
+        return [
+            {"symbol": self.symbols[entry][0], "company_name": self.symbols[entry][1], "score": score}
+            for entry, score in ranked
+        ]
+
+
+# Search over stocks, rebuilt whenever the table changes. A statement-level
+# trigger on stocks notifies CHANNEL; one listener per process debounces the
+# notifications and rebuilds the index off the event loop. A listener that
+# lost its connection rebuilds on reconnect, since it may have missed some.
+class SymbolSearch:
+    def __init__(self, dsn, debounce=0.5, retry_interval=5.0):
+        self.dsn = dsn
+        self.debounce = debounce
+        self.retry_interval = retry_interval
+        self.index = SymbolIndex([])
+        self.connected = False
+        self.loaded_at = None
+        self.build_seconds = None
+        self.notifications = 0
+        self.rebuilds = 0
+        self.searches = 0
+        self._pool = None
+        self._dirty = False
+        self._pending = None
+
+    @classmethod
+    def from_env(cls, dsn):
+        return cls(
+            dsn,
+            debounce=float(os.getenv("SYMBOL_SEARCH_DEBOUNCE", "0.5")),
+            retry_interval=float(os.getenv("SYMBOL_SEARCH_RETRY_INTERVAL", "5")),
+        )
+
+    async def setup(self, db):
+        await db.execute(f"""
+            CREATE OR REPLACE FUNCTION notify_stocks_changed() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                PERFORM pg_notify('{CHANNEL}', '');
+                RETURN NULL;
+            END
+            $$
+        """)
+        await db.execute("""
+            CREATE OR REPLACE TRIGGER stocks_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON stocks
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_stocks_changed()
+        """)
+
+    async def reload(self, db):
+        rows = await queries.search_stocks(db)
+        started = datetime.now()
+        self.index = await asyncio.to_thread(SymbolIndex, rows)
+        self.build_seconds = round((datetime.now() - started).total_seconds(), 3)
+        self.loaded_at = datetime.now()
+        self.rebuilds += 1
+        return self.index.size
+
+    def search(self, query: str, limit: int = 10):
+        self.searches += 1
+        return self.index.search(query, limit)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.notifications += 1
+        self._changed()
+
+    def _changed(self):
+        self._dirty = True
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.create_task(self._rebuild())
+
+    async def _rebuild(self):
+        # A burst of writes (a bulk load) costs one rebuild; a change that
+        # lands during a rebuild triggers another one after it.
+        while self._dirty:
+            await asyncio.sleep(self.debounce)
+            self._dirty = False
+            try:
+                async with self._pool.acquire() as connection:
+                    await self.reload(connection)
+            except Exception:
+                logger.exception("Symbol search rebuild failed")
+
+    async def run(self, pool):
+        self._pool = pool
+        loop = asyncio.get_running_loop()
+        reconnecting = False
+        try:
+            while True:
+                try:
+                    connection = await asyncpg.connect(self.dsn)
+                    lost = loop.create_future()
+                    connection.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+                    try:
+                        await connection.add_listener(CHANNEL, self._on_notify)
+                        self.connected = True
+                        if reconnecting:
+                            self._changed()
+                        await lost
+                    finally:
+                        self.connected = False
+                        await connection.close()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Symbol search listener failed")
+                reconnecting = True
+                await asyncio.sleep(self.retry_interval)
+        finally:
+            if self._pending is not None:
+                self._pending.cancel()
+
+    def stats(self):
+        return {
+            "symbols": self.index.size,
+            "connected": self.connected,
+            "loaded_at": self.loaded_at,
+            "build_seconds": self.build_seconds,
+            "notifications": self.notifications,
+            "rebuilds": self.rebuilds,
+            "searches": self.searches,
+        }
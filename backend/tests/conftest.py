@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from helpers import DSN, SCHEMA, execute, run, start_worker
+
+
+def pytest_collection_modifyitems(config, items):
+    # Only tests on the database fixtures need a server; the rest always run.
+    if DSN:
+        return
+    skip = pytest.mark.skip(reason="set TEST_DATABASE_URL to run database tests")
+    for item in items:
+        if "database" in item.fixturenames:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # An empty base schema per test; the app creates everything else at
+    # startup, as it would against a fresh database.
+    monkeypatch.setenv("DATABASE_URL", DSN)
+    run(execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;"))
+    run(execute(SCHEMA.read_text()))
+    return DSN
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    monkeypatch.setenv("ADMISSION_CONTROL", "0")
+    with start_worker() as client:
+        yield client
+
+
+@pytest.fixture
+def other_client(client):
+    with start_worker() as other:
+        yield other
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import asyncpg
+
+SCHEMA = Path(__file__).resolve().parent.parent / "bench" / "schema.sql"
+
+# These tests run against a real database, which they drop and recreate:
+# point TEST_DATABASE_URL at a scratch database, never at one with data.
+DSN = os.getenv("TEST_DATABASE_URL")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def wait_for(condition, timeout=5.0):
+    # Cross-worker effects arrive over LISTEN a few milliseconds later.
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.02)
+
+
+async def execute(sql: str, *args):
+    db = await asyncpg.connect(DSN)
+    try:
+        return await db.execute(sql, *args)
+    finally:
+        await db.close()
+
+
+async def fetch(sql: str, *args):
+    db = await asyncpg.connect(DSN)
+    try:
+        return await db.fetch(sql, *args)
+    finally:
+        await db.close()
+
+
+def seed_portfolio(client, cash=1000, holdings=(), prices=None):
+    # One user and portfolio with the given cash and (symbol, shares)
+    # holdings. AAPL trades at 10.00 unless prices says otherwise; NOPRICE
+    # is listed but never traded.
+    async def seed():
+        db = await asyncpg.connect(DSN)
+        try:
+            async with db.transaction():
+                await db.execute("INSERT INTO users (username, password) VALUES ('trader', 'x')")
+                await db.execute("INSERT INTO stocks VALUES ('AAPL', 'Apple'), ('MSFT', 'Microsoft'), ('NOPRICE', 'No Price Inc')")
+                portfolio_id = await db.fetchval(
+                    "INSERT INTO portfolios (name, user_id, cash_balance) VALUES ('main', 1, $1) RETURNING portfolio_id",
+                    cash
+                )
+                for symbol, shares in holdings:
+                    await db.execute("INSERT INTO portfolioholdings VALUES ($1, $2, $3)", portfolio_id, symbol, shares)
+            return portfolio_id
+        finally:
+            await db.close()
+    portfolio_id = run(seed())
+    for symbol, close in (prices or {"AAPL": 10}).items():
+        response = client.post(
+            "/stock/add-price",
+            json={"stock_symbol": symbol, "open": close, "high": close, "low": close, "close": close, "volume": 100}
+        )
+        assert response.status_code == 200
+    return portfolio_id
+
+
+def portfolio_state(portfolio_id):
+    cash = run(fetch("SELECT cash_balance FROM portfolios WHERE portfolio_id = $1", portfolio_id))[0]["cash_balance"]
+    holdings = run(fetch("SELECT stock_symbol, shares FROM portfolioholdings WHERE portfolio_id = $1", portfolio_id))
+    transactions = run(fetch("SELECT count(*) FROM transactions WHERE portfolio_id = $1", portfolio_id))[0]["count"]
+    return float(cash), {row["stock_symbol"]: row["shares"] for row in holdings}, transactions
+
+
+def start_worker():
+    # A TestClient over a fresh app: one more worker on the same database.
+    from fastapi.testclient import TestClient
+    from main import create_app
+
+    return TestClient(create_app("lazy"))
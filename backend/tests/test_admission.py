@@ -0,0 +1,29 @@
+import asyncio
+
+from admission import AdmissionControl, CostClass
+from helpers import run
+
+
+def test_transaction_export_is_not_a_heavy_request():
+    admission = AdmissionControl.from_env()
+
+    assert admission.classify("/portfolio/user-transactions/stream") == "streaming"
+    assert admission.classes["streaming"].concurrency == 0
+    assert admission.classify("/portfolio/1/stats") == "heavy"
+
+
+def test_unlimited_class_admits_every_request():
+    async def admit():
+        cost_class = CostClass("streaming", concurrency=0, queue=0, rate=1.0, burst=5, max_wait=0.1)
+        await asyncio.gather(*(cost_class.acquire() for _ in range(20)))
+        active = cost_class.active
+        for _ in range(20):
+            cost_class.release()
+        return active, cost_class.stats()
+
+    active, stats = run(admit())
+
+    assert active == 20
+    assert stats["active"] == 0
+    assert stats["admitted"] == 20
+    assert stats["saturated"] == 0
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from helpers import run
+from pricefeed import PriceFeed
+from routes.pricestream import stream_prices_sse
+
+
+def test_unsent_stream_leaves_no_subscription():
+    feed = PriceFeed(None, None, None)
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace()))
+
+    response = run(stream_prices_sse(request, "AAPL,MSFT", price_cache=None, feed=feed))
+
+    # The client went away before the first chunk: the body is never read.
+    assert response.media_type == "text/event-stream"
+    assert feed.stats()["symbols"] == 0
+
+
+def test_too_many_symbols_is_rejected_up_front():
+    feed = PriceFeed(None, None, None, max_symbols=1)
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace()))
+
+    with pytest.raises(HTTPException) as error:
+        run(stream_prices_sse(request, "AAPL,MSFT", price_cache=None, feed=feed))
+
+    assert error.value.status_code == 400
+    assert error.value.detail == "At most 1 symbols per subscription"
+    assert feed.stats()["symbols"] == 0
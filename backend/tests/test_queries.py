@@ -0,0 +1,18 @@
+import asyncpg
+
+import queries
+from helpers import DSN, run
+
+
+async def warmed_connection_state():
+    db = await asyncpg.connect(DSN)
+    try:
+        await queries.init_connection(db)
+        async with db.transaction(isolation="repeatable_read", readonly=True):
+            return await db.fetchval("SELECT current_setting('transaction_isolation')")
+    finally:
+        await db.close()
+
+
+def test_warmed_connection_can_start_any_transaction(client):
+    assert run(warmed_connection_state()) == "repeatable read"
@@ -0,0 +1,71 @@
+import pytest
+
+from helpers import portfolio_state, seed_portfolio
+from rebalance import plan_rebalance
+
+
+def test_rebalance_buys_whole_shares_within_cash(client):
+    portfolio_id = seed_portfolio(client, cash=1000, prices={"AAPL": 10, "MSFT": 30})
+
+    response = client.post(f"/portfolio/{portfolio_id}/rebalance", json={"weights": {"AAPL": 0.5, "MSFT": 0.5}})
+
+    assert response.status_code == 200
+    plan = response.json()
+    assert {trade["stock_symbol"]: trade["shares"] for trade in plan["trades"]} == {"AAPL": 50, "MSFT": 16}
+    assert plan["estimated_cash_after"] == 20.0
+    assert portfolio_state(portfolio_id) == (20.0, {"AAPL": 50, "MSFT": 16}, 2)
+
+
+@pytest.mark.parametrize("price", [0, -5])
+def test_rebalance_rejects_unusable_prices(client, price):
+    portfolio_id = seed_portfolio(client, cash=1000, holdings=[("MSFT", 3)], prices={"AAPL": 10, "MSFT": price})
+
+    response = client.post(f"/portfolio/{portfolio_id}/rebalance", json={"weights": {"AAPL": 1.0}})
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Unusable price for: MSFT"
+    assert portfolio_state(portfolio_id) == (1000.0, {"MSFT": 3}, 0)
+
+
+def test_rebalance_rejects_non_finite_weights(client):
+    portfolio_id = seed_portfolio(client, cash=1000)
+
+    response = client.post(
+        f"/portfolio/{portfolio_id}/rebalance",
+        content='{"weights": {"AAPL": NaN}}',
+        headers={"content-type": "application/json"}
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Weights must be finite"
+
+
+def test_fully_invested_rebalance_allows_for_rounding_to_cents(client):
+    # Each buy of 10 shares at 1.0005 is charged 10.01, so both cannot fit
+    # in 20.01 even though their exact costs do.
+    portfolio_id = seed_portfolio(client, cash=20.01, prices={"AAPL": 1.0005, "MSFT": 1.0005})
+
+    response = client.post(f"/portfolio/{portfolio_id}/rebalance", json={"weights": {"AAPL": 0.5, "MSFT": 0.5}})
+
+    assert response.status_code == 200
+    plan = response.json()
+    assert {trade["stock_symbol"]: trade["shares"] for trade in plan["trades"]} == {"AAPL": 10, "MSFT": 9}
+    assert plan["estimated_cash_after"] == 1.0
+    assert portfolio_state(portfolio_id) == (1.0, {"AAPL": 10, "MSFT": 9}, 2)
+
+
+def test_weight_symbols_are_case_insensitive(client):
+    portfolio_id = seed_portfolio(client, cash=100)
+
+    response = client.post(f"/portfolio/{portfolio_id}/rebalance", json={"weights": {" aapl": 1.0}, "dry_run": True})
+
+    assert response.status_code == 200
+    assert [trade["stock_symbol"] for trade in response.json()["trades"]] == ["AAPL"]
+
+
+def test_plan_buys_fit_in_cash_after_rounding():
+    plan = plan_rebalance(["A", "B"], [0, 0], [1.0005, 1.0005], [0.5, 0.5], 20.01)
+
+    assert [trade["shares"] for trade in plan["trades"]] == [10, 9]
+    assert [trade["estimated_value"] for trade in plan["trades"]] == [10.01, 9.0]
+    assert plan["estimated_cash_after"] == 1.0
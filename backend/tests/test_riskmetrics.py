@@ -0,0 +1,65 @@
+import asyncpg
+import numpy as np
+
+import queries
+from helpers import DSN, run
+from riskmetrics import RiskMetrics, compute_metrics
+
+
+def test_beta_of_a_doubled_benchmark_is_two():
+    returns = np.random.default_rng(7).normal(0, 0.01, 60)
+    benchmark = 100 * np.cumprod(1 + returns)
+    doubled = 100 * np.cumprod(1 + 2 * returns)
+
+    metrics = compute_metrics(np.column_stack([doubled, benchmark]), benchmark_col=1)
+
+    assert np.allclose(metrics["beta"], [2.0, 1.0])
+    assert list(metrics["observations"]) == [59, 59]
+
+
+def test_numpy_pass_runs_outside_a_transaction(client, monkeypatch):
+    async def compute():
+        db = await asyncpg.connect(DSN)
+        try:
+            await queries.init_connection(db)
+            await db.execute("INSERT INTO stocks VALUES ('SPY', 'Index')")
+            await db.executemany(
+                "INSERT INTO stockpricerollups (symbol, resolution, bucket, close, close_sum, bar_count) "
+                "VALUES ('SPY', 'day', current_date - $1::int, $2, $2, 1)",
+                [(day, 100.0 + day % 7) for day in range(40)]
+            )
+            states = []
+            original = RiskMetrics._compute
+
+            def record(self, rows, benchmark_col):
+                states.append(db.is_in_transaction())
+                return original(self, rows, benchmark_col)
+
+            monkeypatch.setattr(RiskMetrics, "_compute", record)
+            result = await RiskMetrics(benchmark="SPY").compute(db, force=True)
+            locks = await db.fetchval("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'")
+            return result, states, locks
+        finally:
+            await db.close()
+
+    result, states, locks = run(compute())
+
+    assert result["symbols"] == 1
+    assert states == [False]
+    assert locks == 0
+
+
+def test_refresh_needs_a_login_and_keeps_a_fresh_snapshot(client):
+    assert client.post("/stock/risk-metrics/refresh").status_code == 401
+
+    response = client.post(
+        "/stock/add-price", json={"stock_symbol": "SPY", "open": 1, "high": 1, "low": 1, "close": 1, "volume": 1}
+    )
+    assert response.status_code == 200
+    token = client.post("/register", json={"username": "analyst", "password": "secret"}).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    first = client.post("/stock/risk-metrics/refresh", headers=headers)
+    second = client.post("/stock/risk-metrics/refresh", headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["skipped"] == "computed recently"
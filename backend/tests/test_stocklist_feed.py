@@ -0,0 +1,96 @@
+import base64
+import json
+
+import asyncpg
+import pytest
+
+import queries
+from helpers import DSN, run, seed_portfolio, wait_for
+
+
+def cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def feed(client, **params):
+    response = client.get("/stocklists/public-feed", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def create_list(client, name="picks"):
+    response = client.post("/create-stocklist", json={"name": name, "is_public": True, "creator_id": 1})
+    return response.json()["stocklist_id"]
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("newest", ["1"]),
+    ("newest", [True]),
+    ("newest", [1.5]),
+    ("most_reviewed", ["3", 1]),
+    ("most_reviewed", [3, None]),
+    ("highest_value", [float("nan"), 1]),
+    ("highest_value", [{"a": 1}, 1]),
+])
+def test_malformed_cursor_is_400(client, sort, key):
+    response = client.get("/stocklists/public-feed", params={"sort": sort, "cursor": cursor(key)})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_feed_pages_with_cursor(client):
+    seed_portfolio(client)
+    ids = [create_list(client, f"list {i}") for i in range(3)]
+
+    first = feed(client, limit=2)
+    second = feed(client, limit=2, cursor=first["next_cursor"])
+
+    assert [row["stocklist_id"] for row in first["stocklists"] + second["stocklists"]] == ids[::-1]
+    assert second["next_cursor"] is None
+
+
+def test_write_on_another_worker_reaches_the_feed(client, other_client):
+    seed_portfolio(client)
+    wait_for(lambda: client.app.state.stocklist_feed.listening and other_client.app.state.stocklist_feed.listening)
+    stocklist_id = create_list(client)
+    assert feed(client)["stocklists"][0]["review_count"] == 0
+
+    response = other_client.post("/create-review", json={"reviewer_id": 1, "stocklist_id": stocklist_id, "content": "ok"})
+    assert response.status_code == 200
+
+    wait_for(lambda: feed(client)["stocklists"][0]["review_count"] == 1)
+
+
+def test_invalidation_during_a_reload_is_kept(client, monkeypatch):
+    seed_portfolio(client)
+    stocklist_id = create_list(client)
+    wait_for(lambda: client.app.state.stocklist_feed.listening)
+    stocklist_feed = client.app.state.stocklist_feed
+    feed(client)
+
+    # A review lands while the feed is reloading the list: the reload may
+    # not have seen it, so the list must stay marked.
+    summaries = queries.public_stocklist_summaries
+
+    async def reload_then_write(db, ids):
+        rows = await summaries(db, ids)
+        await db.execute("INSERT INTO reviews (reviewer_id, stocklist_id, content) VALUES (1, $1, 'late')", stocklist_id)
+        stocklist_feed._on_changed([stocklist_id])
+        return rows
+
+    async def sync():
+        db = await asyncpg.connect(DSN)
+        try:
+            await queries.init_connection(db)
+            monkeypatch.setattr(queries, "public_stocklist_summaries", reload_then_write)
+            stocklist_feed._on_changed([stocklist_id])
+            await stocklist_feed._sync(db)
+            monkeypatch.setattr(queries, "public_stocklist_summaries", summaries)
+            assert stocklist_feed._stale == {stocklist_id}
+            await stocklist_feed._sync(db)
+        finally:
+            await db.close()
+
+    run(sync())
+    assert stocklist_feed._lists[stocklist_id]["review_count"] == 1
@@ -0,0 +1,165 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from events import EventBus
+from helpers import DSN, execute, fetch, run, start_worker, wait_for
+from storage import COMPACTION_LOCK, PriceStorage, add_months, month_start, partition_name, week_start
+
+
+async def insert_bars(db, *timestamps):
+    await db.executemany(
+        "INSERT INTO stockpricehistory (symbol, the_timestamp, close) VALUES ('AAPL', $1, 10)",
+        [(the_timestamp,) for the_timestamp in timestamps]
+    )
+
+
+async def relkind():
+    return (await fetch("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('stockpricehistory')"))[0]["relkind"]
+
+
+def test_conversion_is_idempotent_and_keeps_rows(database):
+    async def convert_twice():
+        db = await asyncpg.connect(DSN)
+        try:
+            await insert_bars(db, datetime(2020, 1, 2), datetime(2020, 3, 4))
+            await PriceStorage(EventBus(DSN)).setup(db)
+            await PriceStorage(EventBus(DSN)).setup(db)
+            return await db.fetchval("SELECT count(*) FROM stockpricehistory")
+        finally:
+            await db.close()
+
+    assert run(convert_twice()) == 2
+    assert run(relkind()) == "p"
+    legacy = run(fetch("SELECT count(*) FROM stockpricehistory_legacy"))[0]["count"]
+    assert legacy == 2
+
+
+def test_workers_starting_together_partition_once(database, monkeypatch):
+    monkeypatch.setenv("ADMISSION_CONTROL", "0")
+
+    async def seed():
+        db = await asyncpg.connect(DSN)
+        try:
+            await insert_bars(db, datetime(2020, 1, 2))
+        finally:
+            await db.close()
+    run(seed())
+
+    barrier = threading.Barrier(2)
+    statuses, errors = [], []
+
+    def worker():
+        try:
+            barrier.wait()
+            with start_worker() as client:
+                statuses.append(client.get("/stock/storage/stats").status_code)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert statuses == [200, 200]
+    assert run(relkind()) == "p"
+    assert run(fetch("SELECT count(*) FROM stockpricehistory"))[0]["count"] == 1
+
+
+def compaction_dates():
+    # Relative to today, since startup creates partitions from this month on:
+    # the first month is wholly before the cutoff, the raw horizon is two
+    # months on and the cutoff is the Monday on or before it.
+    first = month_start(datetime.now())
+    now = add_months(first, 3) + timedelta(days=14)
+    horizon = add_months(first, 2)
+    return first, now, horizon, week_start(horizon)
+
+
+def test_compaction_at_the_horizon_boundary(client):
+    first, now, horizon, cutoff = compaction_dates()
+
+    async def compact():
+        db = await asyncpg.connect(DSN)
+        try:
+            storage = PriceStorage(EventBus(DSN), raw_retention_months=1, daily_retention_months=1)
+            await storage.setup(db)
+            await storage.ensure_partitions(db, first, now)
+            await insert_bars(
+                db, first + timedelta(days=10), cutoff - timedelta(hours=1), cutoff, horizon - timedelta(hours=1), horizon
+            )
+            await db.executemany(
+                "INSERT INTO stockpricerollups (symbol, resolution, bucket, close_sum, bar_count) "
+                "VALUES ('AAPL', 'day', $1, 10, 1)",
+                [((cutoff - timedelta(days=1)).date(),), (cutoff.date(),)]
+            )
+            return storage, await storage.compact(db, now=now)
+        finally:
+            await db.close()
+
+    storage, result = run(compact())
+
+    assert partition_name(first) in result["dropped_partitions"]
+    assert result["raw_rows_deleted"] >= 1
+    remaining = run(fetch("SELECT the_timestamp FROM stockpricehistory ORDER BY the_timestamp"))
+    assert [row["the_timestamp"] for row in remaining] == [cutoff, horizon - timedelta(hours=1), horizon]
+    days = run(fetch("SELECT bucket FROM stockpricerollups WHERE resolution = 'day' ORDER BY bucket"))
+    assert [row["bucket"] for row in days] == [cutoff.date()]
+    assert storage.raw_horizon == horizon
+    assert not storage.accepts(horizon - timedelta(microseconds=1))
+    assert storage.accepts(horizon)
+
+
+def test_skipped_compaction_reloads_the_leaders_horizons(client):
+    first, now, horizon, cutoff = compaction_dates()
+
+    async def compact():
+        leader = PriceStorage(EventBus(DSN), raw_retention_months=1)
+        follower = PriceStorage(EventBus(DSN), raw_retention_months=1)
+        db = await asyncpg.connect(DSN)
+        holder = await asyncpg.connect(DSN)
+        try:
+            await leader.setup(db)
+            await follower.setup(db)
+            await leader.compact(db, now=now)
+            async with holder.transaction():
+                await holder.execute("SELECT pg_advisory_xact_lock($1)", COMPACTION_LOCK)
+                result = await follower.compact(db, now=now)
+            return leader, follower, result
+        finally:
+            await holder.close()
+            await db.close()
+
+    leader, follower, result = run(compact())
+
+    assert result["skipped"]
+    assert follower.raw_horizon == leader.raw_horizon == horizon
+    assert first not in follower._months
+
+
+def test_compaction_broadcast_reloads_other_workers(client):
+    storage = client.app.state.price_storage
+    horizon = datetime(2020, 1, 1)
+    # Let the reload that follows the bus connecting go by first.
+    wait_for(lambda: client.app.state.event_bus.connected and not storage._compacted_elsewhere.is_set())
+    time.sleep(0.2)
+    assert storage.raw_horizon is None
+
+    run(execute("INSERT INTO pricecompaction VALUES ('raw', $1)", horizon))
+    run(execute("""SELECT pg_notify('price_storage', '{"origin":"elsewhere","messages":["compacted"]}')"""))
+
+    wait_for(lambda: storage.raw_horizon == horizon)
+
+
+def test_compaction_is_not_exposed_over_http(client):
+    assert client.post("/stock/storage/compact").status_code in (404, 405)
+
+    response = client.get("/stock/storage/stats")
+    assert response.status_code == 200
+    assert response.json()["partitioned"]
+    assert any(partition["name"] == "stockpricehistory_legacy" for partition in response.json()["partitions"])
@@ -0,0 +1,76 @@
+import asyncpg
+
+import queries
+from helpers import DSN, portfolio_state, run, seed_portfolio
+
+
+async def trade(portfolio_id, symbols, shares, prices):
+    db = await asyncpg.connect(DSN)
+    try:
+        await queries.init_connection(db)
+        return [dict(row) for row in await queries.execute_trades(db, portfolio_id, symbols, shares, prices)]
+    finally:
+        await db.close()
+
+
+def test_oversold_position_is_rejected_without_writes(client):
+    portfolio_id = seed_portfolio(client, cash=1000, holdings=[("AAPL", 5)])
+
+    [row] = run(trade(portfolio_id, ["AAPL"], [-10], [10.0]))
+
+    assert row["outcome"] == "rejected"
+    assert row["reason"] == "Insufficient shares to sell"
+    assert portfolio_state(portfolio_id) == (1000.0, {"AAPL": 5}, 0)
+
+
+def test_batch_rejects_only_the_oversold_order(client):
+    portfolio_id = seed_portfolio(client, cash=1000, holdings=[("AAPL", 5)])
+
+    response = client.post(
+        f"/portfolio/{portfolio_id}/orders",
+        json={"orders": [{"stock_symbol": "AAPL", "shares": -5}, {"stock_symbol": "AAPL", "shares": -1}]}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == ["filled", "rejected"]
+    assert body["results"][1]["detail"] == "Insufficient shares to sell"
+    assert portfolio_state(portfolio_id) == (1050.0, {}, 1)
+
+
+def test_selling_a_whole_position_removes_the_holding(client):
+    portfolio_id = seed_portfolio(client, cash=1000, holdings=[("AAPL", 5)])
+
+    response = client.post(
+        "/portfolio/transaction",
+        json={"portfolio_id": portfolio_id, "stock_symbol": "AAPL", "shares": -5, "price_per_share": 0}
+    )
+
+    assert response.status_code == 200
+    assert portfolio_state(portfolio_id) == (1050.0, {}, 1)
+
+
+def test_missing_portfolio_returns_no_rows(client):
+    seed_portfolio(client)
+
+    assert run(trade(999, ["AAPL"], [1], [10.0])) == []
+
+    response = client.post(
+        "/portfolio/transaction",
+        json={"portfolio_id": 999, "stock_symbol": "AAPL", "shares": 1, "price_per_share": 0}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Portfolio not found"
+
+
+def test_missing_price_is_404_and_leaves_the_portfolio_alone(client):
+    portfolio_id = seed_portfolio(client, cash=1000)
+
+    response = client.post(
+        "/portfolio/transaction",
+        json={"portfolio_id": portfolio_id, "stock_symbol": "NOPRICE", "shares": 1, "price_per_share": 0}
+    )
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Stock price not found"
+    assert portfolio_state(portfolio_id) == (1000.0, {}, 0)
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import asyncpg
+import pytest
+
+import queries
+from helpers import DSN, run, seed_portfolio
+from routes.portfolioholdings import HeldConnectionResponse
+from starlette.requests import ClientDisconnect
+
+
+def test_export_streams_rows_and_returns_its_connection(client):
+    portfolio_id = seed_portfolio(client, cash=1000)
+    for _ in range(3):
+        response = client.post(
+            "/portfolio/transaction",
+            json={"portfolio_id": portfolio_id, "stock_symbol": "AAPL", "shares": 1, "price_per_share": 0}
+        )
+        assert response.status_code == 200
+    pool = client.app.state.pool
+
+    response = client.get("/portfolio/user-transactions/stream?user_id=1")
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 3
+    assert pool.get_idle_size() == pool.get_size()
+
+
+def test_export_is_503_when_the_pool_is_starved(client):
+    state = client.app.state
+    state.pool_acquire_timeout = 0.1
+    held = [client.portal.call(state.pool.acquire) for _ in range(state.pool.get_max_size())]
+    timeouts = state.metrics.acquire_timeouts
+    try:
+        response = client.get("/portfolio/user-transactions/stream?user_id=1")
+    finally:
+        for connection in held:
+            client.portal.call(state.pool.release, connection)
+
+    assert response.status_code == 503
+    assert state.metrics.acquire_timeouts == timeouts + 1
+
+
+def test_idle_export_transaction_is_ended_by_the_server(database):
+    async def idle():
+        db = await asyncpg.connect(DSN)
+        try:
+            async with db.transaction(readonly=True):
+                await queries.set_transaction_timeouts(db, 1000, 200)
+                await asyncio.sleep(0.5)
+                await db.fetchval("SELECT 1")
+        finally:
+            await db.close()
+
+    with pytest.raises((asyncpg.PostgresError, asyncpg.InterfaceError, ConnectionError)):
+        run(idle())
+
+
+def test_connection_is_released_when_the_client_leaves_before_the_body():
+    started = []
+    released = []
+
+    async def body():
+        started.append(True)
+        yield "row\n"
+
+    class Pool:
+        async def release(self, connection):
+            released.append(connection)
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    response = HeldConnectionResponse(body(), Pool(), "connection", media_type="application/x-ndjson")
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        run(response(scope, receive, send))
+
+    assert started == []
+    assert released == ["connection"]
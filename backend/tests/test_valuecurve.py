@@ -0,0 +1,56 @@
+import asyncio
+
+import asyncpg
+import numpy as np
+
+import queries
+from helpers import DSN, run, seed_portfolio
+from statsengine import StatsEngine
+from valuecurve import ValueCurveEngine
+
+
+async def curves(portfolio_id, engine, concurrent):
+    pool = await asyncpg.create_pool(DSN, init=queries.init_connection, min_size=concurrent, max_size=concurrent)
+    try:
+        async def curve():
+            async with pool.acquire() as db:
+                return await engine.curve(db, portfolio_id)
+        return await asyncio.gather(*(curve() for _ in range(concurrent)))
+    finally:
+        await pool.close()
+
+
+async def buy(portfolio_id, shares, days_ago):
+    # Backdated, so a double-applied trade shows in the days before today
+    # and is not simply overwritten by reconciling today's balances.
+    db = await asyncpg.connect(DSN)
+    try:
+        await queries.init_connection(db)
+        [row] = await queries.execute_trades(db, portfolio_id, ["AAPL"], [shares], [10.0])
+        assert row["outcome"] == "filled"
+        await db.execute(
+            "UPDATE transactions SET the_timestamp = now() - make_interval(days => $1) "
+            "WHERE transaction_id = (SELECT max(transaction_id) FROM transactions)",
+            days_ago
+        )
+    finally:
+        await db.close()
+
+
+def test_concurrent_curves_apply_new_transactions_once(client):
+    portfolio_id = seed_portfolio(client, cash=1000)
+    run(buy(portfolio_id, 10, days_ago=20))
+    engine = ValueCurveEngine(StatsEngine())
+    run(curves(portfolio_id, engine, 1))
+
+    run(buy(portfolio_id, 5, days_ago=10))
+    results = run(curves(portfolio_id, engine, 4))
+
+    ledger = engine._ledgers[portfolio_id]
+    assert ledger.positions[-1][ledger.columns["AAPL"]] == 15
+    assert ledger.cash[-1] == 850
+    [fresh] = run(curves(portfolio_id, ValueCurveEngine(StatsEngine()), 1))
+    for days, cash, market_value in results:
+        assert days == fresh[0]
+        np.testing.assert_allclose(cash, fresh[1])
+        np.testing.assert_allclose(market_value, fresh[2])
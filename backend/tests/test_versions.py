@@ -0,0 +1,99 @@
+from events import EventBus
+from helpers import seed_portfolio, wait_for
+from pricecache import LatestPriceCache
+from versions import DataVersions
+
+
+def listening(*clients):
+    return lambda: all(client.app.state.versions.listening for client in clients)
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={"If-None-Match": etag}).status_code
+
+
+def test_bump_on_one_worker_moves_tags_on_another(client, other_client):
+    seed_portfolio(client)
+    wait_for(listening(client, other_client))
+    url = "/get-stocklists?user_id=1"
+    etag = client.get(url).headers["ETag"]
+    assert revalidate(client, url, etag) == 304
+
+    response = other_client.post("/create-stocklist", json={"name": "picks", "is_public": True, "creator_id": 1})
+    assert response.status_code == 200
+
+    wait_for(lambda: revalidate(client, url, etag) == 200)
+
+
+def test_portfolio_bump_reaches_owner_lists_on_other_workers(client, other_client):
+    portfolio_id = seed_portfolio(client)
+    wait_for(listening(client, other_client))
+    url = "/portfolios?user_id=1"
+    etag = client.get(url).headers["ETag"]
+    assert revalidate(client, url, etag) == 304
+
+    response = other_client.post(
+        "/portfolio/transaction",
+        json={"portfolio_id": portfolio_id, "stock_symbol": "AAPL", "shares": 1, "price_per_share": 0}
+    )
+    assert response.status_code == 200
+
+    wait_for(lambda: revalidate(client, url, etag) == 200)
+
+
+def test_no_304_while_disconnected_and_new_epoch_after(client):
+    seed_portfolio(client)
+    wait_for(listening(client))
+    versions = client.app.state.versions
+    url = "/get-stocklists?user_id=1"
+    etag = client.get(url).headers["ETag"]
+
+    versions._lost()
+    assert revalidate(client, url, etag) == 200
+
+    versions._connected()
+    assert revalidate(client, url, etag) == 200
+    assert revalidate(client, url, client.get(url).headers["ETag"]) == 304
+
+
+def detached_versions():
+    # Never connected: publishes queue in the bus's outbox.
+    return DataVersions(LatestPriceCache(), EventBus(None))
+
+
+def test_tags_are_not_confirmed_until_the_listener_connects():
+    versions = detached_versions()
+    assert not versions.confirms([("stocklist", 1)])
+
+    versions._connected()
+    assert versions.confirms([("stocklist", 1)])
+    # Prices are only confirmed by a listening price cache.
+    assert not versions.confirms([("prices",), ("stocklist", 1)])
+    versions.price_cache.listening = True
+    assert versions.confirms([("prices",), ("stocklist", 1)])
+
+    versions._lost()
+    assert not versions.confirms([("stocklist", 1)])
+
+
+def test_reconnect_starts_a_new_epoch():
+    versions = detached_versions()
+    versions._connected()
+    before = versions.etag("stocklist", [("stocklist", 1)])
+
+    versions._lost()
+    versions._connected()
+
+    assert versions.etag("stocklist", [("stocklist", 1)]) != before
+
+
+def test_remote_portfolio_bump_moves_the_known_owners_list():
+    versions = detached_versions()
+    versions.remember_owner(7, 3)
+
+    versions._on_bumps([{"portfolio": 7}, {"portfolio": 8}, {"keys": [["stocklist", 1]]}])
+
+    assert versions.get(("portfolio", 7)) == 1
+    assert versions.get(("user_portfolios", 3)) == 1
+    assert versions.get(("portfolio", 8)) == 1
+    assert versions.get(("stocklist", 1)) == 1
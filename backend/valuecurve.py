@@ -0,0 +1,177 @@
+import asyncio
+import os
+import weakref
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+import queries
+from statsengine import EPOCH, day_number
+
+
+class PortfolioLedger:
+    # Step function of a portfolio's state: row i holds the shares per symbol
+    # and the cash balance from days[i] until the next row.
+    def __init__(self, start: int, symbols, positions, cash: float):
+        self.start = start
+        self.symbols = list(symbols)
+        self.columns = {symbol: col for col, symbol in enumerate(self.symbols)}
+        self.days = np.array([start - 1], dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(1, -1)
+        self.cash = np.array([cash], dtype=np.float64)
+        self.last_transaction_id = 0
+
+    def add_symbols(self, symbols):
+        new = [symbol for symbol in symbols if symbol not in self.columns]
+        if not new:
+            return
+        for symbol in new:
+            self.columns[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self.positions = np.hstack([self.positions, np.zeros((len(self.days), len(new)))])
+
+    def _append(self, days, positions, cash):
+        # A day already at the end is overwritten with its later state.
+        if days[0] == self.days[-1]:
+            self.days, self.positions, self.cash = self.days[:-1], self.positions[:-1], self.cash[:-1]
+        self.days = np.concatenate([self.days, days])
+        self.positions = np.vstack([self.positions, positions])
+        self.cash = np.concatenate([self.cash, cash])
+
+    def apply(self, ledger):
+        if not ledger:
+            return
+        self.add_symbols(row["stock_symbol"] for row in ledger)
+        # Rows only ever extend the curve; anything stamped earlier than the
+        # last known state is booked on that state's day.
+        days, inverse = np.unique(
+            np.maximum([day_number(row["the_timestamp"]) for row in ledger], self.days[-1]),
+            return_inverse=True
+        )
+        cols = np.array([self.columns[row["stock_symbol"]] for row in ledger])
+        shares, cash = trade_deltas(ledger)
+
+        delta_positions = np.zeros((len(days), len(self.symbols)))
+        np.add.at(delta_positions, (inverse, cols), shares)
+        delta_cash = np.bincount(inverse, weights=cash, minlength=len(days))
+
+        self._append(
+            days,
+            self.positions[-1] + np.cumsum(delta_positions, axis=0),
+            self.cash[-1] + np.cumsum(delta_cash)
+        )
+        self.last_transaction_id = max(row["transaction_id"] for row in ledger)
+
+    def reconcile(self, holdings, cash: float, today: int):
+        # Deposits, withdrawals and transfers never reach the ledger; they
+        # show up as a gap between the replayed and the actual state, which
+        # is booked on the day it is first seen.
+        self.add_symbols(holdings)
+        actual = np.zeros(len(self.symbols))
+        for symbol, shares in holdings.items():
+            actual[self.columns[symbol]] = shares
+        if np.array_equal(actual, self.positions[-1]) and abs(cash - self.cash[-1]) < 0.005:
+            return
+        self._append(np.array([today], dtype=np.int64), actual.reshape(1, -1), np.array([cash]))
+
+
+class LedgerSnapshot:
+    # What curve() reads from a ledger, fixed while it still holds the lock.
+    def __init__(self, ledger):
+        self.start = ledger.start
+        self.symbols = list(ledger.symbols)
+        self.days = ledger.days
+        self.positions = ledger.positions
+        self.cash = ledger.cash
+
+
+def trade_deltas(ledger):
+    buys = np.array([row["trans_type"] == "buy" for row in ledger])
+    shares = np.array([row["shares"] for row in ledger], dtype=np.float64)
+    totals = np.array([row["total_price"] for row in ledger], dtype=np.float64)
+    sign = np.where(buys, 1.0, -1.0)
+    return sign * shares, -sign * totals
+
+
+# Daily portfolio value rebuilt from the transactions ledger. Each
+# portfolio's replayed state is cached and later calls only apply the
+# transactions added since, while prices come from the StatsEngine's
+# incrementally synced daily closes, so nothing is recomputed from
+# inception after the first call. Calls for the same portfolio take turns
+# bringing its ledger up to date, each from one snapshot of the balances and
+# the transactions, so no row is applied twice and no trade shows up in one
+# read but not the other.
+class ValueCurveEngine:
+    def __init__(self, stats_engine, cache_size=256):
+        self.stats_engine = stats_engine
+        self.cache_size = cache_size
+        self._ledgers = OrderedDict()
+        self._locks = weakref.WeakValueDictionary()
+
+    @classmethod
+    def from_env(cls, stats_engine):
+        return cls(stats_engine, cache_size=int(os.getenv("VALUE_CURVE_CACHE_SIZE", "256")))
+
+    async def _ledger(self, db, portfolio_id: int, cash: float, holdings):
+        today = day_number(date.today())
+        ledger = self._ledgers.get(portfolio_id)
+        if ledger is None:
+            rows = await queries.ledger_since(db, portfolio_id, 0)
+            # The state before the first transaction is whatever makes the
+            # replay land on today's balances.
+            shares, cash_deltas = trade_deltas(rows) if rows else ([], [])
+            initial = dict(holdings)
+            for row, delta in zip(rows, shares):
+                initial[row["stock_symbol"]] = initial.get(row["stock_symbol"], 0) - delta
+            symbols = sorted(initial)
+            start = day_number(rows[0]["the_timestamp"]) if rows else today
+            ledger = PortfolioLedger(
+                start, symbols, [initial[symbol] for symbol in symbols], cash - float(np.sum(cash_deltas))
+            )
+        else:
+            rows = await queries.ledger_since(db, portfolio_id, ledger.last_transaction_id)
+
+        ledger.apply(rows)
+        ledger.reconcile(holdings, cash, today)
+
+        self._ledgers[portfolio_id] = ledger
+        self._ledgers.move_to_end(portfolio_id)
+        while len(self._ledgers) > self.cache_size:
+            self._ledgers.popitem(last=False)
+        return ledger
+
+    async def curve(self, db, portfolio_id: int):
+        lock = self._locks.get(portfolio_id)
+        if lock is None:
+            lock = self._locks[portfolio_id] = asyncio.Lock()
+        async with lock:
+            async with db.transaction(isolation="repeatable_read", readonly=True):
+                portfolio = await queries.get_cash_balance(db, portfolio_id)
+                if portfolio is None:
+                    return None
+                holdings = {row["stock_symbol"]: row["shares"] for row in await queries.list_holdings(db, portfolio_id)}
+                ledger = await self._ledger(db, portfolio_id, float(portfolio["cash_balance"]), holdings)
+            # The ledger's arrays are replaced, never changed in place, but
+            # its symbol list grows in place.
+            ledger = LedgerSnapshot(ledger)
+        series = await self.stats_engine.daily_series(db, ledger.symbols)
+
+        # Every trading day of any symbol held, plus the days the state
+        # changed and today, from the first transaction on.
+        today = np.array([day_number(date.today())], dtype=np.int64)
+        axis = np.unique(np.concatenate([days for days, _ in series.values()] + [ledger.days, today]))
+        axis = axis[axis >= ledger.start]
+
+        prices = np.full((len(axis), len(ledger.symbols)), np.nan)
+        for col, symbol in enumerate(ledger.symbols):
+            days, closes = series[symbol]
+            if not len(days):
+                continue
+            idx = np.searchsorted(days, axis, side="right") - 1
+            prices[idx >= 0, col] = closes[idx[idx >= 0]]
+
+        state = np.searchsorted(ledger.days, axis, side="right") - 1
+        market_value = np.nansum(ledger.positions[state] * prices, axis=1)
+        cash = ledger.cash[state]
+        return [EPOCH + timedelta(days=int(day)) for day in axis], cash, market_value
@@ -0,0 +1,109 @@
+import secrets
+
+from fastapi import Depends, HTTPException, Request, Response
+
+
+CHANNEL = "data_versions"
+
+
+# Per-entity version counters, bumped by the write routes, that read routes
+# turn into ETags. A matching If-None-Match is answered with 304 before the
+# route acquires a connection or runs its query. Counters live in each
+# process and every bump is broadcast on the event bus, so a write on one
+# worker moves the tags served by all of them. Bumps sent while a worker's
+# listener is down are lost to it: it answers no 304 until it reconnects,
+# and then starts a new epoch, which every tag carries, so no tag issued
+# before can match again.
+class DataVersions:
+    def __init__(self, price_cache, bus):
+        self.price_cache = price_cache
+        self.bus = bus
+        self.epoch = secrets.token_hex(4)
+        self.listening = False
+        self._versions = {}
+        self._owners = {}
+        self.not_modified = 0
+        bus.subscribe(CHANNEL, self._on_bumps)
+        bus.on_connect(self._connected)
+        bus.on_lost(self._lost)
+
+    def _connected(self):
+        self.epoch = secrets.token_hex(4)
+        self.listening = True
+
+    def _lost(self):
+        self.listening = False
+
+    def get(self, key):
+        if key == ("prices",):
+            return self.price_cache.version
+        return self._versions.get(key, 0)
+
+    def confirms(self, keys):
+        # Whether an unchanged tag over keys proves the data is unchanged.
+        if ("prices",) in keys and not self.price_cache.listening:
+            return False
+        return self.listening
+
+    def _bump(self, keys):
+        for key in keys:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def bump(self, *keys):
+        self._bump(keys)
+        self.bus.publish(CHANNEL, {"keys": keys})
+
+    def remember_owner(self, portfolio_id: int, user_id: int):
+        self._owners[portfolio_id] = user_id
+
+    def _bump_portfolio(self, portfolio_id: int):
+        # A user's portfolio list shows each cash balance. Its owner is known
+        # whenever that list has been served from this process, and only
+        # then can a tag for it from here be outstanding.
+        self._bump([("portfolio", portfolio_id)])
+        user_id = self._owners.get(portfolio_id)
+        if user_id is not None:
+            self._bump([("user_portfolios", user_id)])
+
+    def bump_portfolio(self, portfolio_id: int):
+        self._bump_portfolio(portfolio_id)
+        self.bus.publish(CHANNEL, {"portfolio": portfolio_id})
+
+    def _on_bumps(self, messages):
+        for message in messages:
+            if "portfolio" in message:
+                self._bump_portfolio(message["portfolio"])
+            else:
+                self._bump(tuple(key) for key in message["keys"])
+
+    def etag(self, scope: str, keys):
+        return f'W/"{self.epoch}-{scope}-' + ".".join(str(self.get(key)) for key in keys) + '"'
+
+
+def _matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def versioned(scope: str, keys):
+    # keys(request) -> the version keys the response depends on, or None
+    # when the request cannot be tagged (e.g. a missing parameter, which
+    # the route will reject anyway).
+    def check(request: Request, response: Response):
+        try:
+            entity_keys = keys(request)
+        except (KeyError, ValueError):
+            return
+        versions = request.app.state.versions
+        etag = versions.etag(scope, entity_keys)
+        if versions.confirms(entity_keys) and _matches(request, etag):
+            versions.not_modified += 1
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return Depends(check)
+
+
+def query_int(request: Request, name: str):
+    return int(request.query_params[name])